@@ -20,6 +20,7 @@ if config.config_file_name is not None:
 # for 'autogenerate' support
 from app.db.base import Base
 from app.models.message import Message # Import models to register them
+from app.models.broadcast import Broadcast, BroadcastDelivery
 target_metadata = Base.metadata
 
 # other values from the config, defined by the needs of env.py,
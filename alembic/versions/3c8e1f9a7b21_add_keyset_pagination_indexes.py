@@ -0,0 +1,39 @@
+"""add keyset pagination indexes to messages
+
+Revision ID: 3c8e1f9a7b21
+Revises: ef52eb4f1f8f
+Create Date: 2026-10-18 10:12:40.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c8e1f9a7b21'
+down_revision: Union[str, None] = 'ef52eb4f1f8f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = {
+    'ix_messages_created_at_id': ['created_at', 'id'],
+    'ix_messages_status_created_at_id': ['status', 'created_at', 'id'],
+    'ix_messages_sender_created_at_id': ['sender', 'created_at', 'id'],
+    'ix_messages_recipient_id_created_at_id': ['recipient_id', 'created_at', 'id'],
+}
+
+
+def upgrade() -> None:
+    # Built concurrently so the messages table stays writable during the migration
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES.items():
+            op.create_index(name, 'messages', columns, unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name in INDEXES:
+            op.drop_index(name, table_name='messages', postgresql_concurrently=True, if_exists=True)
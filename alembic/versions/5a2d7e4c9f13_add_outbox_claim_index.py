@@ -0,0 +1,33 @@
+"""add outbox claim index to messages
+
+Revision ID: 5a2d7e4c9f13
+Revises: 3c8e1f9a7b21
+Create Date: 2026-10-18 11:03:17.502611
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a2d7e4c9f13'
+down_revision: Union[str, None] = '3c8e1f9a7b21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Small partial index over the rows outbox dispatchers claim from
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_outbox', 'messages', ['id'], unique=False,
+            postgresql_where=sa.text("status IN ('pending', 'sending')"),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_messages_outbox', table_name='messages', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,42 @@
+"""add priority to messages
+
+Revision ID: 8b4f2a6d1e57
+Revises: 5a2d7e4c9f13
+Create Date: 2026-10-18 11:48:02.731944
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b4f2a6d1e57'
+down_revision: Union[str, None] = '5a2d7e4c9f13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('messages', sa.Column('priority', sa.String(), nullable=False, server_default='normal'))
+    # Dispatchers claim each lane with ORDER BY id LIMIT n; (priority, id) serves
+    # that directly and replaces the id-only outbox index
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_outbox_priority', 'messages', ['priority', 'id'], unique=False,
+            postgresql_where=sa.text("status IN ('pending', 'sending')"),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index('ix_messages_outbox', table_name='messages', postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_outbox', 'messages', ['id'], unique=False,
+            postgresql_where=sa.text("status IN ('pending', 'sending')"),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index('ix_messages_outbox_priority', table_name='messages', postgresql_concurrently=True, if_exists=True)
+    op.drop_column('messages', 'priority')
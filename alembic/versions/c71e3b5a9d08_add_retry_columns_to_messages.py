@@ -0,0 +1,28 @@
+"""add retry columns to messages
+
+Revision ID: c71e3b5a9d08
+Revises: 8b4f2a6d1e57
+Create Date: 2026-10-18 13:20:45.906113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c71e3b5a9d08'
+down_revision: Union[str, None] = '8b4f2a6d1e57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('messages', sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('messages', sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('messages', 'next_attempt_at')
+    op.drop_column('messages', 'attempts')
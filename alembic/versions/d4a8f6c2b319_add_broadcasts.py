@@ -0,0 +1,59 @@
+"""add broadcasts
+
+Revision ID: d4a8f6c2b319
+Revises: c71e3b5a9d08
+Create Date: 2026-10-18 16:42:11.380257
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4a8f6c2b319'
+down_revision: Union[str, None] = 'c71e3b5a9d08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('broadcasts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('content', sa.JSON(), nullable=False),
+    sa.Column('recipient_type', sa.String(), nullable=False),
+    sa.Column('msg_type', sa.String(), nullable=False),
+    sa.Column('sender', sa.String(), nullable=False),
+    sa.Column('priority', sa.String(), server_default='bulk', nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('total', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('sent_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('failed_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('error_log', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_broadcasts_id'), 'broadcasts', ['id'], unique=False)
+    op.create_index(op.f('ix_broadcasts_status'), 'broadcasts', ['status'], unique=False)
+    op.create_table('broadcast_deliveries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('broadcast_id', sa.Integer(), nullable=False),
+    sa.Column('recipient_id', sa.String(), nullable=False),
+    sa.Column('status', sa.String(), server_default='pending', nullable=False),
+    sa.Column('feishu_message_id', sa.String(), nullable=True),
+    sa.Column('error_code', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['broadcast_id'], ['broadcasts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('broadcast_id', 'recipient_id', name='uq_broadcast_deliveries_recipient')
+    )
+    op.create_index('ix_broadcast_deliveries_broadcast_status_id', 'broadcast_deliveries', ['broadcast_id', 'status', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_broadcast_deliveries_broadcast_status_id', table_name='broadcast_deliveries')
+    op.drop_table('broadcast_deliveries')
+    op.drop_index(op.f('ix_broadcasts_status'), table_name='broadcasts')
+    op.drop_index(op.f('ix_broadcasts_id'), table_name='broadcasts')
+    op.drop_table('broadcasts')
@@ -0,0 +1,35 @@
+"""add upsert key to messages
+
+Revision ID: e5b9a7d3c410
+Revises: d4a8f6c2b319
+Create Date: 2026-10-18 17:35:52.114902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b9a7d3c410'
+down_revision: Union[str, None] = 'd4a8f6c2b319'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('messages', sa.Column('upsert_key', sa.String(), nullable=True))
+    # Partial: only group-buy cards sent in upsert mode carry a key
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_upsert_key', 'messages', ['upsert_key', 'id'], unique=False,
+            postgresql_where=sa.text('upsert_key IS NOT NULL'),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_messages_upsert_key', table_name='messages', postgresql_concurrently=True, if_exists=True)
+    op.drop_column('messages', 'upsert_key')
@@ -0,0 +1,67 @@
+import logging
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.database import get_db
+from app.core.config import settings
+from app.services.admission import AdmissionController, Overloaded
+from app.schemas.broadcast import BroadcastCreate, BroadcastResponse, BroadcastDeliveryResponse
+from app.services.broadcast_service import BroadcastService
+from app.services.message_service import MessageService
+from app.worker.dispatch import enqueue_broadcast
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+@router.post("/", response_model=BroadcastResponse)
+async def create_broadcast(broadcast_in: BroadcastCreate, db: AsyncSession = Depends(get_db)):
+    """
+    Send one message to many recipients. Stored as one broadcast plus one
+    delivery row per recipient and sent through Feishu's batch API where possible.
+    """
+    if not broadcast_in.recipient_ids:
+        raise HTTPException(status_code=400, detail="recipient_ids must not be empty")
+    if len(broadcast_in.recipient_ids) > settings.BROADCAST_MAX_RECIPIENTS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BROADCAST_MAX_RECIPIENTS} recipients per broadcast")
+
+    priority = broadcast_in.priority or MessageService.default_priority(broadcast_in.sender, fallback="bulk")
+    try:
+        await AdmissionController.check({priority})
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    # 1. Create the broadcast and its pending deliveries
+    broadcast = await BroadcastService.create_broadcast(db, broadcast_in, priority)
+
+    # 2. Trigger Async Task; if publishing fails the sweep picks the broadcast up
+    try:
+        enqueue_broadcast(broadcast.id)
+    except Exception as e:
+        logger.error(f"Failed to publish broadcast {broadcast.id}, leaving it to the sweep: {e}")
+
+    return broadcast
+
+@router.get("/{broadcast_id}", response_model=BroadcastResponse)
+async def read_broadcast(broadcast_id: int, db: AsyncSession = Depends(get_db)):
+    broadcast = await BroadcastService.get_broadcast(db, broadcast_id)
+    if not broadcast:
+        raise HTTPException(status_code=404, detail="Broadcast not found")
+    return broadcast
+
+@router.get("/{broadcast_id}/deliveries", response_model=list[BroadcastDeliveryResponse])
+async def read_broadcast_deliveries(
+    broadcast_id: int,
+    response: Response,
+    status: Optional[str] = None,
+    after_id: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    List deliveries in id order. Pass the X-Next-After-Id response header back
+    as `after_id` to fetch the next page; the header is absent on the last page.
+    """
+    deliveries = await BroadcastService.get_deliveries(db, broadcast_id, status=status, after_id=after_id, limit=limit)
+    if len(deliveries) == limit:
+        response.headers["X-Next-After-Id"] = str(deliveries[-1].id)
+    return deliveries
@@ -1,68 +1,159 @@
-from fastapi import APIRouter, Depends, HTTPException
+import logging
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.database import get_db
-from app.schemas.message import MessageCreate, MessageResponse, GroupBuyStatusRequest
+from app.core.config import settings
+from app.models.message import Message
+from app.services.admission import AdmissionController, Overloaded
+from app.services.card_upsert import CardUpsertIndex, UPDATABLE_STATUSES
+from app.schemas.message import MessageCreate, MessageResponse, GroupBuyStatusRequest, MessageBatchCreate, MessageBatchResponse
 from app.services.message_service import MessageService
-from app.services.feishu_message_wrap import generate_group_buy_card
-from app.worker.tasks import send_message_task
+from app.services.feishu_message_wrap import render_group_buy_card
+from app.worker.dispatch import enqueue_message, enqueue_messages, enqueue_card_update
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+async def _admit(priorities: set[str]):
+    try:
+        await AdmissionController.check(priorities)
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def _update_card(db: AsyncSession, message_id: int, card_json) -> Optional[Message]:
+    # Store the latest content; the (coalesced) update task PATCHes whatever is stored by then
+    message = await MessageService.replace_content(db, message_id, card_json, UPDATABLE_STATUSES)
+    if message is not None and await CardUpsertIndex.schedule_update(message_id):
+        enqueue_card_update(message_id, settings.CARD_UPDATE_COALESCE_MS / 1000)
+    return message
+
+async def _upsert_group_buy_card(db: AsyncSession, upsert_key: str, card_json) -> Optional[Message]:
+    """
+    Update the card already sent under upsert_key. Returns None when there is
+    none (or it can no longer be updated) and a new card has to be sent.
+    """
+    message_id = await CardUpsertIndex.lookup_or_claim(upsert_key)
+    if message_id is None:
+        # We own the key now; Redis may just have lost it, so check the DB too,
+        # within the same CARD_UPSERT_TTL the Redis index honours
+        message_id = await MessageService.find_by_upsert_key(db, upsert_key, UPDATABLE_STATUSES, settings.CARD_UPSERT_TTL)
+        if message_id is None:
+            return None
+        await CardUpsertIndex.remember(upsert_key, message_id)
+    return await _update_card(db, message_id, card_json)
 
 @router.post("/send_tuangou_autorelease_status", response_model=MessageResponse)
 async def send_tuangou_autorelease_status(request: GroupBuyStatusRequest, db: AsyncSession = Depends(get_db)):
-    # 1. Generate Feishu Card
+    priority = request.priority or MessageService.default_priority(request.sender, fallback="bulk")
+    await _admit({priority})
+
+    # 1. Render Feishu Card (serialized once, reused for DB and Feishu)
     items_dict = [item.model_dump() for item in request.items]
-    card_content = generate_group_buy_card(
+    card_json = render_group_buy_card(
         items=items_dict,
         node_name=request.node_name,
         release_time=request.release_time,
         header_color=request.header_color,
         at_user_id=request.at_user_id
     )
-    
-    # 2. Create Message Object
-    message_in = MessageCreate(
-        content=card_content,
-        recipient_id=request.recipient_id,
-        recipient_type=request.recipient_type,
-        msg_type="interactive",
-        sender=request.sender,
-        user_id=None # Or some system user id if needed
-    )
-    
+
+    # 2. In upsert mode, update the card sent earlier for the same node and release
+    upsert_key = None
+    if request.upsert:
+        upsert_key = CardUpsertIndex.upsert_key(request.recipient_id, request.node_name, request.release_time)
+        try:
+            message = await _upsert_group_buy_card(db, upsert_key, card_json)
+        except Exception as e:
+            # Without the index a new card is the safe choice
+            logger.warning(f"Card upsert unavailable, sending a new card: {e}")
+            await db.rollback()
+            message = None
+        if message is not None:
+            return message
+
     # 3. Save to DB
-    message = await MessageService.create_message(db, message_in)
+    message = await MessageService.create_message(db, {
+        "content": card_json,
+        "recipient_id": request.recipient_id,
+        "recipient_type": request.recipient_type,
+        "msg_type": "interactive",
+        "sender": request.sender,
+        "user_id": None, # Or some system user id if needed
+        "priority": priority,
+        "upsert_key": upsert_key,
+    })
+    if upsert_key:
+        try:
+            await CardUpsertIndex.remember(upsert_key, message.id)
+        except Exception as e:
+            logger.warning(f"Failed to index card of message {message.id}: {e}")
     
     # 4. Trigger Async Task
-    send_message_task.delay(
-        message.id, 
-        message.recipient_id, 
-        message.recipient_type, 
-        message.msg_type, 
-        message.content
-    )
+    enqueue_message(message, content=card_json)
     
     return message
 
 @router.post("/send", response_model=MessageResponse)
 async def send_message(message_in: MessageCreate, db: AsyncSession = Depends(get_db)):
+    await _admit({message_in.priority or MessageService.default_priority(message_in.sender)})
+
     # 1. Create DB record (Pending)
     message = await MessageService.create_message(db, message_in)
     
     # 2. Trigger Async Task
-    send_message_task.delay(
-        message.id, 
-        message.recipient_id, 
-        message.recipient_type, 
-        message.msg_type, 
-        message.content
-    )
+    enqueue_message(message)
     
     return message
 
+@router.post("/send_batch", response_model=MessageBatchResponse)
+async def send_message_batch(batch_in: MessageBatchCreate, db: AsyncSession = Depends(get_db)):
+    if not batch_in.messages:
+        raise HTTPException(status_code=400, detail="messages must not be empty")
+    if len(batch_in.messages) > settings.MESSAGE_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {settings.MESSAGE_BATCH_MAX_SIZE} messages per batch")
+    await _admit({m.priority or MessageService.default_priority(m.sender) for m in batch_in.messages})
+
+    # 1. Create all DB records (Pending) in one INSERT ... RETURNING
+    messages = await MessageService.create_messages(db, batch_in.messages)
+    
+    # 2. Trigger Async Tasks in one group publish
+    enqueue_messages(messages)
+    
+    return MessageBatchResponse(ids=[message.id for message in messages])
+
 @router.get("/", response_model=list[MessageResponse])
-async def read_messages(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
-    messages = await MessageService.get_messages(db, skip=skip, limit=limit)
+async def read_messages(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    status: Optional[str] = None,
+    sender: Optional[str] = None,
+    recipient_id: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    List messages newest first. Pass the X-Next-Cursor response header back as
+    `cursor` to fetch the next page; the header is absent on the last page.
+    """
+    try:
+        messages, next_cursor = await MessageService.get_messages(
+            db,
+            cursor=cursor,
+            limit=limit,
+            status=status,
+            sender=sender,
+            recipient_id=recipient_id,
+            created_after=created_after,
+            created_before=created_before,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return messages
 
 @router.get("/{message_id}", response_model=MessageResponse)
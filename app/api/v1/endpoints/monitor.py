@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException
 from app.core.config import settings
-import redis.asyncio as redis
-import time
+from app.schemas.monitor import HeartbeatBatch
+from app.services.circuit_breaker import FeishuCircuitBreaker
+from app.services.heartbeat_service import HeartbeatService
 
 router = APIRouter()
 
@@ -12,18 +13,8 @@ async def heartbeat(system_id: str):
     """
     # Token verification is skipped as per requirements.
     
-    # Connect to Redis
-    # decode_responses=True ensures we get strings back, which is easier to work with
-    redis_client = redis.from_url(settings.CELERY_BROKER_URL, decode_responses=True)
     try:
-        current_time = int(time.time())
-        
-        # Update heartbeat timestamp
-        heartbeat_key = f"SystemA_Heartbeat:{system_id}"
-        await redis_client.set(heartbeat_key, current_time)
-        
-        # Add to set of monitored systems to enable iteration during checks
-        await redis_client.sadd("Monitored_Systems", system_id)
+        current_time = await HeartbeatService.record_heartbeat(system_id)
         
         return {
             "status": "received",
@@ -32,5 +23,35 @@ async def heartbeat(system_id: str):
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to record heartbeat: {str(e)}")
-    finally:
-        await redis_client.close()
+
+@router.post("/heartbeats")
+async def heartbeats(batch: HeartbeatBatch):
+    """
+    Receive heartbeats for many systems at once, e.g. from an agent gateway.
+    """
+    system_ids = list(dict.fromkeys(batch.system_ids))
+    if not system_ids:
+        raise HTTPException(status_code=400, detail="system_ids must not be empty")
+    if len(system_ids) > settings.MONITOR_HEARTBEAT_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {settings.MONITOR_HEARTBEAT_BATCH_MAX} system_ids per batch")
+
+    try:
+        current_time = await HeartbeatService.record_heartbeats(system_ids)
+        
+        return {
+            "status": "received",
+            "count": len(system_ids),
+            "timestamp": current_time
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to record heartbeats: {str(e)}")
+
+@router.get("/feishu/circuit")
+async def feishu_circuit():
+    """
+    Current state of the Feishu circuit breaker (closed, open or half_open).
+    """
+    try:
+        return await FeishuCircuitBreaker.status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read circuit state: {str(e)}")
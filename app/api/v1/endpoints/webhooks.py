@@ -1,10 +1,25 @@
+from typing import Optional
 from fastapi import APIRouter, Request, BackgroundTasks
-from app.worker.tasks import process_received_message_task
+from fastapi.responses import JSONResponse
+from app.core.config import settings
+from app.core.redis_pool import get_redis
+from app.worker.dispatch import enqueue_received_event
 import logging
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+def _event_dedup_key(data: dict) -> Optional[str]:
+    # v2 events carry header.event_id; v1 events only have the message id
+    event_id = data.get("header", {}).get("event_id")
+    if event_id:
+        return f"Feishu_Event_Dedup:{event_id}"
+    event = data.get("event", {})
+    message_id = event.get("message", {}).get("message_id") or event.get("open_message_id")
+    if message_id:
+        return f"Feishu_Event_Dedup:msg:{message_id}"
+    return None
+
 @router.post("/feishu")
 async def feishu_webhook(request: Request, background_tasks: BackgroundTasks):
     data = await request.json()
@@ -20,13 +35,34 @@ async def feishu_webhook(request: Request, background_tasks: BackgroundTasks):
     # 2. Event Handling
     # Ideally verify signature here using settings.FEISHU_ENCRYPT_KEY
     
-    # 3. Async Process
+    # 3. Deduplicate retried deliveries
+    # Feishu redelivers events it considers unacknowledged; only the first one is dispatched
+    dedup_key = _event_dedup_key(data)
+    if dedup_key:
+        try:
+            is_first = await get_redis().set(dedup_key, 1, nx=True, ex=settings.FEISHU_EVENT_DEDUP_TTL)
+        except Exception as e:
+            # Fail open: a duplicate reply is better than a lost message
+            logger.warning(f"Event dedup unavailable, dispatching anyway: {e}")
+            is_first = True
+        if not is_first:
+            logger.info(f"Duplicate event ignored: {dedup_key}")
+            return {"msg": "ok"}
+
+    # 4. Async Process
     # We can use Celery for reliability
     logger.info(f"Dispatching task for event: {data.get('header', {}).get('event_id')}")
     try:
-        task = process_received_message_task.apply_async(args=[data], queue="receive_queue")
+        task = enqueue_received_event(data)
         logger.info(f"Task dispatched successfully: {task.id}")
     except Exception as e:
         logger.error(f"Failed to dispatch task: {e}")
+        # Let Feishu's retry of this event through: a non-2xx answer makes Feishu redeliver it
+        if dedup_key:
+            try:
+                await get_redis().delete(dedup_key)
+            except Exception:
+                pass
+        return JSONResponse(status_code=503, content={"msg": "event not accepted, retry later"})
     
     return {"msg": "ok"}
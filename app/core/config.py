@@ -1,6 +1,6 @@
 import os
 from pydantic_settings import BaseSettings
-from typing import Optional, Any
+from typing import Optional, Any, Dict, Set
 from pydantic import model_validator
 
 class Settings(BaseSettings):
@@ -14,15 +14,139 @@ class Settings(BaseSettings):
     
     REDIS_HOST: str
     REDIS_PORT: int = 6379
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT: int = 5
+
+    # Database Pool Settings
+    DB_ECHO: bool = False
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800  # seconds
     
     FEISHU_APP_ID: Optional[str] = None
     FEISHU_APP_SECRET: Optional[str] = None
     FEISHU_ENCRYPT_KEY: Optional[str] = None
     FEISHU_VERIFICATION_TOKEN: Optional[str] = None
+    FEISHU_EVENT_DEDUP_TTL: int = 86400  # seconds a delivered event_id is remembered
+
+    # Feishu Transport Settings
+    FEISHU_TRANSPORT: str = "httpx"  # "httpx" (native async) or "sdk" (lark_oapi in a thread)
+    FEISHU_BASE_URL: str = "https://open.feishu.cn"
+    FEISHU_HTTP2: bool = False
+    FEISHU_CONNECT_TIMEOUT: float = 3.0
+    FEISHU_READ_TIMEOUT: float = 10.0
+    FEISHU_MAX_CONNECTIONS: int = 200
+    FEISHU_MAX_KEEPALIVE: int = 100
+    # tenant_access_token shared by all processes through Redis
+    FEISHU_TOKEN_REFRESH_MARGIN: int = 600     # seconds before expiry a new token is fetched
+    FEISHU_TOKEN_LOCAL_TTL: int = 30           # seconds a process trusts its copy before re-reading Redis
+    FEISHU_TOKEN_LOCK_TIMEOUT_MS: int = 10000
+    # email / user_id recipients are resolved to open_ids before sending
+    FEISHU_RESOLVE_RECIPIENTS: bool = True
+    FEISHU_RECIPIENT_CACHE_TTL: int = 86400      # seconds a resolved open_id is kept in Redis
+    FEISHU_RECIPIENT_NEGATIVE_TTL: int = 600     # seconds an unknown recipient is remembered
+    FEISHU_RECIPIENT_ERROR_TTL: int = 60         # seconds lookups are skipped after one failed (e.g. missing contact scope)
+    FEISHU_RECIPIENT_LOCAL_TTL: int = 300        # seconds in the in-process LRU
+    FEISHU_RECIPIENT_LOCAL_MAX: int = 10000
+    FEISHU_RECIPIENT_BATCH_WINDOW_MS: int = 10   # lookups arriving while one is in flight are batched over this window
+
+    # Maximum number of messages accepted by POST /messages/send_batch
+    MESSAGE_BATCH_MAX_SIZE: int = 1000
+
+    # Priority lanes: high (monitor alerts), normal, bulk (group-buy cards, fan-outs)
+    # Each lane has its own send queue so bulk floods never delay alerts
+    SEND_QUEUE_HIGH: str = "send_queue_high"
+    SEND_QUEUE_NORMAL: str = "send_queue"
+    SEND_QUEUE_BULK: str = "send_queue_bulk"
+    MESSAGE_PRIORITY_BY_SENDER: Dict[str, str] = {"MonitorSystem": "high"}
+
+    # "celery": publish one send task per message
+    # "outbox": pending rows are the queue, drained by python -m app.worker.outbox
+    MESSAGE_DISPATCH_MODE: str = "celery"
+    OUTBOX_BATCH_SIZE: int = 200
+    OUTBOX_CONCURRENCY: int = 200
+    OUTBOX_POLL_INTERVAL_MS: int = 200
+    OUTBOX_CLAIM_TIMEOUT: int = 300  # seconds before a row stuck in "sending" is claimed again
+
+    # Feishu Rate Limits (shared by all workers through Redis)
+    FEISHU_RATE_LIMIT_ENABLED: bool = True
+    FEISHU_APP_RATE: float = 50.0        # sends per second for the whole app
+    FEISHU_APP_BURST: int = 50
+    FEISHU_RECIPIENT_RATE: float = 5.0   # sends per second to one user or chat
+    FEISHU_RECIPIENT_BURST: int = 5
+    FEISHU_RATE_LIMIT_MAX_WAIT: float = 2.0      # seconds a send may wait before it is deferred
+    FEISHU_RATE_LIMIT_RECOVERY: float = 0.05     # app rate factor regained per second after throttling
+    FEISHU_RATE_LIMIT_MIN_FACTOR: float = 0.1
+    FEISHU_RATE_LIMIT_PENALTY_DELAY: float = 1.0 # seconds to defer a send Feishu rejected as rate limited
+    # Circuit breaker around Feishu sends (shared through Redis)
+    FEISHU_CIRCUIT_ENABLED: bool = True
+    FEISHU_CIRCUIT_WINDOW: int = 10              # seconds per counting window
+    FEISHU_CIRCUIT_MIN_CALLS: int = 20
+    FEISHU_CIRCUIT_FAILURE_RATIO: float = 0.5
+    FEISHU_CIRCUIT_SLOW_CALL_MS: int = 5000      # slower calls count as failures
+    FEISHU_CIRCUIT_OPEN_SECONDS: float = 30.0
+    FEISHU_CIRCUIT_HALF_OPEN_PROBES: int = 3
+
+    # Retries: failed sends with these codes are retried with jittered exponential
+    # backoff; after SEND_MAX_ATTEMPTS the message is dead-lettered (status "dead").
+    # -1 covers errors raised before the request left (connect and pool timeouts);
+    # a send whose outcome is unknown (e.g. a read timeout) is failed, never retried.
+    SEND_RETRYABLE_CODES: Set[int] = {-1}
+    SEND_MAX_ATTEMPTS: int = 5
+    SEND_RETRY_BASE_DELAY: float = 2.0
+    SEND_RETRY_MAX_DELAY: float = 300.0
+    SEND_DEFERRED_POLL_INTERVAL: float = 1.0
+    SEND_DEFERRED_BATCH_SIZE: int = 500
+    SEND_DEFERRED_RESCUE_AFTER: int = 300     # seconds past due before a parked row is scheduled again
+    SEND_DEFERRED_RESCUE_INTERVAL: int = 60
+
+    # Admission control: send endpoints answer 429 when the backlog (queued +
+    # deferred sends) exceeds the watermark of the message's lane
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_CACHE_TTL: float = 1.0
+    ADMISSION_BULK_WATERMARK: int = 50000
+    ADMISSION_NORMAL_WATERMARK: int = 100000
+    ADMISSION_HIGH_WATERMARK: int = 200000
+    ADMISSION_MAX_RETRY_AFTER: int = 60
+    ADMISSION_DRAIN_WINDOW: int = 10          # seconds per bucket of the drained-sends counter behind Retry-After
+
+    # Group-buy cards sent with upsert=true are updated in place
+    CARD_UPSERT_TTL: int = 86400             # seconds a (recipient, node, release time) card stays updatable
+    CARD_UPDATE_COALESCE_MS: int = 1000      # updates within this window become one PATCH
+    CARD_UPDATE_MAX_WAIT: int = 600          # seconds an update waits for the original card to be sent
+
+    # Broadcasts: one message to many recipients (POST /broadcasts)
+    BROADCAST_USE_BATCH_API: bool = True     # message/v4/batch_send where msg_type and recipient_type allow it
+    BROADCAST_BATCH_SIZE: int = 200          # recipients per batch_send call (Feishu maximum)
+    BROADCAST_MAX_RECIPIENTS: int = 50000
+    BROADCAST_SEND_CONCURRENCY: int = 20     # parallel single sends when batch_send cannot be used
+    BROADCAST_MAX_ATTEMPTS: int = 3          # tries per call before recipients are marked failed
+    BROADCAST_CLAIM_TIMEOUT: int = 300       # seconds without progress before a "sending" broadcast is claimed again
+    BROADCAST_PENDING_GRACE: int = 120       # seconds a "pending" broadcast may wait for its task before it is republished
+    BROADCAST_ERROR_RETRY_DELAY: float = 30.0  # seconds before a broadcast interrupted by an unexpected error resumes
+    BROADCAST_SWEEP_INTERVAL: float = 60.0
+    BROADCAST_SWEEP_BATCH_SIZE: int = 100
+
+    # Send Consumer Settings (python -m app.worker.send_consumer)
+    SEND_CONSUMER_CONCURRENCY: int = 200
+    SEND_CONSUMER_QUEUES: str = "send_queue_high,send_queue,send_queue_bulk"
+    STATUS_FLUSH_INTERVAL_MS: int = 50
+    STATUS_FLUSH_MAX_ROWS: int = 500
+    STATUS_FLUSH_RETRY_DELAY_MS: int = 1000  # pause before a failed flush is written again
+
+    # Metrics
+    METRICS_ENABLED: bool = True
+    METRICS_WORKER_PORT: int = 9100  # worker-side Prometheus exporter
 
     # Monitor Settings
     MONITOR_HEARTBEAT_TIMEOUT: int = 180  # 3 minutes in seconds    
     MONITOR_CHECK_INTERVAL: int = 180     # 3 minutes in seconds    
+    MONITOR_FAIL_THRESHOLD: int = 3       # consecutive timed-out checks before DOWN
+    MONITOR_RECOVER_THRESHOLD: int = 2    # consecutive healthy checks before a DOWN system is UP again
+    MONITOR_ALERT_WINDOW: int = 0         # seconds transitions are merged into one alert (0 = one check cycle)
+    MONITOR_ALERT_MAX_LISTED: int = 50    # systems listed per section of the summary card
+    MONITOR_HEARTBEAT_BATCH_MAX: int = 10000
     MONITOR_ALERT_RECIPIENT_ID: Optional[str] = None
     MONITOR_ALERT_RECIPIENT_TYPE: str = "feishu_chat" 
     MONITOR_ALERT_AT_USER_ID: Optional[str] = None # "all" for everyone, or user_open_id
@@ -63,6 +187,10 @@ class Settings(BaseSettings):
     def CELERY_BROKER_URL(self) -> str:
         return f"redis://{self.REDIS_HOST}:{self.REDIS_PORT}/0"
 
+    @property
+    def REDIS_URL(self) -> str:
+        return f"redis://{self.REDIS_HOST}:{self.REDIS_PORT}/0"
+
     class Config:
         env_file = ".env"
         case_sensitive = True
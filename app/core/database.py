@@ -1,17 +1,24 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
 from app.core.config import settings
-import json
+from app.core.serialization import dumps
 
 def json_serializer(obj):
     """JSON serializer for objects not serializable by default json code"""
-    return json.dumps(obj, ensure_ascii=False)
+    # Pre-serialized RawJSON payloads are stored as-is
+    return dumps(obj)
 
+# A bounded pool shared by everything running on the owning event loop.
+# Celery workers keep one loop per process (see app.worker.lifecycle), so
+# connections are reused across tasks instead of being opened per task.
 engine = create_async_engine(
     settings.SQLALCHEMY_DATABASE_URI, 
-    echo=True, 
-    poolclass=NullPool,
+    echo=settings.DB_ECHO, 
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=True,
     json_serializer=json_serializer
 )
 
@@ -0,0 +1,66 @@
+"""
+Prometheus metrics for the API and the workers.
+
+Set PROMETHEUS_MULTIPROC_DIR when running several processes (uvicorn workers,
+Celery prefork) so every process writes to a shared directory and a single
+/metrics endpoint or worker exporter can aggregate them.
+"""
+import functools
+import os
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, start_http_server
+from prometheus_client import multiprocess
+
+# Buckets tuned for sub-second service calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Queue wait can reach minutes during floods
+QUEUE_WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+API_REQUEST_LATENCY = Histogram(
+    "sms_api_request_seconds", "API request latency", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+SEND_QUEUE_WAIT = Histogram(
+    "sms_send_queue_wait_seconds", "Time between enqueue and the start of a send", buckets=QUEUE_WAIT_BUCKETS
+)
+FEISHU_SEND_LATENCY = Histogram(
+    "sms_feishu_send_seconds", "FeishuService.send_message latency", ["code"], buckets=LATENCY_BUCKETS
+)
+DB_QUERY_LATENCY = Histogram(
+    "sms_db_query_seconds", "MessageService query latency", ["operation"], buckets=LATENCY_BUCKETS
+)
+HEARTBEAT_CHECK_LATENCY = Histogram(
+    "sms_heartbeat_check_seconds", "Heartbeat check cycle duration", buckets=LATENCY_BUCKETS
+)
+SEND_RESULTS = Counter(
+    "sms_send_results_total", "Send outcomes", ["status"]
+)
+
+def observe_db(operation: str):
+    """Decorator timing an async MessageService query."""
+    histogram = DB_QUERY_LATENCY.labels(operation=operation)
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+def _registry():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+def render_latest() -> tuple[bytes, str]:
+    """Exposition payload and content type for a /metrics endpoint."""
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+def start_exporter(port: int):
+    """Serve /metrics from a background thread (worker side)."""
+    start_http_server(port, registry=_registry())
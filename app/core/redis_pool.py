@@ -0,0 +1,32 @@
+from typing import Optional
+import redis.asyncio as redis
+from app.core.config import settings
+
+_pool: Optional[redis.BlockingConnectionPool] = None
+
+def get_redis() -> redis.Redis:
+    """
+    Return a client bound to the process-wide connection pool.
+    The pool is created lazily on first use, so it belongs to the event loop
+    that is running at that moment. Clients are cheap; do not close them.
+    """
+    global _pool
+    if _pool is None:
+        _pool = redis.BlockingConnectionPool.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+        )
+    return redis.Redis(connection_pool=_pool)
+
+def reset_redis() -> None:
+    """Forget the pool without closing it (used right after fork)."""
+    global _pool
+    _pool = None
+
+async def close_redis() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.disconnect()
+        _pool = None
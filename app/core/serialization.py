@@ -0,0 +1,13 @@
+import json
+
+class RawJSON(str):
+    """
+    A string that already holds serialized JSON.
+    dumps() passes it through unchanged, so a payload rendered once can travel
+    to the database and to Feishu without being encoded again.
+    """
+
+def dumps(obj) -> str:
+    if isinstance(obj, RawJSON):
+        return obj
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
@@ -1,6 +1,11 @@
-from fastapi import FastAPI
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
 from app.api.v1.router import api_router
 from app.core.config import settings
+from app.core.database import engine
+from app.core.metrics import API_REQUEST_LATENCY, render_latest
+from app.core.redis_pool import get_redis, close_redis
 import logging
 
 # Configure basic logging
@@ -9,10 +14,36 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
-app = FastAPI(title=settings.PROJECT_NAME)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One Redis pool and one DB pool for the lifetime of each API process
+    get_redis()
+    yield
+    await close_redis()
+    await engine.dispose()
+
+app = FastAPI(title=settings.PROJECT_NAME, lifespan=lifespan)
 
 app.include_router(api_router, prefix="/api/v1")
 
+@app.middleware("http")
+async def observe_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template, not raw path, to keep cardinality bounded
+    route = request.scope.get("route")
+    API_REQUEST_LATENCY.labels(
+        method=request.method,
+        route=route.path if route is not None else "unmatched",
+        status=response.status_code,
+    ).observe(time.perf_counter() - started)
+    return response
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    payload, content_type = render_latest()
+    return Response(content=payload, media_type=content_type)
+
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
@@ -0,0 +1,40 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+class Broadcast(Base):
+    """One message sent to many recipients; per-recipient state lives in BroadcastDelivery."""
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    content = Column(JSON, nullable=False)
+    recipient_type = Column(String, nullable=False, default="feishu_user") # applies to every recipient
+    msg_type = Column(String, nullable=False, default="text")
+    sender = Column(String, nullable=False)
+    priority = Column(String, nullable=False, default="bulk", server_default="bulk")
+
+    status = Column(String, nullable=False, default="pending", index=True) # pending, sending, sent, partial, failed
+    total = Column(Integer, nullable=False, default=0, server_default="0")
+    sent_count = Column(Integer, nullable=False, default=0, server_default="0")
+    failed_count = Column(Integer, nullable=False, default=0, server_default="0")
+    error_log = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+class BroadcastDelivery(Base):
+    """Compact per-recipient delivery row of a broadcast."""
+    __tablename__ = "broadcast_deliveries"
+
+    id = Column(Integer, primary_key=True)
+    broadcast_id = Column(Integer, ForeignKey("broadcasts.id", ondelete="CASCADE"), nullable=False)
+    recipient_id = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="pending", server_default="pending") # pending, sent, failed
+    feishu_message_id = Column(String, nullable=True) # batch message id when sent through batch_send
+    error_code = Column(Integer, nullable=True) # Feishu code, -1 for our own errors
+
+    __table_args__ = (
+        UniqueConstraint("broadcast_id", "recipient_id", name="uq_broadcast_deliveries_recipient"),
+        # Pending rows of a broadcast in id order, and per-status listings
+        Index("ix_broadcast_deliveries_broadcast_status_id", "broadcast_id", "status", "id"),
+    )
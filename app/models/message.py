@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, Index, text
 from sqlalchemy.sql import func
 from app.db.base import Base
 
@@ -15,9 +15,25 @@ class Message(Base):
     sender = Column(String, nullable=False)
     
     status = Column(String, default="pending", index=True) # pending, sending, sent, failed, received
+    priority = Column(String, nullable=False, default="normal", server_default="normal") # high, normal, bulk
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     feishu_message_id = Column(String, nullable=True) # ID returned by Feishu
     error_log = Column(Text, nullable=True)
+
+    attempts = Column(Integer, nullable=False, default=0, server_default="0") # failed send attempts
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True) # when a "retrying" message is sent again
+    upsert_key = Column(String, nullable=True) # cards updated in place share one row, see CardUpsertIndex
+
+    # Keyset pagination indexes for GET /messages, ordered by (created_at, id)
+    __table_args__ = (
+        Index("ix_messages_created_at_id", "created_at", "id"),
+        Index("ix_messages_status_created_at_id", "status", "created_at", "id"),
+        Index("ix_messages_sender_created_at_id", "sender", "created_at", "id"),
+        Index("ix_messages_recipient_id_created_at_id", "recipient_id", "created_at", "id"),
+        # Rows claimable by outbox dispatchers, one ordered range per priority lane
+        Index("ix_messages_outbox_priority", "priority", "id", postgresql_where=text("status IN ('pending', 'sending')")),
+        Index("ix_messages_upsert_key", "upsert_key", "id", postgresql_where=text("upsert_key IS NOT NULL")),
+    )
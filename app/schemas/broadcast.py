@@ -0,0 +1,39 @@
+from pydantic import BaseModel
+from typing import Optional, Any, Dict, List, Literal
+from datetime import datetime
+
+class BroadcastCreate(BaseModel):
+    content: Dict[str, Any]
+    msg_type: str = "text"
+    # One type for all recipients: feishu_user (open_id), user_id, email or feishu_chat
+    recipient_type: str = "feishu_user"
+    recipient_ids: List[str]
+    sender: str
+    priority: Optional[Literal["high", "normal", "bulk"]] = None  # defaults to "bulk"
+
+class BroadcastResponse(BaseModel):
+    id: int
+    msg_type: str
+    recipient_type: str
+    sender: str
+    priority: str
+    status: str
+    total: int
+    sent_count: int
+    failed_count: int
+    error_log: Optional[str] = None
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class BroadcastDeliveryResponse(BaseModel):
+    id: int
+    recipient_id: str
+    status: str
+    feishu_message_id: Optional[str] = None
+    error_code: Optional[int] = None
+
+    class Config:
+        from_attributes = True
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, Any, Dict, List, Union
+from typing import Optional, Any, Dict, List, Literal, Union
 from datetime import datetime
 
 class GroupBuyItem(BaseModel):
@@ -15,6 +15,10 @@ class GroupBuyStatusRequest(BaseModel):
     recipient_type: str = "feishu_chat"
     sender: str
     at_user_id: Optional[str] = ""
+    priority: Optional[Literal["high", "normal", "bulk"]] = None  # defaults to "bulk"
+    # Update the card previously sent for the same (recipient_id, node_name, release_time)
+    # instead of posting a new one
+    upsert: bool = False
 
 class MessageBase(BaseModel):
     content: Dict[str, Any]
@@ -23,10 +27,18 @@ class MessageBase(BaseModel):
     msg_type: str = "text"
     user_id: Optional[str] = None
     sender: str
+    # Delivery lane. When omitted it is derived from the sender (MESSAGE_PRIORITY_BY_SENDER)
+    priority: Optional[Literal["high", "normal", "bulk"]] = None
 
 class MessageCreate(MessageBase):
     pass
 
+class MessageBatchCreate(BaseModel):
+    messages: List[MessageCreate]
+
+class MessageBatchResponse(BaseModel):
+    ids: List[int]
+
 class MessageUpdate(BaseModel):
     status: Optional[str] = None
     feishu_message_id: Optional[str] = None
@@ -41,6 +53,8 @@ class MessageResponse(MessageBase):
     updated_at: Optional[datetime] = None
     feishu_message_id: Optional[str] = None
     error_log: Optional[str] = None
+    attempts: int = 0
+    next_attempt_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -0,0 +1,5 @@
+from pydantic import BaseModel
+from typing import List
+
+class HeartbeatBatch(BaseModel):
+    system_ids: List[str]
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Iterable, Optional
+from sqlalchemy import func, select
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.redis_pool import get_redis
+from app.models.message import Message
+from app.services.deferred_sends import DEFERRED_KEY
+
+logger = logging.getLogger(__name__)
+
+def drained_key(window: int) -> str:
+    # Sends that left the backlog for good during one ADMISSION_DRAIN_WINDOW
+    return f"Send_Drained:{window}"
+
+class Overloaded(Exception):
+    """The send backlog is above the watermark of the requested lane."""
+
+    def __init__(self, retry_after: int, backlog: int):
+        super().__init__(f"Send backlog too large ({backlog}), retry after {retry_after}s")
+        self.retry_after = retry_after
+        self.backlog = backlog
+
+class AdmissionController:
+    """
+    Queue-depth admission control for the send endpoints.
+    The backlog (queued + deferred sends) and the recent drain rate are read at
+    most once per ADMISSION_CACHE_TTL per process, never per request. The drain
+    rate comes from the workers' record_drained() calls. Bulk
+    traffic is turned away first, alerts last. When the backlog cannot be read
+    every request is admitted (fail open).
+    """
+    _checked_at: float = 0.0
+    _backlog: int = 0
+    _drain_rate: float = 0.0
+    _lock: Optional[asyncio.Lock] = None
+
+    @staticmethod
+    def _watermark(priority: str) -> int:
+        if priority == "high":
+            return settings.ADMISSION_HIGH_WATERMARK
+        if priority == "bulk":
+            return settings.ADMISSION_BULK_WATERMARK
+        return settings.ADMISSION_NORMAL_WATERMARK
+
+    @staticmethod
+    def _drain_window() -> int:
+        return int(time.time() // settings.ADMISSION_DRAIN_WINDOW)
+
+    @classmethod
+    async def record_drained(cls, count: int = 1) -> None:
+        """Count final send results (sent, failed, dead, ...). Never raises."""
+        if not settings.ADMISSION_ENABLED or count <= 0:
+            return
+        key = drained_key(cls._drain_window())
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            pipe.incrby(key, count)
+            pipe.expire(key, settings.ADMISSION_DRAIN_WINDOW * 3)
+            await pipe.execute()
+        except Exception as e:
+            logger.debug(f"Failed to count drained sends: {e}")
+
+    @classmethod
+    async def _refresh(cls):
+        redis_client = get_redis()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zcard(DEFERRED_KEY)
+        # Sends per second over the last complete drain window
+        pipe.get(drained_key(cls._drain_window() - 1))
+        if settings.MESSAGE_DISPATCH_MODE != "outbox":
+            for queue in (settings.SEND_QUEUE_HIGH, settings.SEND_QUEUE_NORMAL, settings.SEND_QUEUE_BULK):
+                pipe.llen(queue)
+        deferred, drained, *queue_lengths = await pipe.execute()
+
+        if settings.MESSAGE_DISPATCH_MODE == "outbox":
+            # Pending rows are the queue
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(select(func.count()).select_from(Message).where(Message.status == "pending"))
+                queue_lengths = [result.scalar() or 0]
+
+        cls._backlog = int(deferred) + sum(int(length) for length in queue_lengths)
+        cls._drain_rate = int(drained or 0) / settings.ADMISSION_DRAIN_WINDOW
+        cls._checked_at = time.monotonic()
+
+    @classmethod
+    async def check(cls, priorities: Iterable[str]) -> None:
+        """Raises Overloaded when any of the lanes must not take more work."""
+        if not settings.ADMISSION_ENABLED:
+            return
+
+        if time.monotonic() - cls._checked_at > settings.ADMISSION_CACHE_TTL:
+            if cls._lock is None:
+                cls._lock = asyncio.Lock()
+            async with cls._lock:
+                if time.monotonic() - cls._checked_at > settings.ADMISSION_CACHE_TTL:
+                    try:
+                        await cls._refresh()
+                    except Exception as e:
+                        # Admission control must not take the send endpoints down with Redis
+                        logger.warning(f"Send backlog unavailable, admitting requests: {e}")
+                        cls._backlog = 0
+                        cls._checked_at = time.monotonic()
+
+        watermark = min(cls._watermark(priority) for priority in priorities)
+        if cls._backlog <= watermark:
+            return
+
+        # Time until the backlog is back under the watermark at the current drain rate
+        if cls._drain_rate > 0:
+            retry_after = math.ceil((cls._backlog - watermark) / cls._drain_rate)
+        else:
+            retry_after = settings.ADMISSION_MAX_RETRY_AFTER
+        raise Overloaded(max(1, min(retry_after, settings.ADMISSION_MAX_RETRY_AFTER)), cls._backlog)
@@ -0,0 +1,217 @@
+from datetime import timedelta
+from typing import Optional
+from sqlalchemy import and_, bindparam, func, insert, or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from app.core.metrics import observe_db
+from app.models.broadcast import Broadcast, BroadcastDelivery
+from app.schemas.broadcast import BroadcastCreate
+
+class BroadcastService:
+    @staticmethod
+    @observe_db("create_broadcast")
+    async def create_broadcast(db: AsyncSession, broadcast_in: BroadcastCreate, priority: str) -> Broadcast:
+        """Insert the parent row and one pending delivery per distinct recipient."""
+        recipient_ids = list(dict.fromkeys(broadcast_in.recipient_ids))
+        broadcast = Broadcast(
+            content=broadcast_in.content,
+            recipient_type=broadcast_in.recipient_type,
+            msg_type=broadcast_in.msg_type,
+            sender=broadcast_in.sender,
+            priority=priority,
+            total=len(recipient_ids),
+        )
+        db.add(broadcast)
+        await db.flush()
+        await db.execute(
+            insert(BroadcastDelivery),
+            [{"broadcast_id": broadcast.id, "recipient_id": recipient_id} for recipient_id in recipient_ids],
+        )
+        await db.commit()
+        await db.refresh(broadcast)
+        return broadcast
+
+    @staticmethod
+    @observe_db("get_broadcast")
+    async def get_broadcast(db: AsyncSession, broadcast_id: int) -> Optional[Broadcast]:
+        result = await db.execute(select(Broadcast).filter(Broadcast.id == broadcast_id))
+        return result.scalars().first()
+
+    @staticmethod
+    @observe_db("get_deliveries")
+    async def get_deliveries(
+        db: AsyncSession,
+        broadcast_id: int,
+        status: Optional[str] = None,
+        after_id: int = 0,
+        limit: int = 100,
+    ) -> list[BroadcastDelivery]:
+        """Deliveries of a broadcast in id order, continuing after after_id."""
+        query = select(BroadcastDelivery).where(
+            BroadcastDelivery.broadcast_id == broadcast_id,
+            BroadcastDelivery.id > after_id,
+        )
+        if status:
+            query = query.where(BroadcastDelivery.status == status)
+        result = await db.execute(query.order_by(BroadcastDelivery.id).limit(limit))
+        return result.scalars().all()
+
+    @staticmethod
+    @observe_db("claim_broadcast")
+    async def claim_broadcast(db: AsyncSession, broadcast_id: int, stale_after: int) -> Optional[Broadcast]:
+        """
+        pending -> sending; None when another worker already has it. A
+        broadcast left in "sending" for more than stale_after seconds (its
+        worker died; every recorded chunk bumps updated_at) is claimed again.
+        """
+        stmt = (
+            update(Broadcast)
+            .where(
+                Broadcast.id == broadcast_id,
+                or_(
+                    Broadcast.status == "pending",
+                    and_(Broadcast.status == "sending", Broadcast.updated_at < func.now() - timedelta(seconds=stale_after)),
+                ),
+            )
+            .values(status="sending")
+            .returning(Broadcast)
+            .execution_options(synchronize_session=False)
+        )
+        broadcast = (await db.scalars(stmt)).first()
+        await db.commit()
+        return broadcast
+
+    @staticmethod
+    @observe_db("unfinished_broadcasts")
+    async def unfinished_broadcasts(db: AsyncSession, pending_after: int, stale_after: int, limit: int) -> list[int]:
+        """
+        Ids of broadcasts nobody is working on: pending for more than
+        pending_after seconds (their task was lost or never published) or
+        sending for more than stale_after seconds.
+        """
+        last_change = func.coalesce(Broadcast.updated_at, Broadcast.created_at)
+        result = await db.execute(
+            select(Broadcast.id)
+            .where(or_(
+                and_(Broadcast.status == "pending", last_change < func.now() - timedelta(seconds=pending_after)),
+                and_(Broadcast.status == "sending", last_change < func.now() - timedelta(seconds=stale_after)),
+            ))
+            .order_by(Broadcast.id)
+            .limit(limit)
+        )
+        return result.scalars().all()
+
+    @staticmethod
+    @observe_db("release_broadcast")
+    async def release_broadcast(db: AsyncSession, broadcast_id: int, error_log: Optional[str] = None) -> None:
+        """
+        sending -> pending, so a later run resumes with the remaining deliveries.
+        error_log records why it was interrupted.
+        """
+        values = {"status": "pending"}
+        if error_log is not None:
+            values["error_log"] = error_log
+        await db.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id, Broadcast.status == "sending")
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+
+    @staticmethod
+    @observe_db("pending_deliveries")
+    async def pending_deliveries(db: AsyncSession, broadcast_id: int, after_id: int, limit: int) -> list:
+        """(id, recipient_id) of the next pending deliveries."""
+        result = await db.execute(
+            select(BroadcastDelivery.id, BroadcastDelivery.recipient_id)
+            .where(
+                BroadcastDelivery.broadcast_id == broadcast_id,
+                BroadcastDelivery.status == "pending",
+                BroadcastDelivery.id > after_id,
+            )
+            .order_by(BroadcastDelivery.id)
+            .limit(limit)
+        )
+        return result.all()
+
+    @staticmethod
+    @observe_db("record_deliveries")
+    async def record_deliveries(db: AsyncSession, broadcast_id: int, results: list[dict]) -> None:
+        """
+        Apply per-recipient results with one executemany UPDATE and add them to
+        the parent's counters. Each result needs "id" and "status" ("sent" or
+        "failed") and may carry "feishu_message_id" and "error_code".
+        """
+        if not results:
+            return
+        table = BroadcastDelivery.__table__
+        await db.execute(
+            update(table)
+            .where(table.c.id == bindparam("b_id"), table.c.status == "pending")
+            .values(
+                status=bindparam("b_status"),
+                feishu_message_id=bindparam("b_feishu_message_id"),
+                error_code=bindparam("b_error_code"),
+            ),
+            [
+                {
+                    "b_id": result["id"],
+                    "b_status": result["status"],
+                    "b_feishu_message_id": result.get("feishu_message_id"),
+                    "b_error_code": result.get("error_code"),
+                }
+                for result in results
+            ],
+        )
+        sent = sum(1 for result in results if result["status"] == "sent")
+        await db.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id)
+            .values(
+                sent_count=Broadcast.sent_count + sent,
+                failed_count=Broadcast.failed_count + (len(results) - sent),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+
+    @staticmethod
+    @observe_db("finish_broadcast")
+    async def finish_broadcast(db: AsyncSession, broadcast_id: int) -> Optional[Broadcast]:
+        """
+        Recount deliveries and set the final status: sent (all delivered),
+        failed (none delivered) or partial. Deliveries still pending are never
+        sent any more, so they are failed first and sent_count + failed_count
+        equals total.
+        """
+        await db.execute(
+            update(BroadcastDelivery)
+            .where(BroadcastDelivery.broadcast_id == broadcast_id, BroadcastDelivery.status == "pending")
+            .values(status="failed", error_code=-1)
+            .execution_options(synchronize_session=False)
+        )
+        counts = dict((await db.execute(
+            select(BroadcastDelivery.status, func.count())
+            .where(BroadcastDelivery.broadcast_id == broadcast_id)
+            .group_by(BroadcastDelivery.status)
+        )).all())
+        sent = counts.get("sent", 0)
+        failed = counts.get("failed", 0)
+        if not failed:
+            status = "sent"
+        elif not sent:
+            status = "failed"
+        else:
+            status = "partial"
+
+        stmt = (
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id)
+            .values(status=status, sent_count=sent, failed_count=failed)
+            .returning(Broadcast)
+            .execution_options(synchronize_session=False)
+        )
+        broadcast = (await db.scalars(stmt)).first()
+        await db.commit()
+        return broadcast
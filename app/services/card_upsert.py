@@ -0,0 +1,67 @@
+import asyncio
+import hashlib
+from typing import Optional
+from app.core.config import settings
+from app.core.redis_pool import get_redis
+
+# Statuses of a card that can still be updated in place
+UPDATABLE_STATUSES = ("pending", "sending", "deferred", "retrying", "sent")
+# Placeholder while the first request for a key creates the message row
+_CLAIMING = "claiming"
+_CLAIM_TTL = 10          # seconds
+_CLAIM_WAIT_STEPS = 20   # x 50ms
+
+class CardUpsertIndex:
+    """
+    Redis index of group-buy cards sent in upsert mode, keyed on
+    (recipient_id, node_name, release_time) -> message row id. The row keeps
+    the same key in messages.upsert_key, so the index can be rebuilt from the
+    DB when Redis lost it.
+    """
+
+    @staticmethod
+    def upsert_key(recipient_id: str, node_name: str, release_time: str) -> str:
+        digest = hashlib.sha1(f"{recipient_id}\x00{node_name}\x00{release_time}".encode()).hexdigest()
+        return f"Card_Upsert:{digest}"
+
+    @staticmethod
+    def _scheduled_key(message_id: int) -> str:
+        return f"Card_Update_Scheduled:{message_id}"
+
+    @staticmethod
+    async def lookup_or_claim(upsert_key: str) -> Optional[int]:
+        """
+        Return the message id indexed under upsert_key. Returns None when the
+        caller has claimed the key instead and must create the message and
+        remember() it. Concurrent first requests wait for the winner's id.
+        """
+        redis_client = get_redis()
+        for _ in range(_CLAIM_WAIT_STEPS):
+            if await redis_client.set(upsert_key, _CLAIMING, nx=True, ex=_CLAIM_TTL):
+                return None
+            value = await redis_client.get(upsert_key)
+            if value is not None and value != _CLAIMING:
+                return int(value)
+            await asyncio.sleep(0.05)
+        # The winner is taking too long; go ahead as if we had claimed it
+        return None
+
+    @staticmethod
+    async def remember(upsert_key: str, message_id: int) -> None:
+        await get_redis().set(upsert_key, message_id, ex=settings.CARD_UPSERT_TTL)
+
+    @staticmethod
+    async def schedule_update(message_id: int) -> bool:
+        """
+        True when the caller should publish the update task: only one is
+        scheduled per message at a time, so updates arriving within
+        CARD_UPDATE_COALESCE_MS end up in one PATCH with the latest content.
+        """
+        # Expires on its own should the scheduled task get lost
+        ttl_ms = settings.CARD_UPDATE_COALESCE_MS + 60000
+        return bool(await get_redis().set(CardUpsertIndex._scheduled_key(message_id), 1, nx=True, px=ttl_ms))
+
+    @staticmethod
+    async def start_update(message_id: int) -> None:
+        """Called by the update task before reading the content, so later updates schedule a new task."""
+        await get_redis().delete(CardUpsertIndex._scheduled_key(message_id))
@@ -0,0 +1,145 @@
+import time
+from typing import Optional
+from app.core.config import settings
+from app.core.redis_pool import get_redis
+
+STATE_KEY = "Feishu_Circuit:state"
+
+def _window_keys(window: int) -> list[str]:
+    return [f"Feishu_Circuit:calls:{window}", f"Feishu_Circuit:failures:{window}"]
+
+# Decide whether a call may go out.
+# closed: always. open: never, until FEISHU_CIRCUIT_OPEN_SECONDS have passed;
+# then half_open: only a few probe calls. Probes that never report back (e.g.
+# the send got deferred) are forgotten after another open period.
+# KEYS: state hash
+# ARGV: open duration ms, max half-open probes
+# Returns: {allowed (0/1), retry after ms}
+ALLOW_SCRIPT = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local open_ms = tonumber(ARGV[1])
+
+local state = redis.call('HGET', KEYS[1], 'state')
+if not state or state == 'closed' then
+    return {1, 0}
+end
+
+local since = tonumber(redis.call('HGET', KEYS[1], 'since'))
+if state == 'open' then
+    if now - since < open_ms then
+        return {0, open_ms - (now - since)}
+    end
+    redis.call('HSET', KEYS[1], 'state', 'half_open', 'since', now, 'probes', 0, 'successes', 0)
+    since = now
+elseif now - since >= open_ms then
+    redis.call('HSET', KEYS[1], 'since', now, 'probes', 0)
+end
+
+if redis.call('HINCRBY', KEYS[1], 'probes', 1) <= tonumber(ARGV[2]) then
+    return {1, 0}
+end
+return {0, 1000}
+"""
+
+# Record the outcome of a call and trip or reset the breaker.
+# KEYS: state hash, window calls counter, window failures counter
+# ARGV: failed (0/1), window ttl s, min calls, failure ratio, probes needed to close
+# Returns: the resulting state
+RECORD_SCRIPT = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local failed = ARGV[1] == '1'
+
+local calls = redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+local failures = tonumber(redis.call('GET', KEYS[3]) or '0')
+if failed then
+    failures = redis.call('INCR', KEYS[3])
+    redis.call('EXPIRE', KEYS[3], ARGV[2])
+end
+
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+if state == 'half_open' then
+    if failed then
+        redis.call('HSET', KEYS[1], 'state', 'open', 'since', now)
+        return 'open'
+    end
+    if redis.call('HINCRBY', KEYS[1], 'successes', 1) >= tonumber(ARGV[5]) then
+        redis.call('DEL', KEYS[1])
+        return 'closed'
+    end
+    return 'half_open'
+end
+
+if state == 'closed' and failed and calls >= tonumber(ARGV[3]) and failures / calls >= tonumber(ARGV[4]) then
+    redis.call('HSET', KEYS[1], 'state', 'open', 'since', now)
+    return 'open'
+end
+return state
+"""
+
+class CircuitOpen(Exception):
+    """Feishu is considered down; retry_after is in seconds."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Feishu circuit open, retry after {retry_after:.3f}s")
+        self.retry_after = retry_after
+
+class FeishuCircuitBreaker:
+    """
+    Circuit breaker around Feishu sends, shared by all workers through Redis.
+    Trips when, within one FEISHU_CIRCUIT_WINDOW, at least FEISHU_CIRCUIT_MIN_CALLS
+    calls were made and FEISHU_CIRCUIT_FAILURE_RATIO of them failed or were slower
+    than FEISHU_CIRCUIT_SLOW_CALL_MS.
+    """
+
+    @staticmethod
+    def _window(now: Optional[float] = None) -> int:
+        return int((now or time.time()) // settings.FEISHU_CIRCUIT_WINDOW)
+
+    @staticmethod
+    async def allow() -> None:
+        """Raises CircuitOpen when the call must not be made now."""
+        script = get_redis().register_script(ALLOW_SCRIPT)
+        allowed, retry_after_ms = await script(
+            keys=[STATE_KEY],
+            args=[int(settings.FEISHU_CIRCUIT_OPEN_SECONDS * 1000), settings.FEISHU_CIRCUIT_HALF_OPEN_PROBES],
+        )
+        if not int(allowed):
+            raise CircuitOpen(int(retry_after_ms) / 1000)
+
+    @staticmethod
+    async def record(failed: bool, elapsed: float) -> str:
+        """Report a finished call; slow calls count as failures."""
+        failed = failed or elapsed * 1000 > settings.FEISHU_CIRCUIT_SLOW_CALL_MS
+        script = get_redis().register_script(RECORD_SCRIPT)
+        return await script(
+            keys=[STATE_KEY, *_window_keys(FeishuCircuitBreaker._window())],
+            args=[
+                1 if failed else 0,
+                settings.FEISHU_CIRCUIT_WINDOW * 3,
+                settings.FEISHU_CIRCUIT_MIN_CALLS,
+                settings.FEISHU_CIRCUIT_FAILURE_RATIO,
+                settings.FEISHU_CIRCUIT_HALF_OPEN_PROBES,
+            ],
+        )
+
+    @staticmethod
+    async def status() -> dict:
+        redis_client = get_redis()
+        window = FeishuCircuitBreaker._window()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hgetall(STATE_KEY)
+        pipe.mget(_window_keys(window))
+        pipe.mget(_window_keys(window - 1))
+        state, current, previous = await pipe.execute()
+
+        since = int(state["since"]) / 1000 if state.get("since") else None
+        return {
+            "state": state.get("state", "closed"),
+            "since": since,
+            "window_seconds": settings.FEISHU_CIRCUIT_WINDOW,
+            "current_window": {"calls": int(current[0] or 0), "failures": int(current[1] or 0)},
+            "previous_window": {"calls": int(previous[0] or 0), "failures": int(previous[1] or 0)},
+        }
@@ -0,0 +1,40 @@
+"""
+Deferred sends.
+
+A send that cannot go out now is not slept on. Its row is parked in status
+"deferred" (rate limited) or "retrying" (failed attempt with backoff) and its
+id is added to a Redis ZSET scored by the time it becomes due.
+release_deferred_task moves due rows back to "pending" and enqueues them
+again, so waiting never holds a worker slot.
+
+The row is always parked before its id is added, so the release task never
+sees an id whose row is still "sending". A row parked by a worker that died
+before the ZADD is found by overdue_deferred() and scheduled again.
+"""
+import time
+from app.core.redis_pool import get_redis
+
+DEFERRED_KEY = "Send_Deferred"
+# Held for SEND_DEFERRED_RESCUE_INTERVAL by the release task that looks for lost entries
+RESCUE_KEY = "Send_Deferred_Rescue"
+
+async def defer_send(message_id: int, delay: float) -> None:
+    await defer_sends([message_id], delay)
+
+async def defer_sends(message_ids: list[int], delay: float) -> None:
+    if message_ids:
+        due_at = time.time() + delay
+        await get_redis().zadd(DEFERRED_KEY, {str(message_id): due_at for message_id in message_ids})
+
+async def due_sends(limit: int) -> list[int]:
+    """Ids of deferred sends that are due, oldest first (not removed)."""
+    members = await get_redis().zrangebyscore(DEFERRED_KEY, "-inf", time.time(), start=0, num=limit)
+    return [int(member) for member in members]
+
+async def remove_sends(message_ids: list[int]) -> None:
+    if message_ids:
+        await get_redis().zrem(DEFERRED_KEY, *[str(message_id) for message_id in message_ids])
+
+async def rescue_due(interval: int) -> bool:
+    """True for one caller per interval: time to look for parked rows without an entry."""
+    return bool(await get_redis().set(RESCUE_KEY, 1, nx=True, ex=interval))
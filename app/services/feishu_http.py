@@ -0,0 +1,108 @@
+import logging
+from typing import Optional
+import httpx
+from app.core.config import settings
+from app.services.feishu_token import FeishuTokenProvider
+
+logger = logging.getLogger(__name__)
+
+# Token expired / invalid, the request can be retried with a fresh token
+TOKEN_INVALID_CODES = {99991661, 99991663, 99991668}
+
+class FeishuHttpClient:
+    """
+    Native async transport for the Feishu Open API.
+    One connection-pooled httpx client is shared by everything running on the
+    process event loop, so sends reuse keep-alive connections.
+    """
+    _client: Optional[httpx.AsyncClient] = None
+
+    @classmethod
+    def get_client(cls) -> httpx.AsyncClient:
+        if cls._client is None:
+            cls._client = httpx.AsyncClient(
+                base_url=settings.FEISHU_BASE_URL,
+                http2=settings.FEISHU_HTTP2,
+                timeout=httpx.Timeout(settings.FEISHU_READ_TIMEOUT, connect=settings.FEISHU_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=settings.FEISHU_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.FEISHU_MAX_KEEPALIVE,
+                ),
+            )
+        return cls._client
+
+    @classmethod
+    def reset(cls):
+        """Forget the client without closing it (used right after fork)."""
+        cls._client = None
+        FeishuTokenProvider.reset()
+
+    @classmethod
+    async def close(cls):
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+        FeishuTokenProvider.reset()
+
+    @classmethod
+    async def fetch_tenant_access_token(cls) -> tuple[str, int]:
+        """
+        Ask Feishu for a tenant_access_token; returns (token, seconds until expiry).
+        Use FeishuTokenProvider.get_token instead, which shares tokens between processes.
+        """
+        response = await cls.get_client().post(
+            "/open-apis/auth/v3/tenant_access_token/internal",
+            json={
+                "app_id": settings.FEISHU_APP_ID or "",
+                "app_secret": settings.FEISHU_APP_SECRET or "",
+            },
+        )
+        body = response.json()
+        if body.get("code") != 0:
+            raise RuntimeError(f"Failed to get tenant_access_token: code={body.get('code')}, msg={body.get('msg')}")
+        return body["tenant_access_token"], int(body.get("expire", 7200))
+
+    @classmethod
+    async def request(cls, method: str, path: str, **kwargs) -> dict:
+        """
+        Call an Open API endpoint with the tenant token and return the decoded body.
+        The call is retried once when Feishu reports the token as invalid.
+        """
+        token = await FeishuTokenProvider.get_token()
+        for attempt in range(2):
+            response = await cls.get_client().request(
+                method, path, headers={"Authorization": f"Bearer {token}"}, **kwargs
+            )
+            body = response.json()
+            if body.get("code") not in TOKEN_INVALID_CODES or attempt > 0:
+                break
+            logger.warning(f"Feishu token rejected (code={body.get('code')}), refreshing")
+            token = await FeishuTokenProvider.get_token(rejected=token)
+
+        if body.get("code") != 0:
+            logger.error(f"Feishu API Error: code={body.get('code')}, msg={body.get('msg')}, log_id={response.headers.get('X-Tt-Logid')}")
+        return body
+
+    @classmethod
+    async def send_message(cls, receive_id_type: str, receive_id: str, msg_type: str, content_str: str) -> dict:
+        return await cls.request(
+            "POST",
+            "/open-apis/im/v1/messages",
+            params={"receive_id_type": receive_id_type},
+            json={"receive_id": receive_id, "msg_type": msg_type, "content": content_str},
+        )
+
+    @classmethod
+    async def update_message(cls, message_id: str, content_str: str) -> dict:
+        """Replace the content of a sent card (the card needs "update_multi": true)."""
+        return await cls.request("PATCH", f"/open-apis/im/v1/messages/{message_id}", json={"content": content_str})
+
+    @classmethod
+    async def batch_send(cls, msg_type: str, content: dict, id_field: str, ids: list[str]) -> dict:
+        """
+        One message to up to 200 users through message/v4/batch_send.
+        id_field is "open_ids" or "user_ids". Cards go in "card", other types in "content".
+        """
+        payload = {"msg_type": msg_type, id_field: ids}
+        payload["card" if msg_type == "interactive" else "content"] = content
+        return await cls.request("POST", "/open-apis/message/v4/batch_send/", json=payload)
@@ -1,9 +1,107 @@
+import json
+from functools import lru_cache
 from typing import List, Dict, Any
+from app.core.serialization import RawJSON, dumps
+
+# 卡片中不随输入变化的部分只序列化一次，渲染时直接拼接 JSON 片段
+_CARD_CONFIG_JSON = dumps({
+    "update_multi": True,
+    "style": {
+        "text_size": {
+            "normal_v2": {
+                "default": "normal",
+                "pc": "normal",
+                "mobile": "heading"
+            }
+        }
+    }
+})
+
+# body 的固定属性（去掉首尾大括号，elements 在渲染时追加）
+_CARD_BODY_ATTRS_JSON = dumps({
+    "direction": "vertical",
+    "horizontal_spacing": "8px",
+    "vertical_spacing": "8px",
+    "horizontal_align": "left",
+    "vertical_align": "top",
+    "padding": "12px 12px 12px 12px",
+})[1:-1]
+
+@lru_cache(maxsize=4096)
+def _item_element_json(name: str, success: bool) -> str:
+    if success:
+        icon_token = "sheet-iconsets-check_filled"
+        icon_color = "green"
+    else:
+        icon_token = "sheet-iconsets-cross_filled"
+        icon_color = "red"
+
+    return dumps({
+        "tag": "markdown",
+        "content": f" {name}",
+        "text_align": "left",
+        "text_size": "normal_v2",
+        "margin": "0px 0px 0px 0px",
+        "icon": {
+            "tag": "standard_icon",
+            "token": icon_token,
+            "color": icon_color
+        }
+    })
+
+@lru_cache(maxsize=1024)
+def _at_element_json(at_user_id: str) -> str:
+    return dumps({
+        "tag": "markdown",
+        "content": f"<at id=\"{at_user_id}\"></at>",
+        "text_align": "left",
+        "text_size": "normal",
+        "margin": "10px 0px 0px 0px"
+    })
+
+@lru_cache(maxsize=1024)
+def _header_json(node_name: str, release_time: str, header_color: str) -> str:
+    return dumps({
+        "title": {
+            "tag": "plain_text",
+            "content": f"团购自动发布  {node_name}"
+        },
+        "subtitle": {
+            "tag": "plain_text",
+            "content": release_time
+        },
+        "template": header_color,
+        "padding": "8px 12px 8px 12px"
+    })
+
+def render_group_buy_card(items: List[Dict[str, Any]], node_name: str = "", release_time: str = "", header_color: str = "blue", at_user_id: str = "") -> RawJSON:
+    """
+    生成团购自动发布的飞书卡片消息，直接返回序列化后的 JSON 字符串
+
+    参数同 generate_group_buy_card。静态骨架预先序列化，元素片段按输入缓存，
+    返回的 RawJSON 可原样写入数据库并作为飞书请求的 content，无需再次编码。
+    """
+    elements = []
+    for item in items:
+        status = item.get("status", False)
+        elements.append(_item_element_json(item.get("name", ""), status is True or status == "success"))
+
+    # 如果有@用户，添加到最后一个元素
+    if at_user_id:
+        elements.append(_at_element_json(at_user_id))
+
+    return RawJSON(
+        '{"schema":"2.0"'
+        f',"config":{_CARD_CONFIG_JSON}'
+        f',"header":{_header_json(node_name, release_time, header_color)}'
+        f',"body":{{{_CARD_BODY_ATTRS_JSON},"elements":[{",".join(elements)}]}}'
+        '}'
+    )
 
 def generate_group_buy_card(items: List[Dict[str, Any]], node_name: str = "", release_time: str = "", header_color: str = "blue", at_user_id: str = "") -> Dict[str, Any]:
     """
     生成团购自动发布的飞书卡片消息
-    
+
     :param items: 列表，每个元素包含 'name' (str) 和 'status' (bool/str)
                   status: True/'success' -> 绿色对勾
                   status: False/'fail' -> 红色叉号
@@ -13,79 +111,53 @@ def generate_group_buy_card(items: List[Dict[str, Any]], node_name: str = "", re
     :param at_user_id: 需要@的用户OpenID，为空则不@
     :return: 飞书卡片 JSON 结构 (dict)
     """
-    
+    return json.loads(render_group_buy_card(items, node_name, release_time, header_color, at_user_id))
+
+def _system_list_markdown(title: str, system_ids: List[str], max_listed: int) -> str:
+    lines = [f"**{title}（{len(system_ids)}）**"]
+    lines.extend(f"- {system_id}" for system_id in system_ids[:max_listed])
+    if len(system_ids) > max_listed:
+        lines.append(f"- …等 {len(system_ids)} 个")
+    return "\n".join(lines)
+
+def render_heartbeat_alert_card(went_down: List[str], went_up: List[str], checked_at: str = "", at_user_id: str = "", max_listed: int = 50) -> RawJSON:
+    """
+    生成心跳监控的汇总告警卡片：一个告警窗口内的所有状态变化合并为一张卡片
+
+    :param went_down: 心跳超时（DOWN）的系统
+    :param went_up: 恢复正常（UP）的系统
+    :param checked_at: 副标题显示的检查时间
+    :param at_user_id: 需要@的用户OpenID，"all" 为所有人，为空则不@
+    :param max_listed: 每个分组最多列出的系统数，其余只计数
+    """
     elements = []
-    for item in items:
-        name = item.get("name", "")
-        status = item.get("status", False)
-        
-        if status is True or status == "success":
-            icon_token = "sheet-iconsets-check_filled"
-            icon_color = "green"
-        else:
-            icon_token = "sheet-iconsets-cross_filled"
-            icon_color = "red"
-            
-        element = {
-            "tag": "markdown",
-            "content": f" {name}",
-            "text_align": "left",
-            "text_size": "normal_v2",
-            "margin": "0px 0px 0px 0px",
-            "icon": {
-                "tag": "standard_icon",
-                "token": icon_token,
-                "color": icon_color
-            }
-        }
-        elements.append(element)
-    
-    # 如果有@用户，添加到最后一个元素
-    if at_user_id:
-        at_element = {
-            "tag": "markdown",
-            "content": f"<at id=\"{at_user_id}\"></at>",
-            "text_align": "left",
-            "text_size": "normal",
-            "margin": "10px 0px 0px 0px"
-        }
-        elements.append(at_element)
-
-    card = {
-        "schema": "2.0",
-        "config": {
-            "update_multi": True,
-            "style": {
-                "text_size": {
-                    "normal_v2": {
-                        "default": "normal",
-                        "pc": "normal",
-                        "mobile": "heading"
-                    }
-                }
-            }
+    if went_down:
+        elements.append({"tag": "markdown", "content": _system_list_markdown("心跳超时", went_down, max_listed)})
+    if went_up:
+        elements.append({"tag": "markdown", "content": _system_list_markdown("已恢复", went_up, max_listed)})
+
+    header = {
+        "title": {
+            "tag": "plain_text",
+            "content": f"心跳监控  {len(went_down)} 个超时 / {len(went_up)} 个恢复"
         },
-        "header": {
-            "title": {
-                "tag": "plain_text",
-                "content": f"团购自动发布  {node_name}"
-            },
-            "subtitle": {
-                "tag": "plain_text",
-                "content": release_time
-            },
-            "template": header_color,
-            "padding": "8px 12px 8px 12px"
+        "subtitle": {
+            "tag": "plain_text",
+            "content": checked_at
         },
-        "body": {
-            "direction": "vertical",
-            "horizontal_spacing": "8px",
-            "vertical_spacing": "8px",
-            "horizontal_align": "left",
-            "vertical_align": "top",
-            "padding": "12px 12px 12px 12px",
-            "elements": elements
-        }
+        # 有超时即为红色，只有恢复为绿色
+        "template": "red" if went_down else "green",
+        "padding": "8px 12px 8px 12px"
     }
-    
-    return card
+
+    element_json = [dumps(element) for element in elements]
+    if at_user_id:
+        element_json.append(_at_element_json(at_user_id))
+
+    return RawJSON(
+        '{"schema":"2.0"'
+        f',"config":{_CARD_CONFIG_JSON}'
+        f',"header":{dumps(header)}'
+        f',"body":{{{_CARD_BODY_ATTRS_JSON},"elements":[{",".join(element_json)}]}}'
+        '}'
+    )
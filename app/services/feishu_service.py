@@ -1,38 +1,92 @@
 import json
 import logging
 import asyncio
-import lark_oapi as lark
-from lark_oapi.api.im.v1 import *
+import time
+from typing import Union
+import httpx
 from app.core.config import settings
+from app.core.metrics import FEISHU_SEND_LATENCY
+from app.services.feishu_http import FeishuHttpClient, TOKEN_INVALID_CODES
+from app.services.feishu_token import FeishuTokenProvider
 
 logger = logging.getLogger(__name__)
 
+# Transport errors raised before anything was sent; safe to retry (code -1)
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Code of a send that failed after the request may have reached Feishu
+# (e.g. a read timeout). Never retried: it could deliver the message twice.
+UNKNOWN_OUTCOME_CODE = -3
+
 class FeishuService:
-    # Initialize Lark Client
-    # Using internal/custom app credentials from settings
-    _client = lark.Client.builder() \
-        .app_id(settings.FEISHU_APP_ID or "") \
-        .app_secret(settings.FEISHU_APP_SECRET or "") \
-        .log_level(lark.LogLevel.INFO) \
-        .build()
+    # Lark SDK clients, built on first use
+    # Only used when FEISHU_TRANSPORT is "sdk" or as a fallback for the httpx transport,
+    # so processes that never send (the API) do not load the SDK at all
+    # shared_token -> client. With enable_set_token the SDK sends with the token
+    # passed in RequestOption; without it the SDK fetches its own per process.
+    _clients: dict = {}
+
+    @staticmethod
+    def _sdk_client(shared_token: bool = True):
+        client = FeishuService._clients.get(shared_token)
+        if client is None:
+            import lark_oapi as lark
+            # Using internal/custom app credentials from settings
+            client = lark.Client.builder() \
+                .app_id(settings.FEISHU_APP_ID or "") \
+                .app_secret(settings.FEISHU_APP_SECRET or "") \
+                .enable_set_token(shared_token) \
+                .log_level(lark.LogLevel.INFO) \
+                .build()
+            FeishuService._clients[shared_token] = client
+        return client
 
     @staticmethod
     async def get_tenant_access_token():
         """
-        SDK handles token management automatically.
-        This method is kept for compatibility but returns a dummy or internal token if needed.
-        For SDK usage, we don't need to manually call this.
+        Return the tenant_access_token shared by all processes through Redis.
+        Both transports send with it; the SDK only fetches its own token when
+        the shared one cannot be had.
+        """
+        return await FeishuTokenProvider.get_token()
+
+    @staticmethod
+    async def send_message(recipient_id: str, recipient_type: str, msg_type: str, content: Union[dict, str], raise_errors: bool = False):
+        """
+        Returns Feishu's answer; exceptions become code -1 unless raise_errors
+        is set, for callers that need to know whether the request was sent.
         """
-        # SDK 内部自动管理 Token，不需要手动获取
-        # 如果需要获取 Token 字符串（例如用于其他手动请求），可以通过 SDK 内部方法获取，
-        # 但标准用法是直接使用 client 发起业务请求。
-        return "managed_by_sdk"
+        started = time.perf_counter()
+        try:
+            response = await FeishuService._send_message(recipient_id, recipient_type, msg_type, content, raise_errors)
+        except Exception:
+            FEISHU_SEND_LATENCY.labels(code="-1").observe(time.perf_counter() - started)
+            raise
+        FEISHU_SEND_LATENCY.labels(code=str(response.get("code"))).observe(time.perf_counter() - started)
+        return response
 
     @staticmethod
-    async def send_message(recipient_id: str, recipient_type: str, msg_type: str, content: dict):
+    async def update_message(feishu_message_id: str, content: Union[dict, str]):
         """
-        Send message using Lark SDK.
-        This method is async, but SDK calls are synchronous, so we run them in a thread.
+        Replace the content of a card that was already sent.
+        Always uses the httpx transport.
+        """
+        try:
+            content_str = content if isinstance(content, str) else json.dumps(content)
+            body = await FeishuHttpClient.update_message(feishu_message_id, content_str)
+            return {"code": body.get("code"), "msg": body.get("msg")}
+        except Exception as e:
+            logger.exception(f"Exception in update_message: {str(e)}")
+            return {"code": -1, "msg": str(e)}
+
+    @staticmethod
+    async def _send_message(recipient_id: str, recipient_type: str, msg_type: str, content: Union[dict, str], raise_errors: bool = False):
+        """
+        Send message to Feishu.
+        content may be a dict or an already serialized JSON string (RawJSON),
+        which is sent as-is.
+        Uses the native async httpx transport by default and falls back to the
+        Lark SDK (run in a thread) when FEISHU_TRANSPORT is "sdk" or the httpx
+        transport cannot connect.
         """
         try:
             # 1. Map recipient_type
@@ -45,44 +99,95 @@ class FeishuService:
                 receive_id_type = "user_id"
             
             # 2. Build Request Body
-            # SDK expects JSON string for content
-            content_str = json.dumps(content)
-            
-            request = CreateMessageRequest.builder() \
-                .receive_id_type(receive_id_type) \
-                .request_body(CreateMessageRequestBody.builder() \
-                    .receive_id(recipient_id) \
-                    .msg_type(msg_type) \
-                    .content(content_str) \
-                    .build()) \
-                .build()
+            # Feishu expects JSON string for content
+            content_str = content if isinstance(content, str) else json.dumps(content)
 
-            # 3. Execute Request (in thread pool to avoid blocking async loop)
-            # client.im.v1.message.create is a blocking call
-            response = await asyncio.to_thread(
-                FeishuService._client.im.v1.message.create, request
-            )
+            if settings.FEISHU_TRANSPORT == "httpx":
+                try:
+                    return await FeishuService._send_via_http(recipient_id, receive_id_type, msg_type, content_str)
+                except httpx.ConnectError as e:
+                    # Nothing reached Feishu, so retrying through the SDK cannot duplicate the message
+                    logger.warning(f"Feishu httpx transport unavailable, falling back to SDK: {e}")
 
-            # 4. Handle Response
-            if not response.success():
-                logger.error(f"Feishu SDK Error: code={response.code}, msg={response.msg}, log_id={response.get_log_id()}")
-                return {"code": response.code, "msg": response.msg, "data": None}
-            
-            # SDK response.data is an object, we need to convert it to dict or extract fields
-            # The structure is response.data.message_id, etc.
-            resp_data = response.data
-            
-            # Extract useful info
-            return {
-                "code": 0,
-                "msg": "success",
-                "data": {
-                    "message_id": resp_data.message_id,
-                    "create_time": resp_data.create_time,
-                    # Add other fields if needed
-                }
-            }
+            return await FeishuService._send_via_sdk(recipient_id, receive_id_type, msg_type, content_str)
 
         except Exception as e:
+            if raise_errors:
+                raise
             logger.exception(f"Exception in send_message: {str(e)}")
             return {"code": -1, "msg": str(e)}
+
+    @staticmethod
+    async def _send_via_http(recipient_id: str, receive_id_type: str, msg_type: str, content_str: str):
+        body = await FeishuHttpClient.send_message(receive_id_type, recipient_id, msg_type, content_str)
+        if body.get("code") != 0:
+            return {"code": body.get("code"), "msg": body.get("msg"), "data": None}
+
+        resp_data = body.get("data") or {}
+        return {
+            "code": 0,
+            "msg": "success",
+            "data": {
+                "message_id": resp_data.get("message_id"),
+                "create_time": resp_data.get("create_time"),
+            }
+        }
+
+    @staticmethod
+    async def _send_via_sdk(recipient_id: str, receive_id_type: str, msg_type: str, content_str: str):
+        import lark_oapi as lark
+        from lark_oapi.api.im.v1 import CreateMessageRequest, CreateMessageRequestBody
+
+        request = CreateMessageRequest.builder() \
+            .receive_id_type(receive_id_type) \
+            .request_body(CreateMessageRequestBody.builder() \
+                .receive_id(recipient_id) \
+                .msg_type(msg_type) \
+                .content(content_str) \
+                .build()) \
+            .build()
+
+        # Use the shared token; if it cannot be had (e.g. we got here because
+        # Feishu is unreachable over httpx), let the SDK fetch its own
+        token = None
+        try:
+            token = await FeishuTokenProvider.get_token()
+        except Exception as e:
+            logger.warning(f"Shared tenant_access_token unavailable, SDK will fetch its own: {e}")
+
+        # Execute Request (in thread pool to avoid blocking async loop)
+        # client.im.v1.message.create is a blocking call
+        if token is None:
+            response = await asyncio.to_thread(
+                FeishuService._sdk_client(shared_token=False).im.v1.message.create, request
+            )
+        else:
+            for attempt in range(2):
+                option = lark.RequestOption.builder().tenant_access_token(token).build()
+                response = await asyncio.to_thread(
+                    FeishuService._sdk_client().im.v1.message.create, request, option
+                )
+                if response.code not in TOKEN_INVALID_CODES or attempt > 0:
+                    break
+                logger.warning(f"Feishu token rejected (code={response.code}), refreshing")
+                token = await FeishuTokenProvider.get_token(rejected=token)
+
+        # Handle Response
+        if not response.success():
+            logger.error(f"Feishu SDK Error: code={response.code}, msg={response.msg}, log_id={response.get_log_id()}")
+            return {"code": response.code, "msg": response.msg, "data": None}
+        
+        # SDK response.data is an object, we need to convert it to dict or extract fields
+        # The structure is response.data.message_id, etc.
+        resp_data = response.data
+        
+        # Extract useful info
+        return {
+            "code": 0,
+            "msg": "success",
+            "data": {
+                "message_id": resp_data.message_id,
+                "create_time": resp_data.create_time,
+                # Add other fields if needed
+            }
+        }
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Optional
+from app.core.config import settings
+from app.core.redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Delete the lock only if we still own it
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Drop the shared token only if it is the one Feishu rejected, so a token
+# another process has just refreshed is not thrown away
+INVALIDATE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'token') == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class FeishuTokenProvider:
+    """
+    tenant_access_token shared by every process through Redis.
+
+    Reads are served from an in-process copy that is re-checked against Redis
+    every FEISHU_TOKEN_LOCAL_TTL seconds. Once a token is within
+    FEISHU_TOKEN_REFRESH_MARGIN of expiry, one process refreshes it in the
+    background under a Redis lock while everyone keeps using the current one,
+    so sends only wait for a fetch when no valid token exists at all.
+    """
+    _token: Optional[str] = None
+    _expires_at: float = 0.0   # unix time
+    _checked_at: float = 0.0   # monotonic time of the last Redis read
+    _lock: Optional[asyncio.Lock] = None
+    _refresh_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _keys() -> tuple[str, str]:
+        app_id = settings.FEISHU_APP_ID or "default"
+        return f"Feishu_Token:{app_id}", f"Feishu_Token:{app_id}:lock"
+
+    @classmethod
+    def reset(cls):
+        """Forget loop-bound state (used right after fork); the cached token stays valid."""
+        cls._lock = None
+        cls._refresh_task = None
+
+    @classmethod
+    def _remember(cls, token: str, expires_at: float):
+        cls._token = token
+        cls._expires_at = expires_at
+        cls._checked_at = time.monotonic()
+
+    @classmethod
+    def _needs_refresh(cls) -> bool:
+        return time.time() >= cls._expires_at - settings.FEISHU_TOKEN_REFRESH_MARGIN
+
+    @classmethod
+    async def get_token(cls, rejected: Optional[str] = None) -> str:
+        """
+        Return a valid tenant_access_token.
+        Pass the token Feishu just rejected as rejected to force a new one.
+        """
+        if rejected is not None:
+            await cls._invalidate(rejected)
+
+        now = time.time()
+        if cls._token and now < cls._expires_at and time.monotonic() - cls._checked_at < settings.FEISHU_TOKEN_LOCAL_TTL:
+            if cls._needs_refresh():
+                cls._refresh_in_background()
+            return cls._token
+
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+        # One Redis read (and at most one fetch) per process at a time
+        async with cls._lock:
+            if not cls._token or time.monotonic() - cls._checked_at >= settings.FEISHU_TOKEN_LOCAL_TTL:
+                await cls._load()
+            if not cls._token or time.time() >= cls._expires_at:
+                await cls._refresh(wait=True)
+
+        if cls._needs_refresh():
+            cls._refresh_in_background()
+        return cls._token
+
+    @classmethod
+    async def _load(cls):
+        token_key, _ = cls._keys()
+        shared = await get_redis().hgetall(token_key)
+        if shared.get("token"):
+            cls._remember(shared["token"], float(shared["expires_at"]))
+        else:
+            cls._checked_at = time.monotonic()
+
+    @classmethod
+    async def _invalidate(cls, rejected: str):
+        if cls._token == rejected:
+            cls._token = None
+            cls._expires_at = 0.0
+        token_key, _ = cls._keys()
+        script = get_redis().register_script(INVALIDATE_SCRIPT)
+        await script(keys=[token_key], args=[rejected])
+
+    @classmethod
+    def _refresh_in_background(cls):
+        if cls._refresh_task is not None and not cls._refresh_task.done():
+            return
+        cls._refresh_task = asyncio.get_running_loop().create_task(cls._refresh(wait=False))
+        cls._refresh_task.add_done_callback(cls._log_refresh_failure)
+
+    @staticmethod
+    def _log_refresh_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Background tenant_access_token refresh failed: {task.exception()}")
+
+    @classmethod
+    async def _refresh(cls, wait: bool):
+        """
+        Fetch a new token under the Redis lock and publish it.
+        When another process holds the lock, wait for its token (wait=True) or
+        leave the refresh to it (wait=False).
+        """
+        from app.services.feishu_http import FeishuHttpClient
+
+        token_key, lock_key = cls._keys()
+        redis_client = get_redis()
+        owner = uuid.uuid4().hex
+
+        # If the holder dies without publishing, its lock expires and we take over
+        while not await redis_client.set(lock_key, owner, nx=True, px=settings.FEISHU_TOKEN_LOCK_TIMEOUT_MS):
+            if not wait:
+                return
+            await asyncio.sleep(0.05)
+            await cls._load()
+            if cls._token and time.time() < cls._expires_at:
+                return
+
+        try:
+            # Someone may have refreshed between our read and taking the lock
+            await cls._load()
+            if cls._token and not cls._needs_refresh():
+                return
+
+            token, expire = await FeishuHttpClient.fetch_tenant_access_token()
+            expires_at = time.time() + expire
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.hset(token_key, mapping={"token": token, "expires_at": expires_at})
+            pipe.expireat(token_key, int(expires_at))
+            await pipe.execute()
+            cls._remember(token, expires_at)
+            logger.info(f"Refreshed tenant_access_token, valid for {expire}s")
+        finally:
+            script = redis_client.register_script(RELEASE_LOCK_SCRIPT)
+            await script(keys=[lock_key], args=[owner])
@@ -0,0 +1,234 @@
+import time
+from app.core.config import settings
+from app.core.redis_pool import get_redis
+
+# Last-seen timestamp of every monitored system, scored by unix time
+HEARTBEATS_KEY = "Monitor_Heartbeats"
+# Consecutive timed-out checks per system (only systems currently failing)
+FAIL_COUNT_KEY = "Monitor_Fail_Count"
+# Systems currently reported as DOWN
+DOWN_KEY = "Monitor_Down"
+# Consecutive healthy checks per DOWN system (hysteresis before UP)
+RECOVER_COUNT_KEY = "Monitor_Recover_Count"
+# Transitions waiting to be reported, system_id -> DOWN/UP
+ALERT_PENDING_KEY = "Monitor_Alert_Pending"
+# Unix time the first pending transition of the current alert window was seen
+ALERT_WINDOW_KEY = "Monitor_Alert_Window_Start"
+# Transitions of the alert last handed out and not acked yet, system_id -> DOWN/UP
+ALERT_INFLIGHT_KEY = "Monitor_Alert_Inflight"
+# Set of systems of the old per-system key layout, emptied by migrate_legacy()
+LEGACY_SYSTEMS_KEY = "Monitored_Systems"
+LEGACY_MIGRATE_BATCH = 500
+
+# Finds timed-out systems with one ZRANGEBYSCORE and applies all fail-count
+# and UP/DOWN transitions server-side. Work is proportional to the number of
+# failing systems, not to the number of monitored systems.
+# A DOWN system only goes UP after ARGV[3] consecutive healthy checks, so a
+# flapping system does not alternate between DOWN and UP every cycle.
+# KEYS: heartbeats zset, fail count hash, down set, recover count hash
+# ARGV: cutoff timestamp, fail threshold, recover threshold
+# Returns: {went_down, went_up}
+CHECK_SCRIPT = """
+local threshold = tonumber(ARGV[2])
+local recover_threshold = tonumber(ARGV[3])
+local went_down, went_up = {}, {}
+local timed_out = {}
+
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[1])) do
+    timed_out[id] = true
+    redis.call('HDEL', KEYS[4], id)
+    local count = redis.call('HINCRBY', KEYS[2], id, 1)
+    if count >= threshold and redis.call('SADD', KEYS[3], id) == 1 then
+        table.insert(went_down, id)
+    end
+end
+
+for _, id in ipairs(redis.call('HKEYS', KEYS[2])) do
+    if not timed_out[id] then
+        redis.call('HDEL', KEYS[2], id)
+    end
+end
+
+for _, id in ipairs(redis.call('SMEMBERS', KEYS[3])) do
+    if not timed_out[id] and redis.call('HINCRBY', KEYS[4], id, 1) >= recover_threshold then
+        redis.call('SREM', KEYS[3], id)
+        redis.call('HDEL', KEYS[4], id)
+        table.insert(went_up, id)
+    end
+end
+
+return {went_down, went_up}
+"""
+
+# Adds this cycle's transitions to the pending alert and hands the whole
+# alert out once the window is over. A transition that undoes a pending one
+# (DOWN then UP again within the window) cancels it, unless the pending one
+# was already handed out: then the new state replaces it and is reported too.
+# Nothing is removed here: the caller acks the alert once it is stored
+# (ACK_ALERT_SCRIPT), so an alert that could not be stored is handed out
+# again on the next cycle.
+# KEYS: pending hash, window start key, in-flight hash
+# ARGV: now, window seconds, number of DOWN ids, DOWN ids..., UP ids...
+# Returns: flat {system_id, state, ...} when the alert is due, else {}
+ALERT_SCRIPT = """
+local now, window, n = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+
+local function apply(id, state, opposite)
+    if redis.call('HGET', KEYS[1], id) == opposite and redis.call('HGET', KEYS[3], id) ~= opposite then
+        redis.call('HDEL', KEYS[1], id)
+    else
+        redis.call('HSET', KEYS[1], id, state)
+    end
+end
+
+for i = 4, 3 + n do
+    apply(ARGV[i], 'DOWN', 'UP')
+end
+for i = 4 + n, #ARGV do
+    apply(ARGV[i], 'UP', 'DOWN')
+end
+
+if redis.call('HLEN', KEYS[1]) == 0 then
+    redis.call('DEL', KEYS[2], KEYS[3])
+    return {}
+end
+
+local start = tonumber(redis.call('GET', KEYS[2]))
+if not start then
+    redis.call('SET', KEYS[2], now)
+    start = now
+end
+if now - start < window then
+    return {}
+end
+
+local pending = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[3])
+for i = 1, #pending, 2 do
+    redis.call('HSET', KEYS[3], pending[i], pending[i + 1])
+end
+return pending
+"""
+
+# Removes the transitions of a stored alert. An entry whose state changed in
+# the meantime stays pending; leftovers start a new window.
+# KEYS: pending hash, window start key, in-flight hash
+# ARGV: now, then system_id, state pairs
+ACK_ALERT_SCRIPT = """
+for i = 2, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+if redis.call('HLEN', KEYS[1]) == 0 then
+    redis.call('DEL', KEYS[2])
+else
+    redis.call('SET', KEYS[2], ARGV[1])
+end
+redis.call('DEL', KEYS[3])
+return 0
+"""
+
+# Moves one batch of systems from the old layout (Monitored_Systems set plus
+# SystemA_Heartbeat:{id}, Monitor_Status:{id} and Monitor_Fail_Count:{id}
+# strings) into the heartbeat zset, fail count hash and down set, then drops
+# the old keys. ZADD NX keeps a heartbeat the new endpoint already recorded.
+# Systems without a last-seen time get score 0, i.e. they are timed out, as
+# the old check treated them.
+# KEYS: legacy set, heartbeats zset, fail count hash, down set
+# ARGV: batch size
+# Returns: number of systems moved
+LEGACY_MIGRATE_SCRIPT = """
+local ids = redis.call('SPOP', KEYS[1], tonumber(ARGV[1]))
+for _, id in ipairs(ids) do
+    local heartbeat_key = 'SystemA_Heartbeat:' .. id
+    local status_key = 'Monitor_Status:' .. id
+    local fail_count_key = 'Monitor_Fail_Count:' .. id
+
+    redis.call('ZADD', KEYS[2], 'NX', tonumber(redis.call('GET', heartbeat_key)) or 0, id)
+    local fail_count = tonumber(redis.call('GET', fail_count_key)) or 0
+    if fail_count > 0 then
+        redis.call('HSET', KEYS[3], id, fail_count)
+    end
+    if redis.call('GET', status_key) == 'DOWN' then
+        redis.call('SADD', KEYS[4], id)
+    end
+    redis.call('DEL', heartbeat_key, status_key, fail_count_key)
+end
+return #ids
+"""
+
+class HeartbeatService:
+    @staticmethod
+    async def record_heartbeat(system_id: str) -> int:
+        return await HeartbeatService.record_heartbeats([system_id])
+
+    @staticmethod
+    async def record_heartbeats(system_ids: list[str]) -> int:
+        """Record many heartbeats with a single ZADD."""
+        current_time = int(time.time())
+        await get_redis().zadd(HEARTBEATS_KEY, {system_id: current_time for system_id in system_ids})
+        return current_time
+
+    @staticmethod
+    async def migrate_legacy() -> int:
+        """
+        One-time move of the monitoring state kept by the old per-system keys,
+        so systems that stopped sending heartbeats before the upgrade are
+        still checked and DOWN systems are not reported again. A no-op once
+        Monitored_Systems is gone; returns the number of systems moved.
+        """
+        script = get_redis().register_script(LEGACY_MIGRATE_SCRIPT)
+        moved = 0
+        while True:
+            count = await script(
+                keys=[LEGACY_SYSTEMS_KEY, HEARTBEATS_KEY, FAIL_COUNT_KEY, DOWN_KEY],
+                args=[LEGACY_MIGRATE_BATCH],
+            )
+            moved += count
+            if count < LEGACY_MIGRATE_BATCH:
+                return moved
+
+    @staticmethod
+    async def check_timeouts() -> tuple[list[str], list[str]]:
+        """
+        Run one heartbeat check cycle in a single round trip.
+        Returns the systems that just went DOWN and the ones that just recovered.
+        """
+        redis_client = get_redis()
+        script = redis_client.register_script(CHECK_SCRIPT)
+        cutoff = int(time.time()) - settings.MONITOR_HEARTBEAT_TIMEOUT
+        went_down, went_up = await script(
+            keys=[HEARTBEATS_KEY, FAIL_COUNT_KEY, DOWN_KEY, RECOVER_COUNT_KEY],
+            args=[cutoff, settings.MONITOR_FAIL_THRESHOLD, settings.MONITOR_RECOVER_THRESHOLD],
+        )
+        return list(went_down), list(went_up)
+
+    @staticmethod
+    async def collect_alerts(went_down: list[str], went_up: list[str]) -> tuple[list[str], list[str]]:
+        """
+        Merge one cycle's transitions into the current alert window
+        (MONITOR_ALERT_WINDOW seconds, 0 = every cycle). Returns the systems to
+        report as DOWN and UP once the window is over, else two empty lists.
+        They stay pending until ack_alerts() is called for them.
+        """
+        script = get_redis().register_script(ALERT_SCRIPT)
+        pending = await script(
+            keys=[ALERT_PENDING_KEY, ALERT_WINDOW_KEY, ALERT_INFLIGHT_KEY],
+            args=[int(time.time()), settings.MONITOR_ALERT_WINDOW, len(went_down), *went_down, *went_up],
+        )
+        states = dict(zip(pending[::2], pending[1::2]))
+        down = sorted(system_id for system_id, state in states.items() if state == "DOWN")
+        up = sorted(system_id for system_id, state in states.items() if state == "UP")
+        return down, up
+
+    @staticmethod
+    async def ack_alerts(went_down: list[str], went_up: list[str]) -> None:
+        """Forget the transitions of an alert that has been stored and queued."""
+        args = [int(time.time())]
+        for system_id in went_down:
+            args += [system_id, "DOWN"]
+        for system_id in went_up:
+            args += [system_id, "UP"]
+        script = get_redis().register_script(ACK_ALERT_SCRIPT)
+        await script(keys=[ALERT_PENDING_KEY, ALERT_WINDOW_KEY, ALERT_INFLIGHT_KEY], args=args)
@@ -1,28 +1,120 @@
+import base64
+from datetime import datetime, timedelta
+from typing import Optional, Sequence, Union
+from sqlalchemy import and_, bindparam, func, insert, or_, tuple_, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from app.core.config import settings
+from app.core.metrics import observe_db
 from app.models.message import Message
 from app.schemas.message import MessageCreate, MessageUpdate
 
+# Claim order of the outbox: alerts first, bulk traffic last
+PRIORITY_LANES = ("high", "normal", "bulk")
+
 class MessageService:
     @staticmethod
-    async def create_message(db: AsyncSession, message_in: MessageCreate) -> Message:
-        db_message = Message(**message_in.model_dump())
+    def default_priority(sender: str, fallback: str = "normal") -> str:
+        return settings.MESSAGE_PRIORITY_BY_SENDER.get(sender, fallback)
+
+    @staticmethod
+    def _column_values(message_in: Union[MessageCreate, dict]) -> dict:
+        values = dict(message_in) if isinstance(message_in, dict) else message_in.model_dump()
+        if not values.get("priority"):
+            values["priority"] = MessageService.default_priority(values["sender"])
+        return values
+
+    @staticmethod
+    @observe_db("create_message")
+    async def create_message(db: AsyncSession, message_in: Union[MessageCreate, dict]) -> Message:
+        """
+        message_in may also be a plain dict of column values, e.g. when the
+        content is a pre-serialized RawJSON payload.
+        """
+        values = MessageService._column_values(message_in)
+        db_message = Message(**values)
         db.add(db_message)
         await db.commit()
         await db.refresh(db_message)
         return db_message
 
     @staticmethod
+    @observe_db("create_messages")
+    async def create_messages(db: AsyncSession, messages_in: list[MessageCreate]) -> list[Message]:
+        """
+        Insert many messages with one multi-row INSERT ... RETURNING.
+        Rows are returned in the same order as messages_in.
+        """
+        stmt = insert(Message).returning(Message, sort_by_parameter_order=True)
+        result = await db.scalars(stmt, [MessageService._column_values(message_in) for message_in in messages_in])
+        db_messages = result.all()
+        await db.commit()
+        return db_messages
+
+    @staticmethod
+    @observe_db("get_message")
     async def get_message(db: AsyncSession, message_id: int) -> Message:
         result = await db.execute(select(Message).filter(Message.id == message_id))
         return result.scalars().first()
 
     @staticmethod
-    async def get_messages(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[Message]:
-        result = await db.execute(select(Message).offset(skip).limit(limit))
-        return result.scalars().all()
+    def encode_cursor(message: Message) -> str:
+        raw = f"{message.created_at.isoformat()}|{message.id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple[datetime, int]:
+        """Raises ValueError for malformed cursors."""
+        try:
+            created_at, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            return datetime.fromisoformat(created_at), int(message_id)
+        except Exception as e:
+            raise ValueError(f"Invalid cursor: {cursor}") from e
+
+    @staticmethod
+    @observe_db("get_messages")
+    async def get_messages(
+        db: AsyncSession,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        status: Optional[str] = None,
+        sender: Optional[str] = None,
+        recipient_id: Optional[str] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+    ) -> tuple[list[Message], Optional[str]]:
+        """
+        Newest-first keyset pagination ordered by (created_at, id).
+        Returns the page and the cursor of the next page (None on the last page).
+        """
+        stmt = select(Message)
+        if status is not None:
+            stmt = stmt.filter(Message.status == status)
+        if sender is not None:
+            stmt = stmt.filter(Message.sender == sender)
+        if recipient_id is not None:
+            stmt = stmt.filter(Message.recipient_id == recipient_id)
+        if created_after is not None:
+            stmt = stmt.filter(Message.created_at >= created_after)
+        if created_before is not None:
+            stmt = stmt.filter(Message.created_at < created_before)
+        if cursor is not None:
+            cursor_created_at, cursor_id = MessageService.decode_cursor(cursor)
+            stmt = stmt.filter(tuple_(Message.created_at, Message.id) < tuple_(cursor_created_at, cursor_id))
+
+        # Fetch one extra row to know whether another page exists
+        stmt = stmt.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1)
+        result = await db.execute(stmt)
+        messages = result.scalars().all()
+
+        next_cursor = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            next_cursor = MessageService.encode_cursor(messages[-1])
+        return messages, next_cursor
     
     @staticmethod
+    @observe_db("update_message")
     async def update_message(db: AsyncSession, message_id: int, message_in: MessageUpdate) -> Message:
         db_message = await MessageService.get_message(db, message_id)
         if not db_message:
@@ -35,3 +127,201 @@ class MessageService:
         await db.commit()
         await db.refresh(db_message)
         return db_message
+
+    @staticmethod
+    @observe_db("find_by_upsert_key")
+    async def find_by_upsert_key(db: AsyncSession, upsert_key: str, statuses: Sequence[str], max_age: int) -> Optional[int]:
+        """
+        Id of the newest message with this upsert key in one of the given
+        statuses, created within the last max_age seconds.
+        """
+        result = await db.execute(
+            select(Message.id)
+            .where(
+                Message.upsert_key == upsert_key,
+                Message.status.in_(list(statuses)),
+                Message.created_at >= func.now() - timedelta(seconds=max_age),
+            )
+            .order_by(Message.id.desc())
+            .limit(1)
+        )
+        return result.scalar()
+
+    @staticmethod
+    @observe_db("replace_content")
+    async def replace_content(db: AsyncSession, message_id: int, content, statuses: Sequence[str]) -> Optional[Message]:
+        """
+        Overwrite the content of a message that is still in one of the given
+        statuses and return it; None when it is not (any more).
+        """
+        stmt = (
+            update(Message)
+            .where(Message.id == message_id, Message.status.in_(list(statuses)))
+            .values(content=content)
+            .returning(Message)
+            .execution_options(synchronize_session=False)
+        )
+        message = (await db.scalars(stmt)).first()
+        await db.commit()
+        return message
+
+    @staticmethod
+    @observe_db("transition_status")
+    async def transition_status(db: AsyncSession, message_id: int, expected: Union[str, Sequence[str]], status: str, **values) -> bool:
+        """
+        Move a message from an expected status to a new one with a single
+        UPDATE ... WHERE id = :id AND status = :expected RETURNING id.
+        Returns False when the row is missing or is no longer in the expected
+        status, e.g. because another worker already claimed it.
+        """
+        expected_statuses = [expected] if isinstance(expected, str) else list(expected)
+        stmt = (
+            update(Message)
+            .where(Message.id == message_id, Message.status.in_(expected_statuses))
+            .values(status=status, **values)
+            .returning(Message.id)
+            .execution_options(synchronize_session=False)
+        )
+        result = await db.execute(stmt)
+        updated = result.first() is not None
+        await db.commit()
+        return updated
+
+    @staticmethod
+    @observe_db("claim_message")
+    async def claim_message(db: AsyncSession, message_id: int) -> Optional[int]:
+        """
+        Claim one pending message for sending (pending -> sending).
+        Returns its number of failed attempts so far, or None if it was not pending.
+        """
+        stmt = (
+            update(Message)
+            .where(Message.id == message_id, Message.status == "pending")
+            .values(status="sending")
+            .returning(Message.attempts)
+            .execution_options(synchronize_session=False)
+        )
+        result = await db.execute(stmt)
+        attempts = result.scalar()
+        await db.commit()
+        return attempts
+
+    @staticmethod
+    @observe_db("bulk_transition_status")
+    async def bulk_transition_status(db: AsyncSession, expected: str, results: list[dict]) -> None:
+        """
+        Apply many status results in one executemany UPDATE.
+        Each result needs "id" and "status" and may carry "feishu_message_id"
+        and "error_log"; a column a result does not carry keeps its value, as
+        with transition_status. Rows that left the expected status are left
+        untouched.
+        """
+        if not results:
+            return
+        table = Message.__table__
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("b_id"), table.c.status == expected)
+            .values(
+                status=bindparam("b_status"),
+                feishu_message_id=func.coalesce(bindparam("b_feishu_message_id", type_=table.c.feishu_message_id.type), table.c.feishu_message_id),
+                error_log=func.coalesce(bindparam("b_error_log", type_=table.c.error_log.type), table.c.error_log),
+            )
+        )
+        await db.execute(stmt, [
+            {
+                "b_id": result["id"],
+                "b_status": result["status"],
+                "b_feishu_message_id": result.get("feishu_message_id"),
+                "b_error_log": result.get("error_log"),
+            }
+            for result in results
+        ])
+        await db.commit()
+
+    @staticmethod
+    @observe_db("release_deferred")
+    async def release_deferred(db: AsyncSession, message_ids: list[int]) -> list[Message]:
+        """Move due deferred/retrying messages back to pending and return them."""
+        stmt = (
+            update(Message)
+            .where(Message.id.in_(message_ids), Message.status.in_(["deferred", "retrying"]))
+            .values(status="pending")
+            .returning(Message)
+            .execution_options(synchronize_session=False)
+        )
+        result = await db.scalars(stmt)
+        messages = result.all()
+        await db.commit()
+        return messages
+
+    @staticmethod
+    @observe_db("ids_in_status")
+    async def ids_in_status(db: AsyncSession, message_ids: Sequence[int], statuses: Sequence[str]) -> set[int]:
+        """The subset of message_ids whose rows are in one of the given statuses."""
+        if not message_ids:
+            return set()
+        result = await db.execute(
+            select(Message.id).where(Message.id.in_(list(message_ids)), Message.status.in_(list(statuses)))
+        )
+        return set(result.scalars().all())
+
+    @staticmethod
+    @observe_db("overdue_deferred")
+    async def overdue_deferred(db: AsyncSession, overdue_after: int, limit: int) -> list[int]:
+        """
+        Ids of deferred/retrying rows due more than overdue_after seconds ago.
+        Normally the release task has long moved them on, so their entry in the
+        deferred schedule was lost.
+        """
+        due_at = func.coalesce(Message.next_attempt_at, Message.updated_at)
+        result = await db.execute(
+            select(Message.id)
+            .where(
+                Message.status.in_(["deferred", "retrying"]),
+                due_at < func.now() - timedelta(seconds=overdue_after),
+            )
+            .order_by(Message.id)
+            .limit(limit)
+        )
+        return result.scalars().all()
+
+    @staticmethod
+    @observe_db("claim_pending")
+    async def claim_pending(db: AsyncSession, limit: int, stale_after: int) -> list[Message]:
+        """
+        Claim up to `limit` messages for sending, lane by lane in PRIORITY_LANES
+        order, with one statement per lane:
+        UPDATE ... SET status = 'sending' WHERE id IN (SELECT ... WHERE priority = :lane
+        ORDER BY id FOR UPDATE SKIP LOCKED LIMIT n) RETURNING.
+        Each lane is an ordered range scan of ix_messages_outbox_priority, so a
+        claim never sorts the whole backlog. Concurrent dispatchers never claim
+        the same row. Rows left in "sending" for more than stale_after seconds
+        (their dispatcher died) are claimed again.
+        """
+        claimable_status = or_(
+            Message.status == "pending",
+            and_(Message.status == "sending", Message.updated_at < func.now() - timedelta(seconds=stale_after)),
+        )
+        messages = []
+        for lane in PRIORITY_LANES:
+            remaining = limit - len(messages)
+            if remaining <= 0:
+                break
+            claimable = (
+                select(Message.id)
+                .where(Message.priority == lane, claimable_status)
+                .order_by(Message.id)
+                .limit(remaining)
+                .with_for_update(skip_locked=True)
+            )
+            stmt = (
+                update(Message)
+                .where(Message.id.in_(claimable.scalar_subquery()))
+                .values(status="sending")
+                .returning(Message)
+                .execution_options(synchronize_session=False)
+            )
+            messages.extend((await db.scalars(stmt)).all())
+        await db.commit()
+        return messages
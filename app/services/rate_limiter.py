@@ -0,0 +1,120 @@
+import asyncio
+from typing import Optional
+from app.core.config import settings
+from app.core.redis_pool import get_redis
+
+# Feishu error codes meaning "too many requests"
+RATE_LIMIT_CODES = {99991400, 230020}
+
+# GCRA over two keys at once (whole app and single recipient), shared by every
+# worker through Redis. Nothing is consumed unless both keys allow the send.
+# The app rate is scaled by an adaptive factor that drops when Feishu reports
+# rate limiting and recovers linearly over time.
+# KEYS: app tat, recipient tat, factor hash
+# ARGV: app rate, app burst, recipient rate, recipient burst, recovery per second
+# Returns: 0 when allowed, otherwise milliseconds until the next slot
+ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+
+local f = tonumber(redis.call('HGET', KEYS[3], 'f') or '1')
+local ft = tonumber(redis.call('HGET', KEYS[3], 't') or now)
+local factor = math.min(1, f + (now - ft) / 1000 * tonumber(ARGV[5]))
+
+local function check(key, rate, burst)
+    local interval = 1000 / rate
+    local tat = tonumber(redis.call('GET', key) or now)
+    if tat < now then
+        tat = now
+    end
+    local new_tat = tat + interval
+    local allow_at = new_tat - interval * burst
+    if now < allow_at then
+        return new_tat, allow_at - now
+    end
+    return new_tat, 0
+end
+
+local app_tat, app_wait = check(KEYS[1], tonumber(ARGV[1]) * factor, tonumber(ARGV[2]))
+local rcpt_tat, rcpt_wait = check(KEYS[2], tonumber(ARGV[3]), tonumber(ARGV[4]))
+if app_wait > 0 or rcpt_wait > 0 then
+    return math.ceil(math.max(app_wait, rcpt_wait))
+end
+
+redis.call('SET', KEYS[1], app_tat, 'PX', math.ceil(app_tat - now) + 1000)
+redis.call('SET', KEYS[2], rcpt_tat, 'PX', math.ceil(rcpt_tat - now) + 1000)
+return 0
+"""
+
+# Multiplicative decrease of the adaptive factor
+# KEYS: factor hash
+# ARGV: decrease multiplier, minimum factor, recovery per second
+PENALIZE_SCRIPT = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+
+local f = tonumber(redis.call('HGET', KEYS[1], 'f') or '1')
+local ft = tonumber(redis.call('HGET', KEYS[1], 't') or now)
+local factor = math.min(1, f + (now - ft) / 1000 * tonumber(ARGV[3]))
+
+factor = math.max(tonumber(ARGV[2]), factor * tonumber(ARGV[1]))
+redis.call('HSET', KEYS[1], 'f', factor, 't', now)
+redis.call('PEXPIRE', KEYS[1], 3600000)
+return tostring(factor)
+"""
+
+class RateLimited(Exception):
+    """The send must be retried later; retry_after is in seconds."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limited, retry after {retry_after:.3f}s")
+        self.retry_after = retry_after
+
+class FeishuRateLimiter:
+    @staticmethod
+    def _keys(recipient_id: str) -> list[str]:
+        app_id = settings.FEISHU_APP_ID or "default"
+        return [
+            f"Feishu_RateLimit:app:{app_id}",
+            f"Feishu_RateLimit:recipient:{recipient_id}",
+            f"Feishu_RateLimit:factor:{app_id}",
+        ]
+
+    @staticmethod
+    async def acquire(recipient_id: str, max_wait: Optional[float] = None) -> None:
+        """
+        Wait for a send slot for this recipient.
+        Raises RateLimited when the next slot is further away than max_wait,
+        so the caller can reschedule instead of holding a worker.
+        """
+        max_wait = settings.FEISHU_RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+        script = get_redis().register_script(ACQUIRE_SCRIPT)
+        waited = 0.0
+        while True:
+            retry_after_ms = await script(
+                keys=FeishuRateLimiter._keys(recipient_id),
+                args=[
+                    settings.FEISHU_APP_RATE,
+                    settings.FEISHU_APP_BURST,
+                    settings.FEISHU_RECIPIENT_RATE,
+                    settings.FEISHU_RECIPIENT_BURST,
+                    settings.FEISHU_RATE_LIMIT_RECOVERY,
+                ],
+            )
+            if not retry_after_ms:
+                return
+            retry_after = int(retry_after_ms) / 1000
+            if waited + retry_after > max_wait:
+                raise RateLimited(retry_after)
+            await asyncio.sleep(retry_after)
+            waited += retry_after
+
+    @staticmethod
+    async def penalize() -> float:
+        """Feishu reported rate limiting: slow the whole app down."""
+        script = get_redis().register_script(PENALIZE_SCRIPT)
+        factor = await script(
+            keys=FeishuRateLimiter._keys("")[2:],
+            args=[0.5, settings.FEISHU_RATE_LIMIT_MIN_FACTOR, settings.FEISHU_RATE_LIMIT_RECOVERY],
+        )
+        return float(factor)
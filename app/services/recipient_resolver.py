@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+from app.core.config import settings
+from app.core.redis_pool import get_redis
+from app.services.feishu_http import FeishuHttpClient
+
+logger = logging.getLogger(__name__)
+
+# recipient_type -> kind of id looked up
+RESOLVABLE_TYPES = {"email": "email", "user_id": "user_id"}
+# Feishu accepts at most 50 ids per batch lookup
+LOOKUP_BATCH_SIZE = 50
+
+class RecipientNotFound(Exception):
+    """Feishu has no user for this email / user_id."""
+
+    def __init__(self, recipient_type: str, recipient_id: str):
+        super().__init__(f"Unknown Feishu recipient: {recipient_type}={recipient_id}")
+        self.recipient_type = recipient_type
+        self.recipient_id = recipient_id
+
+class RecipientLookupUnavailable(Exception):
+    """Lookups of this kind failed recently and are skipped until FEISHU_RECIPIENT_ERROR_TTL is over."""
+
+class RecipientResolver:
+    """
+    Resolves email / user_id recipients to open_ids through Feishu's batch ID
+    lookups, so Feishu does not resolve them again on every send and unknown
+    addresses fail before a send is attempted.
+
+    Results are cached in Redis (unknown recipients for a shorter time) and in
+    an in-process LRU with TTL. A lookup with nothing else in flight goes out
+    at once; lookups arriving while one is in flight are coalesced for
+    FEISHU_RECIPIENT_BATCH_WINDOW_MS into a single batch call. That only helps
+    processes with many sends in flight (send consumer, outbox): a prefork
+    Celery worker sends one message at a time, so each cold recipient costs
+    its own lookup there. Batching for those comes from callers holding many
+    recipients, which warm() the cache up front: the outbox per claimed
+    batch, warm_recipients_task for batches published by enqueue_messages
+    and broadcasts (resolve_many).
+    """
+    # (kind, value) -> (open_id or None when unknown, monotonic expiry)
+    _local: "OrderedDict[tuple[str, str], tuple[Optional[str], float]]" = OrderedDict()
+    # kind -> value -> future of the open_id, waiting for the next batch call
+    _pending: dict[str, dict[str, asyncio.Future]] = {}
+    _flush_timers: dict[str, asyncio.TimerHandle] = {}
+    _flushing: set[asyncio.Task] = set()
+
+    @staticmethod
+    def normalize(kind: str, value: str) -> str:
+        value = value.strip()
+        return value.lower() if kind == "email" else value
+
+    @staticmethod
+    def _redis_key(kind: str, value: str) -> str:
+        # open_ids differ per app, so apps sharing a Redis must not share entries
+        app_id = settings.FEISHU_APP_ID or "default"
+        return f"Feishu_Recipient:{app_id}:{kind}:{value}"
+
+    @staticmethod
+    def _unavailable_key(kind: str) -> str:
+        app_id = settings.FEISHU_APP_ID or "default"
+        return f"Feishu_Recipient_Unavailable:{app_id}:{kind}"
+
+    @classmethod
+    def reset(cls):
+        """Forget loop-bound lookups (used right after fork); cached ids stay valid."""
+        cls._pending = {}
+        cls._flush_timers = {}
+        cls._flushing = set()
+
+    @classmethod
+    def _local_get(cls, kind: str, value: str) -> tuple[bool, Optional[str]]:
+        entry = cls._local.get((kind, value))
+        if entry is None:
+            return False, None
+        if entry[1] < time.monotonic():
+            del cls._local[(kind, value)]
+            return False, None
+        cls._local.move_to_end((kind, value))
+        return True, entry[0]
+
+    @classmethod
+    def _local_put(cls, kind: str, value: str, open_id: Optional[str]):
+        ttl = settings.FEISHU_RECIPIENT_LOCAL_TTL
+        if open_id is None:
+            ttl = min(ttl, settings.FEISHU_RECIPIENT_NEGATIVE_TTL)
+        cls._local[(kind, value)] = (open_id, time.monotonic() + ttl)
+        cls._local.move_to_end((kind, value))
+        while len(cls._local) > settings.FEISHU_RECIPIENT_LOCAL_MAX:
+            cls._local.popitem(last=False)
+
+    @classmethod
+    async def resolve_recipient(cls, recipient_id: str, recipient_type: str) -> tuple[str, str]:
+        """
+        Return (recipient_id, recipient_type) to send to: ("ou_...", "feishu_user")
+        for resolvable types, the input unchanged otherwise or when the lookup
+        itself fails. Raises RecipientNotFound for unknown recipients.
+        """
+        kind = RESOLVABLE_TYPES.get(recipient_type)
+        if kind is None:
+            return recipient_id, recipient_type
+        try:
+            open_id = await cls.resolve(kind, recipient_id)
+        except RecipientLookupUnavailable:
+            # Already logged when the lookup failed
+            return recipient_id, recipient_type
+        except Exception as e:
+            # Feishu can still resolve it at send time
+            logger.warning(f"Recipient lookup failed for {recipient_type}={recipient_id}, sending as-is: {e}")
+            return recipient_id, recipient_type
+        if open_id is None:
+            raise RecipientNotFound(recipient_type, recipient_id)
+        return open_id, "feishu_user"
+
+    @classmethod
+    async def resolve(cls, kind: str, value: str) -> Optional[str]:
+        """open_id for one email / user_id, or None when Feishu does not know it."""
+        value = cls.normalize(kind, value)
+        hit, open_id = cls._local_get(kind, value)
+        if hit:
+            return open_id
+
+        pending = cls._pending.setdefault(kind, {})
+        future = pending.get(value)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = pending[value] = loop.create_future()
+            # Nothing in flight means nothing to coalesce with: do not wait for the window
+            if len(pending) >= LOOKUP_BATCH_SIZE or not cls._flushing:
+                cls._schedule_flush(kind, 0)
+            elif kind not in cls._flush_timers:
+                cls._schedule_flush(kind, settings.FEISHU_RECIPIENT_BATCH_WINDOW_MS / 1000)
+        return await future
+
+    @classmethod
+    def _schedule_flush(cls, kind: str, delay: float):
+        timer = cls._flush_timers.pop(kind, None)
+        if timer is not None:
+            timer.cancel()
+        loop = asyncio.get_running_loop()
+        if delay:
+            cls._flush_timers[kind] = loop.call_later(delay, cls._start_flush, kind)
+        else:
+            cls._start_flush(kind)
+
+    @classmethod
+    def _start_flush(cls, kind: str):
+        task = asyncio.get_running_loop().create_task(cls._flush(kind))
+        cls._flushing.add(task)
+        task.add_done_callback(cls._flushing.discard)
+
+    @classmethod
+    async def _flush(cls, kind: str):
+        cls._flush_timers.pop(kind, None)
+        batch = cls._pending.pop(kind, {})
+        if not batch:
+            return
+        try:
+            results = await cls.resolve_many(kind, list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for value, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(value))
+
+    @classmethod
+    async def warm(cls, recipients: Iterable[tuple[str, str]]):
+        """Resolve many (recipient_type, recipient_id) pairs with as few lookups as possible."""
+        by_kind: dict[str, set[str]] = {}
+        for recipient_type, recipient_id in recipients:
+            kind = RESOLVABLE_TYPES.get(recipient_type)
+            if kind is not None:
+                by_kind.setdefault(kind, set()).add(recipient_id)
+        for kind, values in by_kind.items():
+            try:
+                await cls.resolve_many(kind, values)
+            except RecipientLookupUnavailable:
+                pass
+            except Exception as e:
+                logger.warning(f"Failed to pre-resolve {len(values)} {kind} recipients: {e}")
+
+    @classmethod
+    async def resolve_many(cls, kind: str, values: Iterable[str]) -> dict[str, Optional[str]]:
+        """
+        open_ids for many emails / user_ids, keyed by normalized value.
+        Local cache first, then one Redis MGET, then Feishu for whatever is left.
+        A failed Feishu lookup (e.g. the app lacks the contact scope) skips
+        further lookups of this kind for FEISHU_RECIPIENT_ERROR_TTL across all
+        processes; meanwhile uncached values raise RecipientLookupUnavailable.
+        """
+        results: dict[str, Optional[str]] = {}
+        missing = []
+        for value in dict.fromkeys(cls.normalize(kind, v) for v in values):
+            hit, open_id = cls._local_get(kind, value)
+            if hit:
+                results[value] = open_id
+            else:
+                missing.append(value)
+        if not missing:
+            return results
+
+        redis_client = get_redis()
+        # The error marker rides along in the same MGET
+        unavailable, *cached = await redis_client.mget(
+            [cls._unavailable_key(kind), *(cls._redis_key(kind, value) for value in missing)]
+        )
+        unresolved = []
+        for value, open_id in zip(missing, cached):
+            if open_id is None:
+                unresolved.append(value)
+                continue
+            # "" marks a recipient Feishu does not know
+            results[value] = open_id or None
+            cls._local_put(kind, value, results[value])
+        if not unresolved:
+            return results
+        if unavailable is not None:
+            raise RecipientLookupUnavailable(f"{kind} lookups skipped after a recent failure: {unavailable}")
+
+        chunks = [unresolved[i:i + LOOKUP_BATCH_SIZE] for i in range(0, len(unresolved), LOOKUP_BATCH_SIZE)]
+        found: dict[str, str] = {}
+        try:
+            for chunk_found in await asyncio.gather(*(cls._lookup(kind, chunk) for chunk in chunks)):
+                found.update(chunk_found)
+        except Exception as e:
+            logger.warning(f"{kind} lookup failed, skipping {kind} lookups for {settings.FEISHU_RECIPIENT_ERROR_TTL}s: {e}")
+            try:
+                await redis_client.set(cls._unavailable_key(kind), str(e) or type(e).__name__, ex=settings.FEISHU_RECIPIENT_ERROR_TTL)
+            except Exception:
+                pass
+            raise
+
+        pipe = redis_client.pipeline(transaction=False)
+        for value in unresolved:
+            open_id = found.get(value)
+            results[value] = open_id
+            cls._local_put(kind, value, open_id)
+            if open_id:
+                pipe.set(cls._redis_key(kind, value), open_id, ex=settings.FEISHU_RECIPIENT_CACHE_TTL)
+            else:
+                pipe.set(cls._redis_key(kind, value), "", ex=settings.FEISHU_RECIPIENT_NEGATIVE_TTL)
+        await pipe.execute()
+        logger.info(f"Resolved {len(found)}/{len(unresolved)} {kind} recipients through Feishu")
+        return results
+
+    @staticmethod
+    async def _lookup(kind: str, values: list[str]) -> dict[str, str]:
+        """One Feishu batch lookup (at most LOOKUP_BATCH_SIZE values); unknown values are left out."""
+        if kind == "email":
+            body = await FeishuHttpClient.request(
+                "POST",
+                "/open-apis/contact/v3/users/batch_get_id",
+                params={"user_id_type": "open_id"},
+                json={"emails": values},
+            )
+            if body.get("code") != 0:
+                raise RuntimeError(f"batch_get_id failed: code={body.get('code')}, msg={body.get('msg')}")
+            users = (body.get("data") or {}).get("user_list") or []
+            return {user["email"].lower(): user["user_id"] for user in users if user.get("user_id")}
+
+        body = await FeishuHttpClient.request(
+            "GET",
+            "/open-apis/contact/v3/users/batch",
+            params={"user_id_type": "user_id", "user_ids": values},
+        )
+        if body.get("code") != 0:
+            raise RuntimeError(f"users/batch failed: code={body.get('code')}, msg={body.get('msg')}")
+        items = (body.get("data") or {}).get("items") or []
+        return {item["user_id"]: item["open_id"] for item in items if item.get("user_id") and item.get("open_id")}
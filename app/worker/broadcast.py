@@ -0,0 +1,251 @@
+"""
+Broadcast fan-out.
+
+A broadcast is sent in chunks of BROADCAST_BATCH_SIZE pending deliveries. When
+the message type and recipient type allow it, each chunk is a single call to
+Feishu's message/v4/batch_send; otherwise the chunk is sent as parallel single
+messages. Results are written per chunk, so a broadcast interrupted by an open
+circuit or an unexpected error is resumed later from its remaining pending
+deliveries. A broadcast whose worker died is claimed again after BROADCAST_CLAIM_TIMEOUT, and
+sweep_broadcasts() republishes broadcasts whose task was lost.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Optional
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import SEND_RESULTS
+from app.models.broadcast import Broadcast
+from app.services.broadcast_service import BroadcastService
+from app.services.circuit_breaker import FeishuCircuitBreaker, CircuitOpen
+from app.services.feishu_http import FeishuHttpClient
+from app.services.feishu_service import FeishuService, NOT_SENT_ERRORS, UNKNOWN_OUTCOME_CODE
+from app.services.rate_limiter import FeishuRateLimiter, RateLimited, RATE_LIMIT_CODES
+from app.services.recipient_resolver import RecipientResolver, RecipientNotFound
+from app.worker.dispatch import enqueue_broadcast
+
+logger = logging.getLogger(__name__)
+
+# Message types message/v4/batch_send accepts
+BATCH_SEND_MSG_TYPES = {"text", "image", "post", "share_chat", "interactive"}
+# recipient_type -> (id list field, invalid id list field) of batch_send.
+# Emails are resolved to open_ids first.
+BATCH_SEND_ID_FIELDS = {
+    "feishu_user": ("open_ids", "invalid_open_ids"),
+    "email": ("open_ids", "invalid_open_ids"),
+    "user_id": ("user_ids", "invalid_user_ids"),
+}
+# error_code of deliveries whose email / user_id Feishu does not know
+UNKNOWN_RECIPIENT_CODE = -2
+
+class _PartialChunk(Exception):
+    """A chunk stopped by an open circuit, with the results it did produce."""
+
+    def __init__(self, results: list[dict], error: CircuitOpen):
+        super().__init__(str(error))
+        self.results = results
+        self.error = error
+
+async def _acquire_slot(key: str):
+    # A broadcast is bulk work: wait for the quota instead of deferring
+    while True:
+        try:
+            await FeishuRateLimiter.acquire(key)
+            return
+        except RateLimited as e:
+            await asyncio.sleep(e.retry_after)
+
+async def _call(send: Callable[[], Awaitable[dict]], rate_key: str) -> dict:
+    """
+    One Feishu call behind the circuit breaker and rate limiter, retried in
+    place on rate limiting and retryable codes. A transport error is only
+    retried when the request never left (NOT_SENT_ERRORS); any other
+    exception yields UNKNOWN_OUTCOME_CODE. Raises CircuitOpen.
+    """
+    response: dict = {}
+    for attempt in range(1, settings.BROADCAST_MAX_ATTEMPTS + 1):
+        if settings.FEISHU_CIRCUIT_ENABLED:
+            await FeishuCircuitBreaker.allow()
+        if settings.FEISHU_RATE_LIMIT_ENABLED:
+            await _acquire_slot(rate_key)
+
+        started = time.monotonic()
+        try:
+            response = await send()
+        except NOT_SENT_ERRORS as e:
+            logger.warning(f"Broadcast call could not connect: {e}")
+            response = {"code": -1, "msg": str(e)}
+        except Exception as e:
+            logger.exception("Broadcast call failed, outcome unknown")
+            response = {"code": UNKNOWN_OUTCOME_CODE, "msg": str(e)}
+        code = response.get("code")
+
+        if settings.FEISHU_CIRCUIT_ENABLED:
+            failed = code in settings.SEND_RETRYABLE_CODES or code == UNKNOWN_OUTCOME_CODE
+            await FeishuCircuitBreaker.record(failed, time.monotonic() - started)
+
+        if attempt == settings.BROADCAST_MAX_ATTEMPTS or code == UNKNOWN_OUTCOME_CODE:
+            break
+        if code in RATE_LIMIT_CODES:
+            await FeishuRateLimiter.penalize()
+            await asyncio.sleep(settings.FEISHU_RATE_LIMIT_PENALTY_DELAY)
+        elif code in settings.SEND_RETRYABLE_CODES:
+            delay = settings.SEND_RETRY_BASE_DELAY * 2 ** (attempt - 1)
+            await asyncio.sleep(delay / 2 + random.uniform(0, delay / 2))
+        else:
+            break
+    return response
+
+async def _send_batch(broadcast: Broadcast, chunk: list) -> list[dict]:
+    """Send one chunk with a single batch_send call."""
+    id_field, invalid_field = BATCH_SEND_ID_FIELDS[broadcast.recipient_type]
+    results = []
+    targets = {row.id: row.recipient_id for row in chunk}
+
+    if broadcast.recipient_type == "email":
+        try:
+            open_ids = await RecipientResolver.resolve_many("email", targets.values())
+        except Exception as e:
+            # batch_send takes no emails; single sends let Feishu resolve them
+            logger.warning(f"Broadcast {broadcast.id}: email lookup failed, sending one by one: {e}")
+            return await _send_each(broadcast, chunk)
+        for delivery_id, email in list(targets.items()):
+            open_id = open_ids.get(RecipientResolver.normalize("email", email))
+            if open_id is None:
+                results.append({"id": delivery_id, "status": "failed", "error_code": UNKNOWN_RECIPIENT_CODE})
+                del targets[delivery_id]
+            else:
+                targets[delivery_id] = open_id
+        if not targets:
+            return results
+
+    response = await _call(
+        lambda: FeishuHttpClient.batch_send(broadcast.msg_type, broadcast.content, id_field, list(set(targets.values()))),
+        f"broadcast:{broadcast.id}",
+    )
+    code = response.get("code")
+    if code != 0:
+        logger.error(f"Broadcast {broadcast.id}: batch_send failed for {len(targets)} recipients: {response}")
+        return results + [{"id": delivery_id, "status": "failed", "error_code": code} for delivery_id in targets]
+
+    data = response.get("data") or {}
+    batch_message_id = data.get("message_id")
+    invalid = set(data.get(invalid_field) or [])
+    for delivery_id, recipient_id in targets.items():
+        if recipient_id in invalid:
+            results.append({"id": delivery_id, "status": "failed", "error_code": UNKNOWN_RECIPIENT_CODE})
+        else:
+            results.append({"id": delivery_id, "status": "sent", "feishu_message_id": batch_message_id})
+    return results
+
+async def _send_each(broadcast: Broadcast, chunk: list) -> list[dict]:
+    """
+    Send one chunk as parallel single messages. When the circuit opens midway
+    the finished results are kept and CircuitOpen is raised afterwards.
+    """
+    semaphore = asyncio.Semaphore(settings.BROADCAST_SEND_CONCURRENCY)
+    circuit_open: list[CircuitOpen] = []
+
+    async def _send_one(delivery_id: int, recipient_id: str) -> Optional[dict]:
+        async with semaphore:
+            if circuit_open:
+                return None
+            target_id, target_type = recipient_id, broadcast.recipient_type
+            if settings.FEISHU_RESOLVE_RECIPIENTS:
+                try:
+                    target_id, target_type = await RecipientResolver.resolve_recipient(recipient_id, target_type)
+                except RecipientNotFound:
+                    return {"id": delivery_id, "status": "failed", "error_code": UNKNOWN_RECIPIENT_CODE}
+            try:
+                response = await _call(
+                    lambda: FeishuService.send_message(
+                        target_id, target_type, broadcast.msg_type, broadcast.content, raise_errors=True,
+                    ),
+                    target_id,
+                )
+            except CircuitOpen as e:
+                circuit_open.append(e)
+                return None
+            if response.get("code") == 0:
+                message_id = (response.get("data") or {}).get("message_id")
+                return {"id": delivery_id, "status": "sent", "feishu_message_id": message_id}
+            return {"id": delivery_id, "status": "failed", "error_code": response.get("code")}
+
+    results = await asyncio.gather(*(_send_one(row.id, row.recipient_id) for row in chunk))
+    results = [result for result in results if result is not None]
+    if circuit_open:
+        raise _PartialChunk(results, circuit_open[0])
+    return results
+
+async def _record(db, broadcast_id: int, results: list[dict]):
+    await BroadcastService.record_deliveries(db, broadcast_id, results)
+    for result in results:
+        SEND_RESULTS.labels(status=result["status"]).inc()
+
+async def process_broadcast(broadcast_id: int):
+    async with AsyncSessionLocal() as db:
+        broadcast = await BroadcastService.claim_broadcast(db, broadcast_id, settings.BROADCAST_CLAIM_TIMEOUT)
+        if broadcast is None:
+            logger.info(f"Broadcast {broadcast_id} is no longer pending, skipping")
+            return
+
+        use_batch = (
+            settings.BROADCAST_USE_BATCH_API
+            and broadcast.msg_type in BATCH_SEND_MSG_TYPES
+            and broadcast.recipient_type in BATCH_SEND_ID_FIELDS
+        )
+        logger.info(f"Sending broadcast {broadcast_id} to {broadcast.total} recipients, batch_send={use_batch}")
+
+        after_id = 0
+        try:
+            while True:
+                chunk = await BroadcastService.pending_deliveries(db, broadcast_id, after_id, settings.BROADCAST_BATCH_SIZE)
+                if not chunk:
+                    break
+                after_id = chunk[-1].id
+                try:
+                    results = await (_send_batch(broadcast, chunk) if use_batch else _send_each(broadcast, chunk))
+                except _PartialChunk as e:
+                    await _record(db, broadcast_id, e.results)
+                    raise e.error
+                await _record(db, broadcast_id, results)
+        except CircuitOpen as e:
+            # Resume with the remaining pending deliveries once Feishu recovers
+            delay = e.retry_after + random.uniform(0, settings.FEISHU_CIRCUIT_OPEN_SECONDS / 2)
+            await db.rollback()
+            await BroadcastService.release_broadcast(db, broadcast_id)
+            enqueue_broadcast(broadcast_id, countdown=delay)
+            logger.warning(f"Broadcast {broadcast_id} paused by open circuit, resuming in {delay:.1f}s")
+            return
+        except Exception as e:
+            # E.g. a DB or Redis hiccup: finishing now would strand the pending deliveries
+            delay = settings.BROADCAST_ERROR_RETRY_DELAY * random.uniform(1, 1.5)
+            logger.exception(f"Broadcast {broadcast_id} interrupted, resuming in {delay:.1f}s")
+            try:
+                await db.rollback()
+                await BroadcastService.release_broadcast(db, broadcast_id, error_log=f"Exception: {e}")
+                enqueue_broadcast(broadcast_id, countdown=delay)
+            except Exception:
+                # Left to the sweep: still "sending" (claimed again after
+                # BROADCAST_CLAIM_TIMEOUT) or "pending" without a task
+                logger.exception(f"Failed to release broadcast {broadcast_id}")
+            return
+
+        broadcast = await BroadcastService.finish_broadcast(db, broadcast_id)
+        logger.info(
+            f"Broadcast {broadcast_id} finished: {broadcast.status}, "
+            f"sent={broadcast.sent_count}, failed={broadcast.failed_count}"
+        )
+
+async def sweep_broadcasts():
+    """Publish a task again for every broadcast nobody is working on."""
+    async with AsyncSessionLocal() as db:
+        broadcast_ids = await BroadcastService.unfinished_broadcasts(
+            db, settings.BROADCAST_PENDING_GRACE, settings.BROADCAST_CLAIM_TIMEOUT, settings.BROADCAST_SWEEP_BATCH_SIZE,
+        )
+    for broadcast_id in broadcast_ids:
+        enqueue_broadcast(broadcast_id)
+    if broadcast_ids:
+        logger.warning(f"Republished {len(broadcast_ids)} unfinished broadcasts: {broadcast_ids}")
@@ -0,0 +1,78 @@
+"""
+In-place updates of group-buy cards sent in upsert mode.
+
+The API overwrites the stored content of the card's message row and schedules
+update_card_task CARD_UPDATE_COALESCE_MS later, at most once per message at a
+time. The task PATCHes the sent card with whatever content the row holds by
+then, so a burst of status reports becomes one API call.
+"""
+import logging
+import time
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import SEND_RESULTS
+from app.services.card_upsert import CardUpsertIndex
+from app.services.circuit_breaker import FeishuCircuitBreaker, CircuitOpen
+from app.services.feishu_service import FeishuService
+from app.services.message_service import MessageService
+from app.services.rate_limiter import FeishuRateLimiter, RateLimited, RATE_LIMIT_CODES
+from app.worker.dispatch import enqueue_card_update
+
+logger = logging.getLogger(__name__)
+
+# The original card is still on its way
+UNSENT_STATUSES = {"pending", "sending", "deferred", "retrying"}
+
+async def _reschedule(message_id: int, first_scheduled_at: float, reason: str):
+    if time.time() - first_scheduled_at > settings.CARD_UPDATE_MAX_WAIT:
+        logger.error(f"Giving up updating card of message {message_id}: {reason}")
+        return
+    # A newer update may have scheduled a task already; that one carries our content too
+    if await CardUpsertIndex.schedule_update(message_id):
+        enqueue_card_update(message_id, max(settings.CARD_UPDATE_COALESCE_MS / 1000, 1.0), first_scheduled_at)
+        logger.info(f"Card update of message {message_id} rescheduled: {reason}")
+
+async def process_card_update(message_id: int, first_scheduled_at: float):
+    # Cleared before reading, so content written after this read schedules another update
+    await CardUpsertIndex.start_update(message_id)
+    async with AsyncSessionLocal() as db:
+        message = await MessageService.get_message(db, message_id)
+    if message is None:
+        return
+
+    if message.status in UNSENT_STATUSES or (message.status == "sent" and not message.feishu_message_id):
+        # The original send may still carry older content; patch once it is out
+        await _reschedule(message_id, first_scheduled_at, f"card not sent yet ({message.status})")
+        return
+    if message.status != "sent":
+        logger.info(f"Message {message_id} is {message.status}, nothing to update")
+        return
+
+    try:
+        if settings.FEISHU_CIRCUIT_ENABLED:
+            await FeishuCircuitBreaker.allow()
+        if settings.FEISHU_RATE_LIMIT_ENABLED:
+            await FeishuRateLimiter.acquire(message.recipient_id)
+
+        started = time.monotonic()
+        response = await FeishuService.update_message(message.feishu_message_id, message.content)
+        if settings.FEISHU_CIRCUIT_ENABLED:
+            await FeishuCircuitBreaker.record(
+                response.get("code") in settings.SEND_RETRYABLE_CODES,
+                time.monotonic() - started,
+            )
+    except (CircuitOpen, RateLimited) as e:
+        await _reschedule(message_id, first_scheduled_at, str(e))
+        return
+
+    code = response.get("code")
+    if code == 0:
+        SEND_RESULTS.labels(status="updated").inc()
+        logger.info(f"Updated card of message {message_id} ({message.feishu_message_id})")
+    elif code in RATE_LIMIT_CODES:
+        await FeishuRateLimiter.penalize()
+        await _reschedule(message_id, first_scheduled_at, f"rate limited (code={code})")
+    elif code in settings.SEND_RETRYABLE_CODES:
+        await _reschedule(message_id, first_scheduled_at, f"Feishu Error: {response}")
+    else:
+        logger.error(f"Failed to update card of message {message_id}: {response}")
@@ -1,16 +1,39 @@
 from celery import Celery
 from app.core.config import settings
 
+# Task names, so the API can publish tasks without importing app.worker.tasks
+# (and with it the Feishu SDK and the whole send path)
+SEND_MESSAGE_TASK = "app.worker.tasks.send_message_task"
+PROCESS_RECEIVED_MESSAGE_TASK = "app.worker.tasks.process_received_message_task"
+SEND_BROADCAST_TASK = "app.worker.tasks.send_broadcast_task"
+UPDATE_CARD_TASK = "app.worker.tasks.update_card_task"
+SWEEP_BROADCASTS_TASK = "app.worker.tasks.sweep_broadcasts_task"
+WARM_RECIPIENTS_TASK = "app.worker.tasks.warm_recipients_task"
+RECEIVE_QUEUE = "receive_queue"
+
 celery_app = Celery("worker", broker=settings.CELERY_BROKER_URL, include=["app.worker.tasks"])
 
 celery_app.conf.task_routes = {
-    "app.worker.tasks.send_message_task": "send_queue",
-    "app.worker.tasks.process_received_message_task": "receive_queue",
+    # Default lane; app.worker.dispatch picks the queue from the message priority
+    SEND_MESSAGE_TASK: settings.SEND_QUEUE_NORMAL,
+    PROCESS_RECEIVED_MESSAGE_TASK: RECEIVE_QUEUE,
 }
 
+# Reserve one task at a time per process, so a worker never sits on a backlog
+# of bulk tasks while alerts wait in another queue
+celery_app.conf.worker_prefetch_multiplier = 1
+
 celery_app.conf.beat_schedule = {
     "check-heartbeat-every-interval": {
         "task": "app.worker.tasks.check_heartbeat_task",
         "schedule": settings.MONITOR_CHECK_INTERVAL,
     },
+    "release-deferred-sends": {
+        "task": "app.worker.tasks.release_deferred_task",
+        "schedule": settings.SEND_DEFERRED_POLL_INTERVAL,
+    },
+    "sweep-unfinished-broadcasts": {
+        "task": SWEEP_BROADCASTS_TASK,
+        "schedule": settings.BROADCAST_SWEEP_INTERVAL,
+    },
 }
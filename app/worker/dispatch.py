@@ -0,0 +1,97 @@
+import time
+from typing import Optional, Union
+from celery import group
+from app.core.config import settings
+from app.core.serialization import RawJSON
+from app.models.message import Message
+from app.worker.celery_app import celery_app, SEND_MESSAGE_TASK, PROCESS_RECEIVED_MESSAGE_TASK, SEND_BROADCAST_TASK, UPDATE_CARD_TASK, WARM_RECIPIENTS_TASK, RECEIVE_QUEUE
+
+# Recipient types the workers resolve to open_ids (RESOLVABLE_TYPES of app.services.recipient_resolver)
+RESOLVABLE_RECIPIENT_TYPES = {"email", "user_id"}
+
+def send_queue_for(priority: Optional[str]) -> str:
+    if priority == "high":
+        return settings.SEND_QUEUE_HIGH
+    if priority == "bulk":
+        return settings.SEND_QUEUE_BULK
+    return settings.SEND_QUEUE_NORMAL
+
+def enqueue_message(message: Message, content: Union[dict, RawJSON, None] = None):
+    """
+    Publish one stored message to the send queue.
+    content overrides message.content, e.g. with the RawJSON the message was
+    rendered to, so the payload is not serialized again.
+    In outbox mode the committed pending row already is the queue entry.
+    """
+    if settings.MESSAGE_DISPATCH_MODE == "outbox":
+        return
+    celery_app.send_task(
+        SEND_MESSAGE_TASK,
+        args=[
+            message.id, 
+            message.recipient_id, 
+            message.recipient_type, 
+            message.msg_type, 
+            message.content if content is None else content
+        ],
+        # Carried to the worker to measure queue wait
+        kwargs={"enqueued_at": time.time()},
+        queue=send_queue_for(message.priority)
+    )
+
+def enqueue_messages(messages: list[Message]):
+    """
+    Publish many stored messages over one producer connection.
+    When several of them need their recipient resolved, a warm_recipients_task
+    goes out first in the same publish: it resolves them in a few batch
+    lookups on the default queue, so most sends find them cached instead of
+    looking them up one by one in prefork workers.
+    """
+    if not messages or settings.MESSAGE_DISPATCH_MODE == "outbox":
+        return
+    enqueued_at = time.time()
+    signatures = []
+    if settings.FEISHU_RESOLVE_RECIPIENTS:
+        recipients = list(dict.fromkeys(
+            (message.recipient_type, message.recipient_id)
+            for message in messages if message.recipient_type in RESOLVABLE_RECIPIENT_TYPES
+        ))
+        if len(recipients) > 1:
+            signatures.append(celery_app.signature(WARM_RECIPIENTS_TASK, args=(recipients,)))
+    group(
+        *signatures,
+        *(celery_app.signature(
+            SEND_MESSAGE_TASK,
+            args=(
+                message.id,
+                message.recipient_id,
+                message.recipient_type,
+                message.msg_type,
+                message.content,
+            ),
+            kwargs={"enqueued_at": enqueued_at},
+            queue=send_queue_for(message.priority)
+        )
+        for message in messages),
+    ).apply_async()
+
+def enqueue_broadcast(broadcast_id: int, countdown: Optional[float] = None):
+    """
+    Hand a broadcast to a worker. One task sends the whole broadcast, so it goes
+    to the default worker queue (the send queues only carry single sends), also
+    in outbox mode.
+    """
+    return celery_app.send_task(SEND_BROADCAST_TASK, args=[broadcast_id], countdown=countdown)
+
+def enqueue_card_update(message_id: int, countdown: float, first_scheduled_at: Optional[float] = None):
+    """PATCH the sent card of a message with its latest content after countdown seconds."""
+    return celery_app.send_task(
+        UPDATE_CARD_TASK,
+        args=[message_id],
+        kwargs={"first_scheduled_at": first_scheduled_at or time.time()},
+        countdown=countdown,
+    )
+
+def enqueue_received_event(event_data: dict):
+    """Hand a Feishu webhook event to the receive workers."""
+    return celery_app.send_task(PROCESS_RECEIVED_MESSAGE_TASK, args=[event_data], queue=RECEIVE_QUEUE)
@@ -0,0 +1,67 @@
+"""
+Worker process lifecycle.
+
+Every Celery child process keeps one long-lived event loop. The DB engine pool,
+the Redis pool and other loop-bound clients live on that loop for the whole
+life of the process and are disposed when the process shuts down.
+"""
+import asyncio
+import logging
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+from app.core.config import settings
+from app.core.database import engine
+from app.core import redis_pool
+from app.core.metrics import start_exporter
+from app.services.feishu_http import FeishuHttpClient
+from app.services.recipient_resolver import RecipientResolver
+
+logger = logging.getLogger(__name__)
+
+_loop = None
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    # Created lazily as well, so the solo pool (no worker_process_init) works too
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop
+
+def run_async(coro):
+    """Run a coroutine to completion on the process event loop."""
+    return get_loop().run_until_complete(coro)
+
+async def dispose_resources():
+    await FeishuHttpClient.close()
+    await redis_pool.close_redis()
+    await engine.dispose()
+
+@worker_init.connect
+def init_worker(**kwargs):
+    # One exporter in the main process; prefork children report through
+    # PROMETHEUS_MULTIPROC_DIR when it is set
+    if settings.METRICS_ENABLED:
+        start_exporter(settings.METRICS_WORKER_PORT)
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    # Connections inherited from the parent must never be used after fork
+    engine.sync_engine.dispose(close=False)
+    redis_pool.reset_redis()
+    FeishuHttpClient.reset()
+    RecipientResolver.reset()
+    get_loop()
+    logger.info("Worker process initialized with a long-lived event loop")
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    global _loop
+    if _loop is None or _loop.is_closed():
+        return
+    try:
+        _loop.run_until_complete(dispose_resources())
+    except Exception:
+        logger.exception("Failed to dispose worker resources")
+    finally:
+        _loop.close()
+        _loop = None
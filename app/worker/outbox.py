@@ -0,0 +1,120 @@
+"""
+Transactional outbox dispatcher.
+
+With MESSAGE_DISPATCH_MODE=outbox the API only commits pending rows; nothing
+is published to the broker. Dispatchers claim batches of pending rows with
+SELECT ... FOR UPDATE SKIP LOCKED, send them concurrently and write the final
+statuses through a StatusWriter. Any number of dispatchers can run side by
+side, and a row whose dispatcher died mid-send is claimed again after
+OUTBOX_CLAIM_TIMEOUT, which gives at-least-once delivery.
+
+    python -m app.worker.outbox
+"""
+import asyncio
+import logging
+import signal
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import start_exporter
+from app.services.message_service import MessageService
+from app.services.recipient_resolver import RecipientResolver
+from app.worker.lifecycle import dispose_resources
+from app.worker.status_writer import StatusWriter, StatusWriteFailed
+from app.worker.tasks import process_send
+
+logger = logging.getLogger(__name__)
+
+class OutboxDispatcher:
+    def __init__(self, batch_size: int, concurrency: int):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.poll_interval = settings.OUTBOX_POLL_INTERVAL_MS / 1000
+        self.writer = StatusWriter()
+        self._inflight: set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        logger.info("Stopping outbox dispatcher, waiting for in-flight sends")
+        self._stopping.set()
+
+    async def _claim(self, limit: int):
+        async with AsyncSessionLocal() as db:
+            return await MessageService.claim_pending(db, limit, settings.OUTBOX_CLAIM_TIMEOUT)
+
+    async def _send(self, message):
+        try:
+            await self._process(message)
+        except StatusWriteFailed:
+            # The row stays in "sending" and is claimed again after OUTBOX_CLAIM_TIMEOUT
+            logger.exception(f"Result of message {message.id} was not stored")
+
+    async def _process(self, message):
+        await process_send(
+            message.id,
+            message.recipient_id,
+            message.recipient_type,
+            message.msg_type,
+            message.content,
+            writer=self.writer,
+            attempts=message.attempts,
+            # A first attempt has been waiting since the row was created
+            enqueued_at=message.created_at.timestamp() if message.attempts == 0 and message.created_at else None,
+        )
+
+    async def run(self):
+        await self.writer.start()
+        logger.info(f"Outbox dispatcher started: batch_size={self.batch_size}, concurrency={self.concurrency}")
+        while not self._stopping.is_set():
+            free = self.concurrency - len(self._inflight)
+            if free <= 0:
+                await asyncio.wait(self._inflight, return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            limit = min(self.batch_size, free)
+            try:
+                messages = await self._claim(limit)
+            except Exception:
+                logger.exception("Failed to claim outbox messages")
+                messages = []
+
+            # Resolve the batch's email / user_id recipients in a few lookups up front
+            if messages and settings.FEISHU_RESOLVE_RECIPIENTS:
+                await RecipientResolver.warm((m.recipient_type, m.recipient_id) for m in messages)
+
+            for message in messages:
+                task = asyncio.create_task(self._send(message))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+
+            # A short batch means the outbox is drained; wait before polling again
+            if len(messages) < limit:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        await self.writer.close()
+
+async def _main():
+    dispatcher = OutboxDispatcher(settings.OUTBOX_BATCH_SIZE, settings.OUTBOX_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, dispatcher.stop)
+    loop.add_signal_handler(signal.SIGINT, dispatcher.stop)
+    try:
+        await dispatcher.run()
+    finally:
+        await dispose_resources()
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if settings.METRICS_ENABLED:
+        start_exporter(settings.METRICS_WORKER_PORT)
+    asyncio.run(_main())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Asyncio-native consumer for send_queue.
+
+Instead of one message per prefork slot, a single process keeps up to
+SEND_CONSUMER_CONCURRENCY sends in flight on one event loop. The broker
+connection is owned by the main thread; sends run on the loop thread and every
+message is acked individually once its send has finished and its final status
+has been flushed by the StatusWriter. A message whose status could not be
+written is rejected back to the queue instead.
+
+Run it in place of a Celery worker for the send queues:
+
+    python -m app.worker.send_consumer --concurrency 200 --queues send_queue
+"""
+import argparse
+import asyncio
+import logging
+import queue
+import signal
+import socket
+import threading
+from kombu import Connection, Exchange, Queue
+from app.core.config import settings
+from app.core.metrics import start_exporter
+from app.worker.celery_app import SEND_MESSAGE_TASK
+from app.worker.lifecycle import get_loop, dispose_resources
+from app.worker.status_writer import StatusWriter
+from app.worker.tasks import process_send
+
+logger = logging.getLogger(__name__)
+
+class SendConsumer:
+    def __init__(self, queues: list[str], concurrency: int):
+        self.queues = queues
+        self.concurrency = concurrency
+        self.loop = get_loop()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._acks: queue.SimpleQueue = queue.SimpleQueue()
+        self._inflight: set = set()
+        self._stopping = threading.Event()
+        self.writer = StatusWriter()
+
+    def stop(self, *args):
+        logger.info("Stopping send consumer, waiting for in-flight sends")
+        self._stopping.set()
+
+    def _parse(self, body, message):
+        # Celery task protocol v2: headers carry the task name, body is [args, kwargs, embed]
+        if isinstance(body, (list, tuple)):
+            return message.headers.get("task"), body[0], body[1]
+        # Task protocol v1
+        return body.get("task"), body.get("args", []), body.get("kwargs", {})
+
+    def _on_message(self, body, message):
+        task_name, args, kwargs = self._parse(body, message)
+        if task_name != SEND_MESSAGE_TASK:
+            logger.warning(f"Send consumer rejected unexpected task: {task_name}")
+            message.reject(requeue=False)
+            return
+
+        future = asyncio.run_coroutine_threadsafe(self._handle(args, kwargs), self.loop)
+        self._inflight.add(future)
+
+        def _done(f):
+            # Runs on the loop thread; the broker channel is only touched by the consumer thread
+            self._acks.put((f, message))
+
+        future.add_done_callback(_done)
+
+    async def _handle(self, args, kwargs):
+        async with self._semaphore:
+            await process_send(*args, writer=self.writer, **kwargs)
+
+    def _drain_acks(self):
+        while True:
+            try:
+                future, message = self._acks.get_nowait()
+            except queue.Empty:
+                return
+            self._inflight.discard(future)
+            if future.exception() is not None:
+                # The status was not stored, so the broker has to keep the message
+                logger.error(f"Send failed unexpectedly, requeueing: {future.exception()}")
+                message.reject(requeue=True)
+            else:
+                message.ack()
+
+    def run(self):
+        loop_thread = threading.Thread(target=self.loop.run_forever, name="send-loop", daemon=True)
+        loop_thread.start()
+        asyncio.run_coroutine_threadsafe(self.writer.start(), self.loop).result()
+
+        queues = [Queue(name, Exchange(name), routing_key=name) for name in self.queues]
+        with Connection(settings.CELERY_BROKER_URL) as conn:
+            consumer = conn.Consumer(
+                queues,
+                callbacks=[self._on_message],
+                accept=["json"],
+                prefetch_count=self.concurrency,
+            )
+            with consumer:
+                logger.info(f"Send consumer started: queues={self.queues}, concurrency={self.concurrency}")
+                while not self._stopping.is_set():
+                    self._drain_acks()
+                    try:
+                        conn.drain_events(timeout=0.05)
+                    except socket.timeout:
+                        pass
+
+                # Stop taking new work, then ack whatever is still running
+                consumer.cancel()
+                while self._inflight:
+                    self._drain_acks()
+                    self._stopping.wait(0.05)
+
+        asyncio.run_coroutine_threadsafe(self.writer.close(), self.loop).result()
+        asyncio.run_coroutine_threadsafe(dispose_resources(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        loop_thread.join()
+        self.loop.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Asyncio send consumer")
+    parser.add_argument("--concurrency", type=int, default=settings.SEND_CONSUMER_CONCURRENCY)
+    parser.add_argument("--queues", default=settings.SEND_CONSUMER_QUEUES,
+                        help="Comma separated queue names")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    if settings.METRICS_ENABLED:
+        start_exporter(settings.METRICS_WORKER_PORT)
+
+    consumer = SendConsumer([q.strip() for q in args.queues.split(",") if q.strip()], args.concurrency)
+    signal.signal(signal.SIGTERM, consumer.stop)
+    signal.signal(signal.SIGINT, consumer.stop)
+    consumer.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Buffered writer for final send results.
+
+Workers that keep many sends in flight hand their "sent"/"failed" results to a
+StatusWriter instead of committing one row at a time. Results are flushed with
+one executemany UPDATE every STATUS_FLUSH_INTERVAL_MS or as soon as
+STATUS_FLUSH_MAX_ROWS are buffered. add() only returns once the result has been
+written, so a broker message acked after add() can never lose its status.
+
+A failed flush keeps its results and writes them again after
+STATUS_FLUSH_RETRY_DELAY_MS; add() keeps waiting meanwhile. Only results still
+unwritten when the writer is closed make add() raise StatusWriteFailed.
+"""
+import asyncio
+import logging
+from typing import Optional
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.services.admission import AdmissionController
+from app.services.message_service import MessageService
+
+logger = logging.getLogger(__name__)
+
+class StatusWriteFailed(Exception):
+    """The result was not stored; its broker message must not be acked."""
+
+class StatusWriter:
+    def __init__(self, flush_interval_ms: Optional[int] = None, max_rows: Optional[int] = None):
+        if flush_interval_ms is None:
+            flush_interval_ms = settings.STATUS_FLUSH_INTERVAL_MS
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_rows = settings.STATUS_FLUSH_MAX_ROWS if max_rows is None else max_rows
+        self.retry_delay = settings.STATUS_FLUSH_RETRY_DELAY_MS / 1000
+        self._results: dict[int, dict] = {}
+        self._waiters: list[asyncio.Future] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def add(self, message_id: int, status: str, feishu_message_id: Optional[str] = None, error_log: Optional[str] = None):
+        """Buffer one result and wait until it has been flushed."""
+        if self._closed:
+            raise RuntimeError("StatusWriter is closed")
+        waiter = asyncio.get_running_loop().create_future()
+        self._results[message_id] = {
+            "id": message_id,
+            "status": status,
+            "feishu_message_id": feishu_message_id,
+            "error_log": error_log,
+        }
+        self._waiters.append(waiter)
+        if len(self._results) >= self.max_rows:
+            self._wakeup.set()
+        await waiter
+
+    async def flush(self) -> bool:
+        """Write the buffered results; False when the write failed."""
+        async with self._flush_lock:
+            if not self._results:
+                return True
+            results, waiters = list(self._results.values()), self._waiters
+            self._results, self._waiters = {}, []
+            try:
+                async with AsyncSessionLocal() as db:
+                    await MessageService.bulk_transition_status(db, "sending", results)
+            except Exception as e:
+                if not self._closed:
+                    # Keep them for the next flush; a newer result for the same message wins
+                    logger.exception(f"Failed to flush {len(results)} message results, retrying")
+                    for result in results:
+                        self._results.setdefault(result["id"], result)
+                    self._waiters = waiters + self._waiters
+                    return False
+                logger.exception(f"Failed to flush {len(results)} message results on close")
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(StatusWriteFailed(str(e)))
+                return False
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            await AdmissionController.record_drained(len(results))
+            return True
+
+    async def _run(self):
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not await self.flush():
+                await asyncio.sleep(self.retry_delay)
+
+    async def close(self):
+        """Stop the periodic flush and write whatever is still buffered."""
+        self._closed = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
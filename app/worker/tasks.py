@@ -1,66 +1,287 @@
-from app.worker.celery_app import celery_app
-from app.services.feishu_service import FeishuService
+from app.worker.celery_app import celery_app, SEND_MESSAGE_TASK, PROCESS_RECEIVED_MESSAGE_TASK, SEND_BROADCAST_TASK, SWEEP_BROADCASTS_TASK, UPDATE_CARD_TASK, WARM_RECIPIENTS_TASK
+from app.services.feishu_service import FeishuService, NOT_SENT_ERRORS, UNKNOWN_OUTCOME_CODE
 from app.core.database import AsyncSessionLocal
 from app.services.message_service import MessageService
-from app.schemas.message import MessageUpdate, MessageCreate
 from app.core.config import settings
-import asyncio
+from app.core.metrics import HEARTBEAT_CHECK_LATENCY, SEND_QUEUE_WAIT, SEND_RESULTS
+from app.services.heartbeat_service import HeartbeatService
+from app.services.admission import AdmissionController
+from app.services.feishu_message_wrap import render_heartbeat_alert_card
+from app.services.circuit_breaker import FeishuCircuitBreaker, CircuitOpen
+from app.services.rate_limiter import FeishuRateLimiter, RateLimited, RATE_LIMIT_CODES
+from app.services.recipient_resolver import RecipientResolver, RecipientNotFound
+from app.worker.broadcast import process_broadcast, sweep_broadcasts
+from app.worker.card_update import process_card_update
+from app.worker.lifecycle import run_async
+from app.worker.dispatch import enqueue_message, enqueue_messages
+from app.services.deferred_sends import defer_send, defer_sends, due_sends, remove_sends, rescue_due
+from app.worker.status_writer import StatusWriteFailed
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 import logging
-import redis.asyncio as redis
+import random
 import time
 
 logger = logging.getLogger(__name__)
 
-@celery_app.task(name="app.worker.tasks.send_message_task")
-def send_message_task(message_id: int, recipient_id: str, recipient_type: str, msg_type: str, content: dict):
+async def _record_result(db, writer, message_id: int, status: str, **values):
+    # Final statuses go through the buffered writer when the caller has one
+    SEND_RESULTS.labels(status=status).inc()
+    if writer is not None:
+        # The writer counts what it flushed
+        await writer.add(message_id, status, **values)
+    else:
+        await MessageService.transition_status(db, message_id, "sending", status, **values)
+        await AdmissionController.record_drained()
+
+def _retry_delay(attempt: int) -> float:
+    # Exponential backoff with equal jitter, capped at SEND_RETRY_MAX_DELAY
+    delay = min(settings.SEND_RETRY_MAX_DELAY, settings.SEND_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+async def _retry_or_dead_letter(db, message_id: int, attempts: int, error_msg: str):
+    """
+    Record a failed attempt. The message is retried later through the deferred
+    send schedule, or moved to "dead" once SEND_MAX_ATTEMPTS is reached.
+    """
+    attempt = attempts + 1
+    if attempt >= settings.SEND_MAX_ATTEMPTS:
+        SEND_RESULTS.labels(status="dead").inc()
+        await MessageService.transition_status(db, message_id, "sending", "dead", attempts=attempt, error_log=error_msg)
+        await AdmissionController.record_drained()
+        logger.error(f"Message {message_id} dead-lettered after {attempt} attempts: {error_msg}")
+        return
+
+    delay = _retry_delay(attempt)
+    # Parked before it is scheduled, like _defer
+    parked = await MessageService.transition_status(
+        db, message_id, "sending", "retrying",
+        attempts=attempt,
+        next_attempt_at=datetime.now(timezone.utc) + timedelta(seconds=delay),
+        error_log=error_msg,
+    )
+    if not parked:
+        return
+    SEND_RESULTS.labels(status="retrying").inc()
+    await defer_send(message_id, delay)
+    logger.warning(f"Message {message_id} attempt {attempt} failed, retrying in {delay:.1f}s")
+
+async def _defer(db, message_id: int, delay: float):
+    # Parked first, scheduled second: the release task must never see the id
+    # while the row is still "sending". A lost ZADD is repaired by the rescue sweep.
+    parked = await MessageService.transition_status(
+        db, message_id, "sending", "deferred",
+        next_attempt_at=datetime.now(timezone.utc) + timedelta(seconds=delay),
+    )
+    if not parked:
+        return
+    SEND_RESULTS.labels(status="deferred").inc()
+    await defer_send(message_id, delay)
+    logger.info(f"Message {message_id} deferred for {delay:.2f}s")
+
+async def process_send(message_id: int, recipient_id: str, recipient_type: str, msg_type: str, content: dict, writer=None, attempts: Optional[int] = None, enqueued_at: Optional[float] = None):
+    """
+    Deliver one stored message and record the result.
+    Shared by send_message_task, the asyncio send consumer and the outbox
+    dispatcher. The latter two pass a StatusWriter so final statuses are
+    written in batches. The outbox has already claimed its rows and passes
+    their attempt count; everybody else claims the row here.
+    enqueued_at (unix time) is used to measure queue wait.
+    Raises StatusWriteFailed when the writer could not store the result, so
+    the caller does not ack the message.
+    """
+    if enqueued_at is not None:
+        SEND_QUEUE_WAIT.observe(max(0.0, time.time() - enqueued_at))
+    # Set once Feishu accepted the message; from then on it must never be sent again
+    accepted: Optional[dict] = None
+    async with AsyncSessionLocal() as db:
+        try:
+            # Claim the message: pending -> sending. A duplicate delivery of the
+            # same task finds the row already claimed and stops here.
+            if attempts is None:
+                attempts = await MessageService.claim_message(db, message_id)
+                if attempts is None:
+                    logger.info(f"Message {message_id} is no longer pending, skipping")
+                    return
+            
+            if recipient_type in ['email', 'user_id', 'feishu_chat', 'feishu_user']:
+                send_args = (recipient_id, recipient_type, msg_type, content)
+            elif recipient_type == 'sms_dispatcher':
+                # Reply with "sms消息已收到并分发"
+                reply_content = {"text": "sms消息已收到并分发"}
+                # The recipient_id for sms_dispatcher is the original chat_id
+                # We send a message back to this chat
+                send_args = (recipient_id, "feishu_chat", "text", reply_content)
+            else:
+                print('其它消息，暂不处理')
+                await _record_result(db, writer, message_id, "ignore")
+                return
+
+            # email / user_id -> open_id from cache, so unknown recipients fail before sending
+            if settings.FEISHU_RESOLVE_RECIPIENTS:
+                try:
+                    resolved = await RecipientResolver.resolve_recipient(send_args[0], send_args[1])
+                except RecipientNotFound as e:
+                    await _record_result(db, writer, message_id, "failed", error_log=str(e))
+                    return
+                send_args = (*resolved, *send_args[2:])
+
+            # Fail fast while Feishu is degraded; the send is deferred, not failed
+            if settings.FEISHU_CIRCUIT_ENABLED:
+                await FeishuCircuitBreaker.allow()
+
+            # Wait briefly for a send slot, or defer when the quota is exhausted
+            if settings.FEISHU_RATE_LIMIT_ENABLED:
+                await FeishuRateLimiter.acquire(send_args[0])
+
+            # Call Feishu API. Only errors raised before the request left are
+            # retried; any other failure may have delivered the message already
+            started = time.monotonic()
+            try:
+                response = await FeishuService.send_message(*send_args, raise_errors=True)
+            except NOT_SENT_ERRORS as e:
+                logger.warning(f"Message {message_id} could not reach Feishu: {e}")
+                response = {"code": -1, "msg": str(e)}
+            except Exception as e:
+                logger.exception(f"Message {message_id} send failed, outcome unknown")
+                response = {"code": UNKNOWN_OUTCOME_CODE, "msg": str(e)}
+            if response.get("code") == 0:
+                accepted = response
+
+            if settings.FEISHU_CIRCUIT_ENABLED:
+                code = response.get("code")
+                await FeishuCircuitBreaker.record(
+                    code in settings.SEND_RETRYABLE_CODES or code == UNKNOWN_OUTCOME_CODE,
+                    time.monotonic() - started,
+                )
+
+            if response.get("code") in RATE_LIMIT_CODES:
+                # Feishu throttled us anyway: slow every worker down and try again later
+                await FeishuRateLimiter.penalize()
+                raise RateLimited(settings.FEISHU_RATE_LIMIT_PENALTY_DELAY)
+
+            if response.get("code") == 0:
+                feishu_msg_id = response.get("data", {}).get("message_id")
+                await _record_result(db, writer, message_id, "sent", feishu_message_id=feishu_msg_id)
+            elif response.get("code") in settings.SEND_RETRYABLE_CODES:
+                await _retry_or_dead_letter(db, message_id, attempts, f"Feishu Error: {response}")
+            elif response.get("code") == UNKNOWN_OUTCOME_CODE:
+                # Maybe delivered: fail it rather than risk a duplicate
+                await _record_result(db, writer, message_id, "failed", error_log=f"Outcome unknown: {response.get('msg')}")
+            else:
+                error_msg = f"Feishu Error: {response}"
+                await _record_result(db, writer, message_id, "failed", error_log=error_msg)
+        except StatusWriteFailed:
+            raise
+        except CircuitOpen as e:
+            try:
+                # Spread the deferred sends so they do not all hit the half-open probe at once
+                await _defer(db, message_id, e.retry_after + random.uniform(0, settings.FEISHU_CIRCUIT_OPEN_SECONDS / 2))
+            except Exception:
+                logger.exception(f"Failed to defer message {message_id}")
+        except RateLimited as e:
+            try:
+                await _defer(db, message_id, e.retry_after)
+            except Exception:
+                logger.exception(f"Failed to defer message {message_id}")
+        except Exception as e:
+            logger.exception(f"Task failed for message {message_id}")
+            if attempts is None:
+                return
+            if accepted is not None:
+                # Already delivered: record it directly instead of sending it again
+                try:
+                    await db.rollback()
+                    await MessageService.transition_status(
+                        db, message_id, "sending", "sent",
+                        feishu_message_id=accepted.get("data", {}).get("message_id"),
+                    )
+                    await AdmissionController.record_drained()
+                except Exception:
+                    logger.exception(f"Message {message_id} was delivered but its status could not be recorded")
+                return
+            # The row was claimed, so give it another attempt instead of leaving it in "sending"
+            try:
+                await db.rollback()
+                await _retry_or_dead_letter(db, message_id, attempts, f"Exception: {e}")
+            except Exception:
+                logger.exception(f"Failed to schedule retry for message {message_id}")
+
+@celery_app.task(name=SEND_MESSAGE_TASK)
+def send_message_task(message_id: int, recipient_id: str, recipient_type: str, msg_type: str, content: dict, enqueued_at: Optional[float] = None):
     # Debug log to trace task arguments
     logger.info(f"Processing send_message_task: id={message_id}, type={recipient_type}, msg_type={msg_type}")
-    
+    run_async(process_send(message_id, recipient_id, recipient_type, msg_type, content, enqueued_at=enqueued_at))
+
+@celery_app.task(name=SEND_BROADCAST_TASK)
+def send_broadcast_task(broadcast_id: int):
+    logger.info(f"Processing send_broadcast_task: id={broadcast_id}")
+    run_async(process_broadcast(broadcast_id))
+
+@celery_app.task(name=SWEEP_BROADCASTS_TASK)
+def sweep_broadcasts_task():
     async def _process():
+        try:
+            await sweep_broadcasts()
+        except Exception:
+            logger.exception("Sweep broadcasts task failed")
+
+    run_async(_process())
+
+@celery_app.task(name=WARM_RECIPIENTS_TASK)
+def warm_recipients_task(recipients: list):
+    # Published by enqueue_messages ahead of a batch of sends; lookup errors are only logged
+    run_async(RecipientResolver.warm((recipient_type, recipient_id) for recipient_type, recipient_id in recipients))
+
+@celery_app.task(name=UPDATE_CARD_TASK)
+def update_card_task(message_id: int, first_scheduled_at: Optional[float] = None):
+    run_async(process_card_update(message_id, first_scheduled_at or time.time()))
+
+async def _rescue_deferred():
+    # Rows parked by a worker that died before adding them to the schedule
+    async with AsyncSessionLocal() as db:
+        message_ids = await MessageService.overdue_deferred(
+            db, settings.SEND_DEFERRED_RESCUE_AFTER, settings.SEND_DEFERRED_BATCH_SIZE,
+        )
+    if message_ids:
+        logger.warning(f"Rescheduling {len(message_ids)} deferred messages missing from the schedule")
+        await defer_sends(message_ids, 0)
+
+async def release_due_sends():
+    """Move due deferred/retrying rows back to pending and enqueue them."""
+    if await rescue_due(settings.SEND_DEFERRED_RESCUE_INTERVAL):
+        await _rescue_deferred()
+    while True:
+        message_ids = await due_sends(settings.SEND_DEFERRED_BATCH_SIZE)
+        if not message_ids:
+            return
         async with AsyncSessionLocal() as db:
-            try:
-                # Update status to sending
-                await MessageService.update_message(db, message_id, MessageUpdate(status="sending"))
-                
-                if recipient_type in ['email', 'feishu_chat', 'feishu_user']:
-                    # Call Feishu API
-                    response = await FeishuService.send_message(recipient_id, recipient_type, msg_type, content)
-                    
-                    if response.get("code") == 0:
-                        feishu_msg_id = response.get("data", {}).get("message_id")
-                        await MessageService.update_message(db, message_id, MessageUpdate(status="sent", feishu_message_id=feishu_msg_id))
-                    else:
-                        error_msg = f"Feishu Error: {response}"
-                        await MessageService.update_message(db, message_id, MessageUpdate(status="failed", error_log=error_msg))
-                elif recipient_type == 'sms_dispatcher':
-                    # Reply with "sms消息已收到并分发"
-                    reply_content = {"text": "sms消息已收到并分发"}
-                    # The recipient_id for sms_dispatcher is the original chat_id
-                    # We send a message back to this chat
-                    response = await FeishuService.send_message(recipient_id, "feishu_chat", "text", reply_content)
-                    
-                    if response.get("code") == 0:
-                        feishu_msg_id = response.get("data", {}).get("message_id")
-                        await MessageService.update_message(db, message_id, MessageUpdate(status="sent", feishu_message_id=feishu_msg_id))
-                    else:
-                        error_msg = f"Feishu Error: {response}"
-                        await MessageService.update_message(db, message_id, MessageUpdate(status="failed", error_log=error_msg))
-                else:
-                    print('其它消息，暂不处理')
-                    await MessageService.update_message(db, message_id, MessageUpdate(status="ignore"))
-            except Exception as e:
-                logger.exception(f"Task failed for message {message_id}")
-                # We might want to re-acquire DB session if it failed during transaction? 
-                # Ideally, if update_message fails, we are in trouble.
-                # Here assuming simple failure logging.
-                pass
-
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(_process())
-    loop.close()
-
-@celery_app.task(name="app.worker.tasks.process_received_message_task")
+            messages = await MessageService.release_deferred(db, message_ids)
+            released = {message.id for message in messages}
+            # An id whose row is still in flight keeps its entry; pending
+            # and final rows no longer need one
+            keep = await MessageService.ids_in_status(
+                db, [i for i in message_ids if i not in released], ["sending", "deferred", "retrying"],
+            )
+        enqueue_messages(messages)
+        # Only forget the ids once their rows are pending again
+        done = [i for i in message_ids if i not in keep]
+        await remove_sends(done)
+        if not done or len(message_ids) < settings.SEND_DEFERRED_BATCH_SIZE:
+            return
+
+@celery_app.task(name="app.worker.tasks.release_deferred_task")
+def release_deferred_task():
+    """Put due deferred and retrying sends back in the queue."""
+    async def _process():
+        try:
+            await release_due_sends()
+        except Exception as e:
+            logger.exception("Release deferred task failed")
+
+    run_async(_process())
+
+@celery_app.task(name=PROCESS_RECEIVED_MESSAGE_TASK)
 def process_received_message_task(event_data: dict):
     # Process received webhook event
     # Logic: Parse event -> Save to DB -> Maybe reply?
@@ -83,10 +304,7 @@ def process_received_message_task(event_data: dict):
             except Exception as e:
                 logger.error(f"Failed to process Feishu message: {e}")
     
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(_process())
-    loop.close()
+    run_async(_process())
 
 async def _handle_text_message(db, event, message):
     # Content is a JSON string, e.g. "{\"text\":\"hello\"}"
@@ -139,109 +357,65 @@ async def _handle_text_message(db, event, message):
     db_message = await MessageService.create_message(db, message_in)
     
     # 2. Trigger Async Task to "send" (or process) this message
-    # Since we are already in a task, calling delay() adds another task to the queue.
+    # Since we are already in a task, enqueueing adds another task to the queue
+    # (in outbox mode the pending row itself is picked up by the dispatcher).
     # This is correct for decoupling receiving from processing/dispatching.
-    send_message_task.delay(
-        db_message.id, 
-        db_message.recipient_id, 
-        db_message.recipient_type, 
-        db_message.msg_type, 
-        db_message.content
-    )
+    enqueue_message(db_message)
     
     logger.info(f"Processed and dispatched message {db_message.id} from Feishu event")
 
 @celery_app.task(name="app.worker.tasks.check_heartbeat_task")
 def check_heartbeat_task():
-    async def create_and_send_alert(db, system_id: str, status: str):
+    async def send_summary_alert(went_down: list[str], went_up: list[str]):
         if not settings.MONITOR_ALERT_RECIPIENT_ID:
             logger.warning("No recipient configured for monitor alerts.")
+            # Nowhere to send them; do not let them pile up
+            await HeartbeatService.ack_alerts(went_down, went_up)
             return
 
-        msg = f"警告：{system_id} 心跳超时。" if status == "DOWN" else f"恢复：{system_id} 心跳正常。"
-        
-        # Add @mention if configured
-        if settings.MONITOR_ALERT_AT_USER_ID:
-            if settings.MONITOR_ALERT_AT_USER_ID == "all":
-                msg += " <at user_id=\"all\">所有人</at>"
-            else:
-                msg += f" <at user_id=\"{settings.MONITOR_ALERT_AT_USER_ID}\"></at>"
-                
-        content = {"text": msg}
-        
-        message_in = MessageCreate(
-            content=content,
-            recipient_id=settings.MONITOR_ALERT_RECIPIENT_ID,
-            recipient_type=settings.MONITOR_ALERT_RECIPIENT_TYPE,
-            msg_type="text",
-            sender="MonitorSystem",
-            user_id=None
+        # 一个告警窗口内的所有变化合并成一张卡片，避免大面积故障时刷屏
+        content = render_heartbeat_alert_card(
+            went_down,
+            went_up,
+            checked_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            at_user_id=settings.MONITOR_ALERT_AT_USER_ID,
+            max_listed=settings.MONITOR_ALERT_MAX_LISTED,
         )
-        
+
         try:
-            message = await MessageService.create_message(db, message_in)
-            # Use delay to invoke the task
-            send_message_task.delay(
-                message.id, 
-                message.recipient_id, 
-                message.recipient_type, 
-                message.msg_type, 
-                message.content
-            )
+            async with AsyncSessionLocal() as db:
+                message = await MessageService.create_message(db, {
+                    "content": content,
+                    "recipient_id": settings.MONITOR_ALERT_RECIPIENT_ID,
+                    "recipient_type": settings.MONITOR_ALERT_RECIPIENT_TYPE,
+                    "msg_type": "interactive",
+                    "sender": "MonitorSystem",
+                    "user_id": None,
+                    "priority": "high",
+                })
+            enqueue_message(message)
         except Exception as e:
-            logger.error(f"Failed to create alert message: {e}")
+            # Still pending in Redis, so the next check cycle sends the alert again
+            logger.error(f"Failed to create alert message (down={went_down}, up={went_up}): {e}")
+            return
+        await HeartbeatService.ack_alerts(went_down, went_up)
 
     async def _process():
-        redis_client = redis.from_url(settings.CELERY_BROKER_URL, decode_responses=True)
         try:
-            systems = await redis_client.smembers("Monitored_Systems")
-            if not systems:
+            moved = await HeartbeatService.migrate_legacy()
+            if moved:
+                logger.info(f"Moved {moved} systems from the old heartbeat keys")
+            went_down, went_up = await HeartbeatService.check_timeouts()
+            went_down, went_up = await HeartbeatService.collect_alerts(went_down, went_up)
+            if not went_down and not went_up:
                 return
-
-            current_time = int(time.time())
-            
-            async with AsyncSessionLocal() as db:
-                for system_id in systems:
-                    heartbeat_key = f"SystemA_Heartbeat:{system_id}"
-                    status_key = f"Monitor_Status:{system_id}"
-                    fail_count_key = f"Monitor_Fail_Count:{system_id}"
-                    
-                    last_seen = await redis_client.get(heartbeat_key)
-                    current_status = await redis_client.get(status_key) or "UP"
-                    fail_count = int(await redis_client.get(fail_count_key) or 0)
-                    
-                    if not last_seen:
-                        last_seen_time = 0
-                    else:
-                        last_seen_time = int(last_seen)
-                    
-                    # Check if timeout
-                    is_timeout = (current_time - last_seen_time) > settings.MONITOR_HEARTBEAT_TIMEOUT
-                    
-                    if is_timeout:
-                        fail_count += 1
-                        await redis_client.set(fail_count_key, fail_count)
-                        
-                        if fail_count >= 3 and current_status == "UP":
-                            await redis_client.set(status_key, "DOWN")
-                            # Send Alert
-                            await create_and_send_alert(db, system_id, "DOWN")
-                            
-                    else:
-                        # Reset fail count if healthy
-                        await redis_client.set(fail_count_key, 0)
-                        
-                        if current_status == "DOWN":
-                            await redis_client.set(status_key, "UP")
-                            # Send Recovery Alert
-                            await create_and_send_alert(db, system_id, "UP")
+            await send_summary_alert(went_down, went_up)
 
         except Exception as e:
             logger.exception("Check heartbeat task failed")
-        finally:
-            await redis_client.close()
 
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(_process())
-    loop.close()
+    started = time.perf_counter()
+    try:
+        run_async(_process())
+    finally:
+        HEARTBEAT_CHECK_LATENCY.observe(time.perf_counter() - started)
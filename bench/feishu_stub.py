@@ -0,0 +1,150 @@
+"""
+Local stand-in for the Feishu Open API, used by the benchmark suite.
+
+Serves the token endpoint, POST /open-apis/im/v1/messages and
+/open-apis/message/v4/batch_send/ with a configurable
+latency, error rate and rate-limit rate, and keeps counters the load driver
+reads back through GET /_stub/stats. Point the services at it with
+
+    FEISHU_BASE_URL=http://127.0.0.1:9999 FEISHU_TRANSPORT=httpx
+
+and start it with
+
+    python -m bench.feishu_stub --port 9999 --latency-ms 50 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from fastapi import FastAPI, Request
+
+# Feishu codes returned for injected failures
+STUB_ERROR_CODE = 230001          # generic "invalid request", not retried by default
+STUB_RATE_LIMIT_CODE = 99991400   # "too many requests"
+
+class StubConfig:
+    latency_ms: float = 50.0
+    jitter_ms: float = 10.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+
+class StubStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.time()
+        self.tokens = 0
+        self.sends = 0
+        self.delivered = 0
+        self.errors = 0
+        self.rate_limited = 0
+        # Enqueue-to-delivery delays of bench messages, in seconds
+        self.delays: list[float] = []
+
+    def snapshot(self) -> dict:
+        return {
+            "started_at": self.started_at,
+            "tokens": self.tokens,
+            "sends": self.sends,
+            "delivered": self.delivered,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "delays": self.delays,
+        }
+
+config = StubConfig()
+stats = StubStats()
+app = FastAPI(title="Feishu stub")
+
+async def _simulate_latency():
+    delay = max(0.0, config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)) / 1000
+    if delay:
+        await asyncio.sleep(delay)
+
+def _bench_sent_at(content: str):
+    # The load driver stamps every message with the time it was submitted
+    try:
+        return float(json.loads(content).get("bench_sent_at"))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+@app.post("/open-apis/auth/v3/tenant_access_token/internal")
+async def tenant_access_token():
+    stats.tokens += 1
+    return {"code": 0, "msg": "ok", "tenant_access_token": "t-bench-stub", "expire": 7200}
+
+@app.post("/open-apis/im/v1/messages")
+async def send_message(request: Request):
+    body = await request.json()
+    stats.sends += 1
+    await _simulate_latency()
+
+    roll = random.random()
+    if roll < config.rate_limit_rate:
+        stats.rate_limited += 1
+        return {"code": STUB_RATE_LIMIT_CODE, "msg": "too many requests"}
+    if roll < config.rate_limit_rate + config.error_rate:
+        stats.errors += 1
+        return {"code": STUB_ERROR_CODE, "msg": "stub error"}
+
+    stats.delivered += 1
+    sent_at = _bench_sent_at(body.get("content"))
+    if sent_at is not None:
+        stats.delays.append(time.time() - sent_at)
+    return {
+        "code": 0,
+        "msg": "success",
+        "data": {"message_id": f"om_stub_{stats.sends}", "chat_id": body.get("receive_id")},
+    }
+
+@app.post("/open-apis/message/v4/batch_send/")
+async def batch_send(request: Request):
+    body = await request.json()
+    recipients = len(body.get("open_ids") or []) + len(body.get("user_ids") or [])
+    stats.sends += 1
+    await _simulate_latency()
+
+    roll = random.random()
+    if roll < config.rate_limit_rate:
+        stats.rate_limited += 1
+        return {"code": STUB_RATE_LIMIT_CODE, "msg": "too many requests"}
+    if roll < config.rate_limit_rate + config.error_rate:
+        stats.errors += recipients
+        return {"code": STUB_ERROR_CODE, "msg": "stub error"}
+
+    stats.delivered += recipients
+    return {"code": 0, "msg": "success", "data": {"message_id": f"bm_stub_{stats.sends}", "invalid_open_ids": []}}
+
+@app.get("/_stub/stats")
+async def get_stats():
+    return stats.snapshot()
+
+@app.post("/_stub/reset")
+async def reset_stats():
+    stats.reset()
+    return {"msg": "ok"}
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Feishu Open API stub")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--latency-ms", type=float, default=StubConfig.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=StubConfig.jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate,
+                        help="Fraction of sends answered with a non-retryable error")
+    parser.add_argument("--rate-limit-rate", type=float, default=StubConfig.rate_limit_rate,
+                        help="Fraction of sends answered with the rate limit code")
+    args = parser.parse_args()
+
+    config.latency_ms = args.latency_ms
+    config.jitter_ms = args.jitter_ms
+    config.error_rate = args.error_rate
+    config.rate_limit_rate = args.rate_limit_rate
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
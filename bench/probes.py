@@ -0,0 +1,80 @@
+"""
+Server-side counters sampled before and after a benchmark run.
+
+Postgres: committed + rolled back transactions of the application database and,
+when the pg_stat_statements extension is installed, the number of statements
+executed. Redis: per-command call counts from INFO commandstats (this includes
+the Celery broker traffic, which lives on the same instance).
+"""
+import logging
+from typing import Optional
+import redis.asyncio as redis
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+XACT_SQL = text(
+    "SELECT xact_commit + xact_rollback FROM pg_stat_database WHERE datname = current_database()"
+)
+STATEMENTS_SQL = text(
+    "SELECT sum(s.calls) FROM pg_stat_statements s "
+    "JOIN pg_database d ON d.oid = s.dbid WHERE d.datname = current_database()"
+)
+
+class Probes:
+    def __init__(self):
+        self.engine = create_async_engine(settings.SQLALCHEMY_DATABASE_URI, pool_size=1, max_overflow=0)
+        self.redis = redis.from_url(settings.REDIS_URL, decode_responses=True)
+        self.has_statements = True
+
+    async def _db_counters(self) -> dict:
+        async with self.engine.connect() as conn:
+            # pg_stat_database is refreshed once per transaction; read it fresh
+            await conn.execute(text("SELECT pg_stat_clear_snapshot()"))
+            xacts = (await conn.execute(XACT_SQL)).scalar()
+            statements: Optional[int] = None
+            if self.has_statements:
+                try:
+                    statements = (await conn.execute(STATEMENTS_SQL)).scalar()
+                except Exception:
+                    logger.info("pg_stat_statements not available, reporting transactions only")
+                    self.has_statements = False
+        return {"transactions": int(xacts or 0), "statements": None if statements is None else int(statements)}
+
+    async def _redis_counters(self) -> dict:
+        info = await self.redis.info("commandstats")
+        # Keys look like "cmdstat_get": {"calls": 12, ...}
+        return {name.split("_", 1)[1]: int(values["calls"]) for name, values in info.items()}
+
+    async def sample(self) -> dict:
+        return {"db": await self._db_counters(), "redis": await self._redis_counters()}
+
+    @staticmethod
+    def diff(before: dict, after: dict, messages: int) -> dict:
+        per = max(messages, 1)
+
+        db = {"transactions": after["db"]["transactions"] - before["db"]["transactions"], "statements": None}
+        if after["db"]["statements"] is not None and before["db"]["statements"] is not None:
+            db["statements"] = after["db"]["statements"] - before["db"]["statements"]
+        db["transactions_per_message"] = round(db["transactions"] / per, 3)
+        if db["statements"] is not None:
+            db["statements_per_message"] = round(db["statements"] / per, 3)
+
+        by_command = {}
+        for name, calls in after["redis"].items():
+            delta = calls - before["redis"].get(name, 0)
+            if delta > 0:
+                by_command[name] = delta
+        total = sum(by_command.values())
+        redis_stats = {
+            "commands": total,
+            "commands_per_message": round(total / per, 3),
+            "by_command": dict(sorted(by_command.items(), key=lambda kv: kv[1], reverse=True)),
+        }
+        return {"db": db, "redis": redis_stats}
+
+    async def close(self):
+        await self.redis.aclose()
+        await self.engine.dispose()
@@ -0,0 +1,263 @@
+"""
+Load driver for the end-to-end benchmark.
+
+Drives a running API (and its workers) against the Feishu stub and prints a
+JSON report: request throughput and p50/p99 latency, delivery throughput and
+enqueue-to-delivery p50/p99 as seen by the stub, and DB/Redis round trips per
+message. Scenarios:
+
+    send        POST /api/v1/messages/send, one message per request
+    send_batch  POST /api/v1/messages/send_batch, --batch-size messages per request
+    webhook     POST /api/v1/webhooks/feishu, --duplicate-ratio of them redelivered
+    heartbeat   POST /api/v1/monitor/heartbeat/{id}, or /heartbeats with --batch-size > 1
+
+Example:
+
+    python -m bench.feishu_stub --port 9999 &
+    python -m bench.run --scenario send --messages 5000 --concurrency 100 --output bench_output.txt
+
+Each run appends one JSON line to --output, so results of several runs can be
+compared with jq or loaded into a dataframe.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+from typing import Optional
+import httpx
+from bench.probes import Probes
+
+logger = logging.getLogger(__name__)
+
+SCENARIOS = ("send", "send_batch", "webhook", "heartbeat")
+
+def percentiles(values: list[float]) -> dict:
+    """p50/p90/p99/max of latencies in seconds, reported in milliseconds."""
+    if not values:
+        return {"p50": None, "p90": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))] * 1000, 2)
+
+    return {"p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99), "max": round(ordered[-1] * 1000, 2)}
+
+class LoadDriver:
+    def __init__(self, args):
+        self.args = args
+        self.client = httpx.AsyncClient(
+            base_url=args.api,
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency),
+        )
+        self.latencies: list[float] = []
+        self.status_counts: dict[str, int] = {}
+        self.errors = 0
+        self.accepted = 0
+
+    def _message(self, i: int) -> dict:
+        return {
+            "recipient_id": f"{self.args.recipient_prefix}{i % self.args.recipients}",
+            "recipient_type": "feishu_user",
+            "msg_type": "text",
+            "sender": "Bench",
+            "priority": self.args.priority,
+            # Stamped so the stub can measure enqueue-to-delivery time
+            "content": {"text": f"bench message {i}", "bench_sent_at": time.time()},
+        }
+
+    def _webhook_event(self, i: int) -> dict:
+        event_id = f"bench-{self.args.run_id}-{i}"
+        return {
+            "schema": "2.0",
+            "header": {"event_id": event_id, "event_type": "im.message.receive_v1", "create_time": str(int(time.time() * 1000))},
+            "event": {
+                "sender": {"sender_id": {"open_id": f"ou_bench_{i % self.args.recipients}"}},
+                "message": {
+                    "message_id": f"om_{event_id}",
+                    "chat_id": "oc_bench",
+                    "message_type": "text",
+                    "content": json.dumps({"text": f"bench event {i}"}),
+                },
+            },
+        }
+
+    def _requests(self):
+        """
+        Yield (method, path, json body, number of units in the request).
+        Bodies are built lazily, so bench_sent_at is stamped right before sending.
+        """
+        args = self.args
+        n = args.messages
+        if args.scenario == "send":
+            for i in range(n):
+                yield "POST", "/api/v1/messages/send", self._message(i), 1
+        elif args.scenario == "send_batch":
+            for start in range(0, n, args.batch_size):
+                batch = [self._message(i) for i in range(start, min(n, start + args.batch_size))]
+                yield "POST", "/api/v1/messages/send_batch", {"messages": batch}, len(batch)
+        elif args.scenario == "webhook":
+            for i in range(n):
+                # Redeliver an earlier event the way Feishu retries unacknowledged ones
+                if i and random.random() < args.duplicate_ratio:
+                    yield "POST", "/api/v1/webhooks/feishu", self._webhook_event(random.randrange(i)), 1
+                else:
+                    yield "POST", "/api/v1/webhooks/feishu", self._webhook_event(i), 1
+        elif args.scenario == "heartbeat":
+            if args.batch_size > 1:
+                for start in range(0, n, args.batch_size):
+                    ids = [f"bench-system-{i % args.recipients}" for i in range(start, min(n, start + args.batch_size))]
+                    yield "POST", "/api/v1/monitor/heartbeats", {"system_ids": ids}, len(ids)
+            else:
+                for i in range(n):
+                    yield "POST", f"/api/v1/monitor/heartbeat/bench-system-{i % args.recipients}", None, 1
+
+    async def _worker(self, pending):
+        while True:
+            try:
+                method, path, body, units = next(pending)
+            except StopIteration:
+                return
+            started = time.perf_counter()
+            try:
+                response = await self.client.request(method, path, json=body)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                logger.warning(f"Request failed: {e}")
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            self.latencies.append(elapsed)
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            if status.startswith("2"):
+                self.accepted += units
+            else:
+                self.errors += 1
+
+    async def drive(self) -> dict:
+        pending = iter(self._requests())
+        started = time.perf_counter()
+        await asyncio.gather(*(self._worker(pending) for _ in range(self.args.concurrency)))
+        duration = time.perf_counter() - started
+        return {
+            "count": len(self.latencies),
+            "errors": self.errors,
+            "accepted_units": self.accepted,
+            "status_counts": self.status_counts,
+            "duration_s": round(duration, 3),
+            "throughput_rps": round(len(self.latencies) / duration, 1) if duration else None,
+            "throughput_units_per_s": round(self.args.messages / duration, 1) if duration else None,
+            "latency_ms": percentiles(self.latencies),
+        }
+
+    async def close(self):
+        await self.client.aclose()
+
+async def _stub_stats(stub: httpx.AsyncClient) -> dict:
+    return (await stub.get("/_stub/stats")).json()
+
+async def wait_for_delivery(stub: httpx.AsyncClient, expected: int, timeout: float, started: float) -> dict:
+    """
+    Poll the stub until every accepted message got a final answer (or timeout).
+    Rate-limited sends are retried by the workers, so they are not final.
+    """
+    stats = await _stub_stats(stub)
+    deadline = time.monotonic() + timeout
+    while stats["delivered"] + stats["errors"] < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+        stats = await _stub_stats(stub)
+
+    duration = time.perf_counter() - started
+    return {
+        "expected": expected,
+        "sends": stats["sends"],
+        "delivered": stats["delivered"],
+        "errors": stats["errors"],
+        "rate_limited": stats["rate_limited"],
+        "tokens_issued": stats["tokens"],
+        "complete": stats["delivered"] + stats["errors"] >= expected,
+        "duration_s": round(duration, 3),
+        "throughput_mps": round(stats["delivered"] / duration, 1) if duration else None,
+        "latency_ms": percentiles(stats["delays"]),
+    }
+
+async def run(args) -> dict:
+    probes = Probes()
+    driver = LoadDriver(args)
+    stub: Optional[httpx.AsyncClient] = None
+    delivers = args.scenario in ("send", "send_batch")
+    try:
+        if delivers:
+            stub = httpx.AsyncClient(base_url=args.stub, timeout=10.0)
+            await stub.post("/_stub/reset")
+
+        before = await probes.sample()
+        started = time.perf_counter()
+        requests_report = await driver.drive()
+
+        delivery = None
+        if delivers:
+            delivery = await wait_for_delivery(stub, driver.accepted, args.drain_timeout, started)
+        elif args.settle:
+            # Let the workers finish the webhook tasks before sampling
+            await asyncio.sleep(args.settle)
+
+        after = await probes.sample()
+    finally:
+        await driver.close()
+        if stub is not None:
+            await stub.aclose()
+        await probes.close()
+
+    return {
+        "run_id": args.run_id,
+        "scenario": args.scenario,
+        "timestamp": time.time(),
+        "config": {
+            "messages": args.messages,
+            "concurrency": args.concurrency,
+            "batch_size": args.batch_size,
+            "recipients": args.recipients,
+            "priority": args.priority,
+            "duplicate_ratio": args.duplicate_ratio,
+        },
+        "requests": requests_report,
+        "delivery": delivery,
+        **Probes.diff(before, after, args.messages),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load driver")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="send")
+    parser.add_argument("--api", default="http://127.0.0.1:8000")
+    parser.add_argument("--stub", default="http://127.0.0.1:9999")
+    parser.add_argument("--messages", type=int, default=1000, help="Messages, events or heartbeats to submit")
+    parser.add_argument("--concurrency", type=int, default=50, help="Requests in flight")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="Units per request (send_batch: 100, heartbeat: 1 = single endpoint)")
+    parser.add_argument("--recipients", type=int, default=100, help="Distinct recipients or system ids")
+    parser.add_argument("--recipient-prefix", default="ou_bench_")
+    parser.add_argument("--priority", choices=("high", "normal", "bulk"), default="normal")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1, help="Webhook redeliveries")
+    parser.add_argument("--drain-timeout", type=float, default=300.0, help="Seconds to wait for delivery")
+    parser.add_argument("--settle", type=float, default=2.0, help="Seconds to wait after non-send scenarios")
+    parser.add_argument("--run-id", default=None)
+    parser.add_argument("--output", default=None, help="Append the JSON report to this file")
+    args = parser.parse_args()
+    args.run_id = args.run_id or uuid.uuid4().hex[:12]
+    if args.batch_size is None:
+        args.batch_size = 100 if args.scenario == "send_batch" else 1
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = asyncio.run(run(args))
+
+    line = json.dumps(report, ensure_ascii=False)
+    print(line)
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(line + "\n")
+
+if __name__ == "__main__":
+    main()
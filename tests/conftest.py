@@ -0,0 +1,115 @@
+"""
+Shared test setup.
+
+Redis is replaced by fakeredis (with Lua, so the server-side scripts run as
+they would on Redis) and nothing connects to Postgres: tests patch the
+service calls they need and use FakeSession for AsyncSessionLocal.
+
+    pip install -r requirements-dev.txt
+    pytest
+"""
+import os
+
+# Settings are read on import; nothing connects to these
+os.environ.setdefault("POSTGRES_SERVER", "localhost")
+os.environ.setdefault("POSTGRES_USER", "test")
+os.environ.setdefault("POSTGRES_PASSWORD", "test")
+os.environ.setdefault("POSTGRES_DB", "test")
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("METRICS_ENABLED", "false")
+# Tests that need it turn it on; otherwise every final status would count drained sends in Redis
+os.environ.setdefault("ADMISSION_ENABLED", "false")
+
+from types import SimpleNamespace
+import fakeredis
+import pytest
+from app.core import redis_pool
+from app.services.message_service import MessageService
+
+class FakeSession:
+    """Stands in for AsyncSessionLocal() where the DB calls are patched."""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+@pytest.fixture
+async def redis():
+    """Point get_redis() at an empty fake server for the duration of a test."""
+    client = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer(), decode_responses=True)
+    redis_pool._pool = client.connection_pool
+    yield client
+    redis_pool._pool = None
+    await client.aclose()
+
+class FakeMessages:
+    """
+    In-memory stand-in for the MessageService calls of the send path.
+    Rows are dicts keyed by message id; exceptions put in fail_next are raised
+    by the next transition_status calls.
+    """
+
+    def __init__(self):
+        self.rows: dict[int, dict] = {}
+        self.fail_next: list[Exception] = []
+
+    def add(self, message_id: int, status: str, **values):
+        self.rows[message_id] = {"id": message_id, "status": status, "attempts": 0, **values}
+
+    def status(self, message_id: int) -> str:
+        return self.rows[message_id]["status"]
+
+    async def transition_status(self, db, message_id, expected, status, **values):
+        if self.fail_next:
+            raise self.fail_next.pop(0)
+        expected = [expected] if isinstance(expected, str) else list(expected)
+        row = self.rows.get(message_id)
+        if row is None or row["status"] not in expected:
+            return False
+        row.update(status=status, **values)
+        return True
+
+    async def claim_message(self, db, message_id):
+        row = self.rows.get(message_id)
+        if row is None or row["status"] != "pending":
+            return None
+        row["status"] = "sending"
+        return row["attempts"]
+
+    async def release_deferred(self, db, message_ids):
+        released = []
+        for message_id in message_ids:
+            row = self.rows.get(message_id)
+            if row is not None and row["status"] in ("deferred", "retrying"):
+                row["status"] = "pending"
+                released.append(SimpleNamespace(**row))
+        return released
+
+    async def ids_in_status(self, db, message_ids, statuses):
+        return {i for i in message_ids if i in self.rows and self.rows[i]["status"] in statuses}
+
+    async def overdue_deferred(self, db, overdue_after, limit):
+        # Rows added with overdue=True play the ones whose schedule entry was lost
+        return [
+            message_id for message_id, row in self.rows.items()
+            if row["status"] in ("deferred", "retrying") and row.get("overdue")
+        ][:limit]
+
+@pytest.fixture
+def messages(monkeypatch):
+    """Route the send path's MessageService calls to a FakeMessages store."""
+    from app.worker import tasks
+
+    store = FakeMessages()
+    for name in ("transition_status", "claim_message", "release_deferred", "ids_in_status", "overdue_deferred"):
+        monkeypatch.setattr(MessageService, name, getattr(store, name))
+    monkeypatch.setattr(tasks, "AsyncSessionLocal", FakeSession)
+    return store
@@ -0,0 +1,41 @@
+import time
+import pytest
+from app.core.config import settings
+from app.services.admission import AdmissionController, Overloaded, drained_key
+from app.services.deferred_sends import DEFERRED_KEY
+
+@pytest.fixture(autouse=True)
+def admission(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(settings, "ADMISSION_CACHE_TTL", 0)
+    monkeypatch.setattr(settings, "ADMISSION_NORMAL_WATERMARK", 10)
+    monkeypatch.setattr(settings, "ADMISSION_MAX_RETRY_AFTER", 60)
+    monkeypatch.setattr(settings, "ADMISSION_DRAIN_WINDOW", 10)
+    monkeypatch.setattr(settings, "FEISHU_CIRCUIT_ENABLED", False)
+    monkeypatch.setattr(settings, "MESSAGE_DISPATCH_MODE", "celery")
+    monkeypatch.setattr(AdmissionController, "_checked_at", 0.0)
+
+async def test_retry_after_follows_the_drain_rate(redis):
+    await redis.zadd(DEFERRED_KEY, {str(i): 0 for i in range(110)})
+    # 50 sends finished in the last complete window: 5/s
+    await redis.set(drained_key(int(time.time() // 10) - 1), 50)
+
+    with pytest.raises(Overloaded) as e:
+        await AdmissionController.check(["normal"])
+
+    assert e.value.backlog == 110
+    assert e.value.retry_after == 20
+
+async def test_record_drained_counts_the_current_window(redis):
+    await AdmissionController.record_drained(3)
+    await AdmissionController.record_drained()
+
+    assert await redis.get(drained_key(int(time.time() // 10))) == "4"
+
+async def test_backlog_errors_admit_requests(monkeypatch):
+    async def refresh():
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(AdmissionController, "_refresh", refresh)
+
+    await AdmissionController.check(["bulk"])
@@ -0,0 +1,177 @@
+import json
+from types import SimpleNamespace
+import httpx
+import pytest
+from app.core.config import settings
+from app.services.broadcast_service import BroadcastService
+from app.services.feishu_http import FeishuHttpClient
+from app.services.feishu_token import FeishuTokenProvider
+from app.worker import broadcast
+from app.worker.broadcast import UNKNOWN_OUTCOME_CODE, UNKNOWN_RECIPIENT_CODE
+from tests.conftest import FakeSession
+
+BATCH_SEND_PATH = "/open-apis/message/v4/batch_send/"
+
+@pytest.fixture(autouse=True)
+def no_limits(monkeypatch):
+    monkeypatch.setattr(settings, "FEISHU_CIRCUIT_ENABLED", False)
+    monkeypatch.setattr(settings, "FEISHU_RATE_LIMIT_ENABLED", False)
+    monkeypatch.setattr(settings, "SEND_RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(settings, "BROADCAST_MAX_ATTEMPTS", 3)
+
+def scripted_send(*outcomes):
+    """A send() raising or returning the given outcomes in turn; .calls counts the calls."""
+    outcomes = list(outcomes)
+
+    async def send():
+        send.calls += 1
+        outcome = outcomes.pop(0) if len(outcomes) > 1 else outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    send.calls = 0
+    return send
+
+async def test_connect_errors_are_retried():
+    send = scripted_send(httpx.ConnectError("refused"), {"code": 0})
+    response = await broadcast._call(send, "broadcast:1")
+
+    assert response["code"] == 0
+    assert send.calls == 2
+
+async def test_read_timeouts_are_not_retried():
+    send = scripted_send(httpx.ReadTimeout("timed out"), {"code": 0})
+    response = await broadcast._call(send, "broadcast:1")
+
+    assert response["code"] == UNKNOWN_OUTCOME_CODE
+    assert send.calls == 1
+
+async def test_unknown_exceptions_are_not_retried():
+    send = scripted_send(RuntimeError("boom"), {"code": 0})
+    response = await broadcast._call(send, "broadcast:1")
+
+    assert response["code"] == UNKNOWN_OUTCOME_CODE
+    assert send.calls == 1
+
+async def test_retryable_codes_are_retried_up_to_max_attempts():
+    send = scripted_send({"code": -1})
+    response = await broadcast._call(send, "broadcast:1")
+
+    assert response["code"] == -1
+    assert send.calls == settings.BROADCAST_MAX_ATTEMPTS
+
+async def test_other_codes_are_not_retried():
+    send = scripted_send({"code": 230001}, {"code": 0})
+    response = await broadcast._call(send, "broadcast:1")
+
+    assert response["code"] == 230001
+    assert send.calls == 1
+
+@pytest.fixture
+async def feishu_stub(redis, monkeypatch):
+    """
+    FeishuHttpClient talking to an in-process Feishu stub. Batch sends are
+    answered with the outcomes queued in stub.batch_outcomes (exceptions are
+    raised as transport errors); stub.batch_requests keeps their bodies.
+    """
+    stub = SimpleNamespace(batch_outcomes=[], batch_requests=[])
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/open-apis/auth/v3/tenant_access_token/internal":
+            return httpx.Response(200, json={"code": 0, "tenant_access_token": "t-stub", "expire": 7200})
+        if request.url.path == BATCH_SEND_PATH:
+            stub.batch_requests.append(json.loads(request.content))
+            outcome = stub.batch_outcomes.pop(0)
+            if isinstance(outcome, type) and issubclass(outcome, httpx.TransportError):
+                raise outcome("stub transport error", request=request)
+            return httpx.Response(200, json=outcome)
+        return httpx.Response(404, json={"code": 404, "msg": "not stubbed"})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=settings.FEISHU_BASE_URL)
+    monkeypatch.setattr(FeishuHttpClient, "_client", client)
+    monkeypatch.setattr(FeishuTokenProvider, "_token", None)
+    monkeypatch.setattr(FeishuTokenProvider, "_expires_at", 0.0)
+    monkeypatch.setattr(FeishuTokenProvider, "_checked_at", 0.0)
+    monkeypatch.setattr(FeishuTokenProvider, "_lock", None)
+    monkeypatch.setattr(FeishuTokenProvider, "_refresh_task", None)
+    yield stub
+    await client.aclose()
+
+def open_id_broadcast():
+    target = SimpleNamespace(id=7, recipient_type="feishu_user", msg_type="text", content={"text": "hi"})
+    chunk = [SimpleNamespace(id=1, recipient_id="ou_1"), SimpleNamespace(id=2, recipient_id="ou_2")]
+    return target, chunk
+
+async def test_batch_send_timeout_fails_the_chunk_without_resending(feishu_stub):
+    feishu_stub.batch_outcomes.append(httpx.ReadTimeout)
+    target, chunk = open_id_broadcast()
+
+    results = await broadcast._send_batch(target, chunk)
+
+    assert len(feishu_stub.batch_requests) == 1
+    assert sorted(results, key=lambda r: r["id"]) == [
+        {"id": 1, "status": "failed", "error_code": UNKNOWN_OUTCOME_CODE},
+        {"id": 2, "status": "failed", "error_code": UNKNOWN_OUTCOME_CODE},
+    ]
+
+async def test_batch_send_is_retried_after_a_connect_error(feishu_stub):
+    feishu_stub.batch_outcomes += [
+        httpx.ConnectError,
+        {"code": 0, "data": {"message_id": "bm_1", "invalid_open_ids": ["ou_2"]}},
+    ]
+    target, chunk = open_id_broadcast()
+
+    results = await broadcast._send_batch(target, chunk)
+
+    assert len(feishu_stub.batch_requests) == 2
+    assert sorted(feishu_stub.batch_requests[-1]["open_ids"]) == ["ou_1", "ou_2"]
+    assert sorted(results, key=lambda r: r["id"]) == [
+        {"id": 1, "status": "sent", "feishu_message_id": "bm_1"},
+        {"id": 2, "status": "failed", "error_code": UNKNOWN_RECIPIENT_CODE},
+    ]
+
+async def test_sweep_republishes_unfinished_broadcasts(monkeypatch):
+    async def unfinished_broadcasts(db, pending_after, stale_after, limit):
+        return [3, 4]
+
+    published = []
+    monkeypatch.setattr(broadcast, "AsyncSessionLocal", FakeSession)
+    monkeypatch.setattr(BroadcastService, "unfinished_broadcasts", unfinished_broadcasts)
+    monkeypatch.setattr(broadcast, "enqueue_broadcast", lambda broadcast_id: published.append(broadcast_id))
+
+    await broadcast.sweep_broadcasts()
+
+    assert published == [3, 4]
+
+async def test_unexpected_error_releases_the_broadcast(monkeypatch):
+    calls = []
+
+    async def claim_broadcast(db, broadcast_id, stale_after):
+        return SimpleNamespace(id=broadcast_id, total=2, msg_type="text", recipient_type="feishu_chat")
+
+    async def pending_deliveries(db, broadcast_id, after_id, limit):
+        raise RuntimeError("db hiccup")
+
+    async def release_broadcast(db, broadcast_id, error_log=None):
+        calls.append(("release", broadcast_id, error_log))
+
+    async def finish_broadcast(db, broadcast_id):
+        calls.append(("finish", broadcast_id))
+
+    monkeypatch.setattr(broadcast, "AsyncSessionLocal", FakeSession)
+    monkeypatch.setattr(BroadcastService, "claim_broadcast", claim_broadcast)
+    monkeypatch.setattr(BroadcastService, "pending_deliveries", pending_deliveries)
+    monkeypatch.setattr(BroadcastService, "release_broadcast", release_broadcast)
+    monkeypatch.setattr(BroadcastService, "finish_broadcast", finish_broadcast)
+    monkeypatch.setattr(
+        broadcast, "enqueue_broadcast",
+        lambda broadcast_id, countdown=None: calls.append(("enqueue", broadcast_id, countdown)),
+    )
+
+    await broadcast.process_broadcast(7)
+
+    assert calls[0] == ("release", 7, "Exception: db hiccup")
+    assert calls[1][:2] == ("enqueue", 7)
+    assert calls[1][2] >= settings.BROADCAST_ERROR_RETRY_DELAY
+    assert len(calls) == 2
@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+from app.core.config import settings
+from app.worker import tasks
+from app.services.deferred_sends import DEFERRED_KEY, RESCUE_KEY, defer_send
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    message_ids = []
+    monkeypatch.setattr(tasks, "enqueue_messages", lambda messages: message_ids.extend(m.id for m in messages))
+    return message_ids
+
+async def scheduled(redis) -> set[int]:
+    return {int(member) for member in await redis.zrange(DEFERRED_KEY, 0, -1)}
+
+async def test_defer_parks_the_row_before_scheduling_it(redis, messages, monkeypatch):
+    messages.add(1, "sending")
+    status_when_scheduled = []
+
+    async def recording_defer_send(message_id, delay):
+        status_when_scheduled.append(messages.status(message_id))
+        await defer_send(message_id, delay)
+
+    monkeypatch.setattr(tasks, "defer_send", recording_defer_send)
+    await tasks._defer(None, 1, 5)
+
+    assert status_when_scheduled == ["deferred"]
+    assert messages.rows[1]["next_attempt_at"] is not None
+    assert await scheduled(redis) == {1}
+
+async def test_defer_leaves_rows_that_are_no_longer_sending_alone(redis, messages):
+    messages.add(1, "sent")
+    await tasks._defer(None, 1, 5)
+
+    assert messages.status(1) == "sent"
+    assert await scheduled(redis) == set()
+
+async def test_release_keeps_entries_of_rows_still_in_flight(redis, messages, enqueued):
+    messages.add(1, "deferred")
+    messages.add(2, "sending")   # due entry of a row that is being sent right now
+    messages.add(3, "sent")
+    messages.add(4, "pending")
+    for message_id in (1, 2, 3, 4):
+        await defer_send(message_id, -1)
+    await redis.set(RESCUE_KEY, 1)
+
+    await tasks.release_due_sends()
+
+    assert enqueued == [1]
+    assert messages.status(1) == "pending"
+    assert messages.status(2) == "sending"
+    assert await scheduled(redis) == {2}
+
+async def test_release_stops_when_only_in_flight_entries_are_due(redis, messages, enqueued, monkeypatch):
+    monkeypatch.setattr(settings, "SEND_DEFERRED_BATCH_SIZE", 1)
+    messages.add(2, "sending")
+    await defer_send(2, -1)
+    await redis.set(RESCUE_KEY, 1)
+
+    await asyncio.wait_for(tasks.release_due_sends(), timeout=1)
+
+    assert enqueued == []
+    assert await scheduled(redis) == {2}
+
+async def test_rows_parked_without_an_entry_are_rescheduled(redis, messages, enqueued):
+    messages.add(5, "deferred", overdue=True)
+
+    await tasks.release_due_sends()
+
+    assert enqueued == [5]
+    assert messages.status(5) == "pending"
+    assert await scheduled(redis) == set()
+
+async def test_rescue_runs_once_per_interval(redis, messages, enqueued):
+    await tasks.release_due_sends()
+    messages.add(6, "deferred", overdue=True)
+
+    await tasks.release_due_sends()
+
+    assert enqueued == []
+    assert messages.status(6) == "deferred"
@@ -0,0 +1,170 @@
+from types import SimpleNamespace
+import pytest
+from app.core.config import settings
+from app.services import heartbeat_service
+from app.services.heartbeat_service import (
+    ALERT_PENDING_KEY,
+    ALERT_WINDOW_KEY,
+    DOWN_KEY,
+    FAIL_COUNT_KEY,
+    HEARTBEATS_KEY,
+    LEGACY_SYSTEMS_KEY,
+    HeartbeatService,
+)
+
+NOW = 1_700_000_000
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fixed unix time for the service; move it with clock.now."""
+    clock = SimpleNamespace(now=NOW)
+    monkeypatch.setattr(heartbeat_service, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+@pytest.fixture(autouse=True)
+def thresholds(monkeypatch):
+    monkeypatch.setattr(settings, "MONITOR_HEARTBEAT_TIMEOUT", 180)
+    monkeypatch.setattr(settings, "MONITOR_FAIL_THRESHOLD", 3)
+    monkeypatch.setattr(settings, "MONITOR_RECOVER_THRESHOLD", 2)
+
+async def test_migrate_legacy_moves_the_old_keys(redis, clock):
+    await redis.sadd(LEGACY_SYSTEMS_KEY, "alive", "failing", "down", "silent", "newer")
+    await redis.set("SystemA_Heartbeat:alive", NOW - 10)
+    await redis.set("SystemA_Heartbeat:failing", NOW - 400)
+    await redis.set("Monitor_Fail_Count:failing", 2)
+    await redis.set("SystemA_Heartbeat:down", NOW - 4000)
+    await redis.set("Monitor_Fail_Count:down", 5)
+    await redis.set("Monitor_Status:down", "DOWN")
+    await redis.set("SystemA_Heartbeat:newer", NOW - 600)
+    # Already reported through the new endpoint after the upgrade
+    await redis.zadd(HEARTBEATS_KEY, {"newer": NOW})
+
+    assert await HeartbeatService.migrate_legacy() == 5
+
+    assert dict(await redis.zrange(HEARTBEATS_KEY, 0, -1, withscores=True)) == {
+        "alive": NOW - 10,
+        "failing": NOW - 400,
+        "down": NOW - 4000,
+        "silent": 0,
+        "newer": NOW,
+    }
+    assert await redis.hgetall(FAIL_COUNT_KEY) == {"failing": "2", "down": "5"}
+    assert await redis.smembers(DOWN_KEY) == {"down"}
+    assert await redis.keys("SystemA_Heartbeat:*") == []
+    assert await redis.keys("Monitor_Status:*") == []
+    assert await redis.keys("Monitor_Fail_Count:*") == []
+    assert not await redis.exists(LEGACY_SYSTEMS_KEY)
+
+async def test_migrate_legacy_works_in_batches(redis, clock, monkeypatch):
+    monkeypatch.setattr(heartbeat_service, "LEGACY_MIGRATE_BATCH", 2)
+    await redis.sadd(LEGACY_SYSTEMS_KEY, *(f"sys{i}" for i in range(5)))
+
+    assert await HeartbeatService.migrate_legacy() == 5
+    assert await redis.zcard(HEARTBEATS_KEY) == 5
+    assert await HeartbeatService.migrate_legacy() == 0
+
+async def test_system_goes_down_after_fail_threshold(redis, clock):
+    await redis.zadd(HEARTBEATS_KEY, {"stale": NOW - 200, "fresh": NOW})
+
+    for _ in range(settings.MONITOR_FAIL_THRESHOLD - 1):
+        assert await HeartbeatService.check_timeouts() == ([], [])
+    assert await HeartbeatService.check_timeouts() == (["stale"], [])
+    # Reported once, not on every further cycle
+    assert await HeartbeatService.check_timeouts() == ([], [])
+    assert await redis.smembers(DOWN_KEY) == {"stale"}
+
+async def test_fail_count_resets_on_a_heartbeat(redis, clock):
+    await redis.zadd(HEARTBEATS_KEY, {"flaky": NOW - 200})
+    for _ in range(settings.MONITOR_FAIL_THRESHOLD - 1):
+        await HeartbeatService.check_timeouts()
+
+    await redis.zadd(HEARTBEATS_KEY, {"flaky": NOW})
+    assert await HeartbeatService.check_timeouts() == ([], [])
+    assert await redis.hgetall(FAIL_COUNT_KEY) == {}
+
+    await redis.zadd(HEARTBEATS_KEY, {"flaky": NOW - 200})
+    for _ in range(settings.MONITOR_FAIL_THRESHOLD - 1):
+        assert await HeartbeatService.check_timeouts() == ([], [])
+
+async def test_down_system_recovers_after_recover_threshold(redis, clock):
+    await redis.zadd(HEARTBEATS_KEY, {"sys": NOW - 200})
+    for _ in range(settings.MONITOR_FAIL_THRESHOLD):
+        await HeartbeatService.check_timeouts()
+    await redis.zadd(HEARTBEATS_KEY, {"sys": NOW})
+
+    for _ in range(settings.MONITOR_RECOVER_THRESHOLD - 1):
+        assert await HeartbeatService.check_timeouts() == ([], [])
+    assert await HeartbeatService.check_timeouts() == ([], ["sys"])
+    assert await redis.smembers(DOWN_KEY) == set()
+
+async def test_flapping_system_stays_down(redis, clock):
+    await redis.zadd(HEARTBEATS_KEY, {"sys": NOW - 200})
+    for _ in range(settings.MONITOR_FAIL_THRESHOLD):
+        await HeartbeatService.check_timeouts()
+
+    # Healthy, timed out, healthy again: the recover count starts over
+    await redis.zadd(HEARTBEATS_KEY, {"sys": NOW})
+    assert await HeartbeatService.check_timeouts() == ([], [])
+    await redis.zadd(HEARTBEATS_KEY, {"sys": NOW - 200})
+    assert await HeartbeatService.check_timeouts() == ([], [])
+    await redis.zadd(HEARTBEATS_KEY, {"sys": NOW})
+    for _ in range(settings.MONITOR_RECOVER_THRESHOLD - 1):
+        assert await HeartbeatService.check_timeouts() == ([], [])
+    assert await HeartbeatService.check_timeouts() == ([], ["sys"])
+
+async def test_alert_stays_pending_until_acked(redis, clock, monkeypatch):
+    monkeypatch.setattr(settings, "MONITOR_ALERT_WINDOW", 0)
+
+    assert await HeartbeatService.collect_alerts(["b", "a"], ["c"]) == (["a", "b"], ["c"])
+    # Not stored yet (e.g. the DB was down): the next cycle hands it out again
+    assert await HeartbeatService.collect_alerts([], []) == (["a", "b"], ["c"])
+
+    await HeartbeatService.ack_alerts(["a", "b"], ["c"])
+    assert await HeartbeatService.collect_alerts([], []) == ([], [])
+    assert not await redis.exists(ALERT_PENDING_KEY, ALERT_WINDOW_KEY)
+
+async def test_alert_is_held_for_the_window(redis, clock, monkeypatch):
+    monkeypatch.setattr(settings, "MONITOR_ALERT_WINDOW", 60)
+
+    assert await HeartbeatService.collect_alerts(["a"], []) == ([], [])
+    clock.now += 30
+    assert await HeartbeatService.collect_alerts(["b"], []) == ([], [])
+    clock.now += 30
+    assert await HeartbeatService.collect_alerts([], []) == (["a", "b"], [])
+
+async def test_down_and_up_within_a_window_cancel_out(redis, clock, monkeypatch):
+    monkeypatch.setattr(settings, "MONITOR_ALERT_WINDOW", 60)
+
+    await HeartbeatService.collect_alerts(["a", "b"], [])
+    await HeartbeatService.collect_alerts([], ["a"])
+    clock.now += 60
+    assert await HeartbeatService.collect_alerts([], []) == (["b"], [])
+
+async def test_ack_keeps_transitions_seen_after_the_alert(redis, clock, monkeypatch):
+    monkeypatch.setattr(settings, "MONITOR_ALERT_WINDOW", 60)
+    await HeartbeatService.collect_alerts(["a", "b"], [])
+    clock.now += 60
+    down, up = await HeartbeatService.collect_alerts([], [])
+    assert (down, up) == (["a", "b"], [])
+
+    # While the card was being stored: b recovered, c went down
+    await HeartbeatService.collect_alerts(["c"], ["b"])
+    await HeartbeatService.ack_alerts(down, up)
+
+    # b's DOWN is already reported, so its recovery is not cancelled against it
+    assert await redis.hgetall(ALERT_PENDING_KEY) == {"b": "UP", "c": "DOWN"}
+    # The leftovers start a new window
+    assert await redis.get(ALERT_WINDOW_KEY) == str(clock.now)
+    assert await HeartbeatService.collect_alerts([], []) == ([], [])
+    clock.now += 60
+    assert await HeartbeatService.collect_alerts([], []) == (["c"], ["b"])
+
+async def test_unreported_transitions_still_cancel_after_an_ack(redis, clock, monkeypatch):
+    monkeypatch.setattr(settings, "MONITOR_ALERT_WINDOW", 0)
+    down, up = await HeartbeatService.collect_alerts(["a"], [])
+    await HeartbeatService.ack_alerts(down, up)
+
+    monkeypatch.setattr(settings, "MONITOR_ALERT_WINDOW", 60)
+    await HeartbeatService.collect_alerts([], ["a"])
+    await HeartbeatService.collect_alerts(["a"], [])
+    assert not await redis.exists(ALERT_PENDING_KEY)
@@ -0,0 +1,46 @@
+from collections import OrderedDict
+from types import SimpleNamespace
+import pytest
+from app.core.config import settings
+from app.services.recipient_resolver import RecipientLookupUnavailable, RecipientResolver
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """Feishu batch lookups answered from lookups.users; lookups.error fails them instead."""
+    lookups = SimpleNamespace(users={}, error=None, calls=0)
+
+    async def lookup(kind, values):
+        lookups.calls += 1
+        if lookups.error is not None:
+            raise lookups.error
+        return {value: lookups.users[value] for value in values if value in lookups.users}
+
+    monkeypatch.setattr(RecipientResolver, "_lookup", staticmethod(lookup))
+    monkeypatch.setattr(RecipientResolver, "_local", OrderedDict())
+    monkeypatch.setattr(settings, "FEISHU_APP_ID", "cli_test")
+    return lookups
+
+async def test_open_ids_are_cached_per_app(redis, lookups):
+    lookups.users["a@example.com"] = "ou_a"
+
+    assert await RecipientResolver.resolve_many("email", ["A@example.com"]) == {"a@example.com": "ou_a"}
+
+    assert await redis.get("Feishu_Recipient:cli_test:email:a@example.com") == "ou_a"
+    assert await redis.keys("Feishu_Recipient:email:*") == []
+
+async def test_failed_lookup_is_not_repeated_within_the_error_ttl(redis, lookups):
+    lookups.error = RuntimeError("batch_get_id failed: code=99991672, msg=no permission")
+
+    with pytest.raises(RuntimeError):
+        await RecipientResolver.resolve_many("email", ["a@example.com"])
+    with pytest.raises(RecipientLookupUnavailable):
+        await RecipientResolver.resolve_many("email", ["b@example.com"])
+    # Sends go out as-is without asking Feishu again
+    assert await RecipientResolver.resolve_recipient("c@example.com", "email") == ("c@example.com", "email")
+
+    assert lookups.calls == 1
+    assert 0 < await redis.ttl("Feishu_Recipient_Unavailable:cli_test:email") <= settings.FEISHU_RECIPIENT_ERROR_TTL
+    # Other kinds are still looked up
+    lookups.error = None
+    lookups.users["u1"] = "ou_1"
+    assert await RecipientResolver.resolve_many("user_id", ["u1"]) == {"u1": "ou_1"}
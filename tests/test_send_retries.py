@@ -0,0 +1,134 @@
+from types import SimpleNamespace
+import httpx
+import pytest
+from app.core.config import settings
+from app.services.circuit_breaker import FeishuCircuitBreaker
+from app.services.feishu_service import FeishuService
+from app.worker import tasks
+from app.services.deferred_sends import DEFERRED_KEY, defer_send
+from app.worker.status_writer import StatusWriteFailed
+
+SENT = {"code": 0, "msg": "success", "data": {"message_id": "om_1"}}
+
+@pytest.fixture
+def feishu(monkeypatch):
+    """
+    Answers sends with the responses queued in feishu.responses, SENT once
+    they run out. Queued exceptions are raised as the transport would.
+    """
+    feishu = SimpleNamespace(responses=[], calls=0)
+
+    async def send_message(*args, raise_errors=False):
+        feishu.calls += 1
+        response = feishu.responses.pop(0) if feishu.responses else SENT
+        if isinstance(response, Exception):
+            if not raise_errors:
+                return {"code": -1, "msg": str(response)}
+            raise response
+        return response
+
+    monkeypatch.setattr(FeishuService, "send_message", send_message)
+    monkeypatch.setattr(settings, "FEISHU_CIRCUIT_ENABLED", False)
+    monkeypatch.setattr(settings, "FEISHU_RATE_LIMIT_ENABLED", False)
+    monkeypatch.setattr(settings, "FEISHU_RESOLVE_RECIPIENTS", False)
+    return feishu
+
+async def scheduled(redis) -> set[int]:
+    return {int(member) for member in await redis.zrange(DEFERRED_KEY, 0, -1)}
+
+async def send(message_id: int, writer=None):
+    await tasks.process_send(message_id, "oc_chat", "feishu_chat", "text", {"text": "hi"}, writer=writer)
+
+async def test_retry_parks_the_row_before_scheduling_it(redis, messages, monkeypatch):
+    messages.add(1, "sending")
+    status_when_scheduled = []
+
+    async def recording_defer_send(message_id, delay):
+        status_when_scheduled.append(messages.status(message_id))
+        await defer_send(message_id, delay)
+
+    monkeypatch.setattr(tasks, "defer_send", recording_defer_send)
+    await tasks._retry_or_dead_letter(None, 1, 0, "Feishu Error")
+
+    assert status_when_scheduled == ["retrying"]
+    assert messages.rows[1]["attempts"] == 1
+    assert await scheduled(redis) == {1}
+
+async def test_last_attempt_is_dead_lettered(redis, messages):
+    messages.add(1, "sending")
+    await tasks._retry_or_dead_letter(None, 1, settings.SEND_MAX_ATTEMPTS - 1, "Feishu Error")
+
+    assert messages.status(1) == "dead"
+    assert await scheduled(redis) == set()
+
+async def test_retryable_failure_is_retried(redis, messages, feishu):
+    messages.add(1, "pending")
+    feishu.responses.append({"code": -1, "msg": "timeout"})
+
+    await send(1)
+
+    assert messages.status(1) == "retrying"
+    assert await scheduled(redis) == {1}
+
+async def test_connect_error_is_retried(redis, messages, feishu):
+    messages.add(1, "pending")
+    feishu.responses.append(httpx.ConnectError("refused"))
+
+    await send(1)
+
+    assert messages.status(1) == "retrying"
+    assert await scheduled(redis) == {1}
+
+async def test_send_with_unknown_outcome_is_not_retried(redis, messages, feishu):
+    messages.add(1, "pending")
+    # The request was written; Feishu may have delivered it
+    feishu.responses.append(httpx.ReadTimeout("timed out"))
+
+    await send(1)
+
+    assert feishu.calls == 1
+    assert messages.status(1) == "failed"
+    assert messages.rows[1]["error_log"].startswith("Outcome unknown")
+    assert await scheduled(redis) == set()
+
+async def test_accepted_send_is_not_retried_when_recording_fails(redis, messages, feishu):
+    messages.add(1, "pending")
+    messages.fail_next.append(RuntimeError("db down"))
+
+    await send(1)
+
+    assert feishu.calls == 1
+    assert messages.status(1) == "sent"
+    assert messages.rows[1]["feishu_message_id"] == "om_1"
+    assert await scheduled(redis) == set()
+
+async def test_accepted_send_is_not_retried_when_bookkeeping_fails(redis, messages, feishu, monkeypatch):
+    async def allow():
+        pass
+
+    async def record(failed, duration):
+        raise RuntimeError("redis down")
+
+    monkeypatch.setattr(settings, "FEISHU_CIRCUIT_ENABLED", True)
+    monkeypatch.setattr(FeishuCircuitBreaker, "allow", allow)
+    monkeypatch.setattr(FeishuCircuitBreaker, "record", record)
+    messages.add(1, "pending")
+
+    await send(1)
+
+    assert feishu.calls == 1
+    assert messages.status(1) == "sent"
+    assert await scheduled(redis) == set()
+
+async def test_unwritten_status_reaches_the_caller(redis, messages, feishu):
+    class FailingWriter:
+        async def add(self, *args, **kwargs):
+            raise StatusWriteFailed("db down")
+
+    messages.add(1, "pending")
+
+    with pytest.raises(StatusWriteFailed):
+        await send(1, writer=FailingWriter())
+
+    assert messages.status(1) == "sending"
+    assert await scheduled(redis) == set()
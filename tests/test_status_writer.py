@@ -0,0 +1,93 @@
+import asyncio
+import concurrent.futures
+import queue
+from types import SimpleNamespace
+import pytest
+from app.core.config import settings
+from app.services.message_service import MessageService
+from app.worker import status_writer
+from app.worker.send_consumer import SendConsumer
+from app.worker.status_writer import StatusWriter, StatusWriteFailed
+from tests.conftest import FakeSession
+
+@pytest.fixture
+def db(monkeypatch):
+    """Records the ids of every bulk write; exceptions put in failures fail the next writes."""
+    db = SimpleNamespace(writes=[], failures=[])
+
+    async def bulk_transition_status(session, expected, results):
+        if db.failures:
+            raise db.failures.pop(0)
+        db.writes.append([result["id"] for result in results])
+
+    monkeypatch.setattr(status_writer, "AsyncSessionLocal", FakeSession)
+    monkeypatch.setattr(MessageService, "bulk_transition_status", staticmethod(bulk_transition_status))
+    monkeypatch.setattr(settings, "STATUS_FLUSH_RETRY_DELAY_MS", 10)
+    return db
+
+async def test_add_returns_once_flushed(db):
+    writer = StatusWriter(flush_interval_ms=10)
+    await writer.start()
+    await asyncio.wait_for(asyncio.gather(writer.add(1, "sent"), writer.add(2, "failed")), timeout=2)
+    await writer.close()
+
+    assert db.writes == [[1, 2]]
+
+def test_explicit_zero_limits_are_kept():
+    writer = StatusWriter(flush_interval_ms=0, max_rows=0)
+
+    assert (writer.flush_interval, writer.max_rows) == (0, 0)
+    assert StatusWriter().max_rows == settings.STATUS_FLUSH_MAX_ROWS
+
+async def test_failed_flush_is_written_again(db):
+    db.failures.append(RuntimeError("db down"))
+    writer = StatusWriter(flush_interval_ms=10)
+    await writer.start()
+
+    # add() keeps waiting through the failed flush instead of raising
+    await asyncio.wait_for(writer.add(1, "sent", feishu_message_id="om_1"), timeout=2)
+    await writer.close()
+
+    assert db.writes == [[1]]
+
+async def test_unwritten_results_fail_on_close(db):
+    db.failures.extend(RuntimeError("db down") for _ in range(100))
+    writer = StatusWriter(flush_interval_ms=10000)
+    await writer.start()
+
+    pending = asyncio.create_task(writer.add(1, "sent"))
+    await asyncio.sleep(0)
+    await writer.close()
+
+    with pytest.raises(StatusWriteFailed):
+        await pending
+    assert db.writes == []
+
+class FakeBrokerMessage:
+    def __init__(self):
+        self.acked = False
+        self.requeued = None
+
+    def ack(self):
+        self.acked = True
+
+    def reject(self, requeue=False):
+        self.requeued = requeue
+
+def test_consumer_requeues_messages_whose_status_was_not_written():
+    consumer = SendConsumer(["send_queue"], concurrency=1)
+    consumer._acks = queue.SimpleQueue()
+
+    done, failed = concurrent.futures.Future(), concurrent.futures.Future()
+    done.set_result(None)
+    failed.set_exception(StatusWriteFailed("db down"))
+    done_message, failed_message = FakeBrokerMessage(), FakeBrokerMessage()
+    consumer._inflight = {done, failed}
+    consumer._acks.put((done, done_message))
+    consumer._acks.put((failed, failed_message))
+
+    consumer._drain_acks()
+
+    assert done_message.acked and done_message.requeued is None
+    assert not failed_message.acked and failed_message.requeued is True
+    assert consumer._inflight == set()